@@ -0,0 +1,65 @@
+"""
+Compare wall time of the figure-building callbacks run serially and on the
+parallel.py worker pool, and check that both produce the same figures.
+
+    python benchmarks/bench_parallel.py [--splits 200000] [--accounts 500] [--workers 1 2 4] [--repeat 3]
+"""
+import argparse
+import json
+import tempfile
+import time
+from typing import Callable, List
+
+import synthetic
+
+import index  # NOQA: registers the callbacks
+import parallel
+from plotly.utils import PlotlyJSONEncoder
+from apps import balance_sheet, cash_flow
+from ledger import ledger_from_json_store
+
+
+def best_ms(function: Callable, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main(splits: int, accounts: int, workers: List[int], repeat: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        data_store = synthetic.load_synthetic(directory, n_splits=splits, n_accounts=accounts)
+
+    ledger = ledger_from_json_store(data_store)
+    # the computations behind the callbacks, bypassing the ledger's result cache
+    callbacks = {
+        'time series (Month)': lambda: cash_flow.time_series_base(ledger, 4),
+        'balance sheet (Month)': lambda: balance_sheet.bs_figures(ledger, 4),
+    }
+    print(f'{splits:,d} splits, {accounts:,d} accounts; best of {repeat}\n')
+    print(f'{"callback":24} ' + ' '.join(f'{f"{w} workers ms":>14}' for w in workers))
+    for name, callback in callbacks.items():
+        expected = None
+        times = []
+        for count in workers:
+            parallel.WORKERS = count
+            if parallel._pool is not None:
+                parallel._pool.shutdown()
+                parallel._pool = None
+            result = json.dumps(callback(), cls=PlotlyJSONEncoder)
+            expected = expected or result
+            assert result == expected, f'{name}: {count} workers changed the result'
+            times.append(best_ms(callback, repeat))
+        print(f'{name:24} ' + ' '.join(f'{x:14,.0f}' for x in times))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--splits', type=int, default=200_000)
+    parser.add_argument('--accounts', type=int, default=500)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    main(args.splits, args.accounts, args.workers, args.repeat)
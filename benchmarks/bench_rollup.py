@@ -0,0 +1,73 @@
+"""
+Compare wall time of whole-ledger aggregates (monthly totals, subtree
+totals and running balances) computed serially, as the backend does, and
+by rollup.py on 1 to N worker processes, partitioned by account subtree
+and by time, and check that they all agree.
+
+    python benchmarks/bench_rollup.py [--splits 500000] [--accounts 2000] [--workers 1 2 4 8] [--repeat 3]
+
+The worker processes are started before timing, as they are kept between
+rollups in the server.
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable, List
+
+import numpy as np
+
+import synthetic
+
+from ledger import ledger_from_json_store
+from rollup import PARTITIONS, rollup
+from utils import subtree_totals
+
+
+def best_ms(function: Callable, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main(splits: int, accounts: int, workers: List[int], repeat: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        data_store = synthetic.load_synthetic(directory, n_splits=splits, n_accounts=accounts)
+    ledger = ledger_from_json_store(data_store)
+    trans = ledger.backend.trans
+
+    def serial():
+        backend = type(ledger.backend)(trans)  # without the indexes built so far
+        totals = backend.account_totals()
+        return subtree_totals(totals, ledger.account_tree), backend.running
+
+    expected_totals, running = serial()
+    expected_balances = np.empty(len(trans), dtype=trans['amount'].dtype)
+    for rows, dates, balances in running.values():
+        expected_balances[rows] = balances[1:]
+
+    print(f'{splits:,d} splits, {accounts:,d} accounts, {os.cpu_count()} CPUs; best of {repeat}\n')
+    print(f'{"serial (backend)":24} {best_ms(serial, repeat):10,.0f} ms')
+    print(f'\n{"rollup by":24} ' + ' '.join(f'{f"{w} workers ms":>14}' for w in workers))
+    for by in PARTITIONS:
+        times = []
+        for count in workers:
+            result = rollup(trans, by, count)  # and starts the worker processes
+            assert (result.balances == expected_balances).all(), f'{by}, {count} workers: balances differ'
+            assert result.summary(ledger.account_tree)['subtotal'].equals(expected_totals['subtotal']), \
+                f'{by}, {count} workers: subtree totals differ'
+            times.append(best_ms(lambda: rollup(trans, by, count), repeat))
+        print(f'{by:24} ' + ' '.join(f'{x:14,.0f}' for x in times))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--splits', type=int, default=500_000)
+    parser.add_argument('--accounts', type=int, default=2000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    main(args.splits, args.accounts, args.workers, args.repeat)
@@ -0,0 +1,98 @@
+"""
+Compare callback response encoding: Plotly's JSON encoder versus
+serialization.FastPlotlyJSONEncoder, and the bytes on the wire with no
+compression, gzip, and brotli.
+
+    python benchmarks/bench_serialization.py [--splits 200000] [--accounts 500] [--repeat 5]
+
+Each payload is what one callback returns for a synthetic ledger, wrapped
+the way Dash wraps callback responses.
+"""
+import argparse
+import gzip
+import json
+import tempfile
+import time
+from typing import Callable, Dict
+
+import synthetic
+
+import index  # NOQA: registers the callbacks and installs the serialization pipeline
+from _plotly_utils.utils import PlotlyJSONEncoder
+import figures
+import serialization
+from apps import balance_sheet, cash_flow
+from ledger import ledger_from_json_store
+from utils import chart_template, get_children, get_descendents, make_bar, make_cum_area, make_sunburst, table_records
+
+
+def payloads(data_store: str) -> Dict[str, dict]:
+    """ Build one response per expensive callback, the way Dash would send it. """
+    ledger = ledger_from_json_store(data_store)
+    result = {}
+
+    source, eras, account_tree, earliest, latest = ledger.view(cash_flow.ACCOUNTS)
+    result['time series (Month)'] = figures.figure(
+        [make_bar(source, account_tree, eras, account, i, 4, False, deep=True)
+         for i, account in enumerate(get_children(account_tree.root, account_tree))],
+        chart_template())
+
+    result['sunburst'] = make_sunburst(source.account_totals(), earliest, latest, ' [Subtotal]', True)
+    result['transaction table'] = table_records(source.rows())
+
+    source, eras, account_tree, earliest, latest = ledger.view(balance_sheet.ACCOUNTS)
+    balance_sheet_figures = []
+    for account in balance_sheet.ACCOUNTS:
+        balance_sheet_figures.append(figures.figure(
+            [make_cum_area(source, subaccount, i, 4)
+             for i, subaccount in enumerate(get_descendents(account, account_tree))
+             if source.count([subaccount]) > 0],
+            chart_template()))
+    result['balance sheet (Month)'] = balance_sheet_figures
+
+    return {name: {'response': {'output': {'value': value}}, 'multi': True} for name, value in result.items()}
+
+
+def best_ms(function: Callable, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times) * 1000
+
+
+def main(splits: int, accounts: int, repeat: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        data_store = synthetic.load_synthetic(directory, n_splits=splits, n_accounts=accounts)
+
+    if serialization.orjson is None:
+        print('orjson is not installed, so the fast encoder is the standard encoder.')
+    print(f'{splits:,d} splits, {accounts:,d} accounts; best of {repeat}\n')
+    print(f'{"callback":24} {"plotly ms":>10} {"fast ms":>8} {"saved ms":>9} '
+          f'{"raw KB":>9} {"gzip KB":>8} {"gzip ms":>8} {"br KB":>8} {"br ms":>6}')
+    for name, response in payloads(data_store).items():
+        standard = json.dumps(response, cls=PlotlyJSONEncoder)
+        fast = json.dumps(response, cls=serialization.FastPlotlyJSONEncoder)
+        assert json.loads(standard) == json.loads(fast), f'{name}: encoders disagree'
+        standard_ms = best_ms(lambda: json.dumps(response, cls=PlotlyJSONEncoder), repeat)
+        fast_ms = best_ms(lambda: json.dumps(response, cls=serialization.FastPlotlyJSONEncoder), repeat)
+        data = fast.encode('utf-8')
+        gzip_ms = best_ms(lambda: gzip.compress(data, serialization.GZIP_LEVEL), repeat)
+        gzip_kb = len(gzip.compress(data, serialization.GZIP_LEVEL)) / 1024
+        if serialization.brotli is not None:
+            br_ms = best_ms(lambda: serialization.compress(data, 'br'), repeat)
+            br_kb = len(serialization.compress(data, 'br')) / 1024
+        else:
+            br_ms = br_kb = float('nan')
+        print(f'{name:24} {standard_ms:10,.1f} {fast_ms:8,.1f} {standard_ms - fast_ms:9,.1f} '
+              f'{len(data) / 1024:9,.0f} {gzip_kb:8,.0f} {gzip_ms:8,.1f} {br_kb:8,.0f} {br_ms:6,.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--splits', type=int, default=200_000)
+    parser.add_argument('--accounts', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    main(args.splits, args.accounts, args.repeat)
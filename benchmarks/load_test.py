@@ -0,0 +1,388 @@
+"""
+Load test: many simulated users browsing the dashboard at once, through
+the same HTTP endpoints the Dash renderer uses.
+
+    python benchmarks/load_test.py [--users 8] [--sessions 2] [--think 0.5] [--splits 50000] [--accounts 200]
+    python benchmarks/load_test.py --url http://localhost:8050 --pid 1234 ...
+
+Each user runs scripted sessions, one after another: open the page, load
+the ledger, expand a page of the account tree, switch to Cash Flow, go
+through the time series resolutions, box-select bars, click into the
+sunburst, which fills the transaction table, then switch to the Balance
+Sheet and select a point.  Requests are built from /_dash-dependencies,
+with the values the browser would send, including the data store, and
+follow-on callbacks are requested as the browser would request them,
+e.g., the flows after a selection, and polls while a coarser time series
+stands in (see deadline.py).  Transaction tables page in the browser
+(page_action='native'), so the only server-side paging is the account
+tree's, which is requested for each expanded account.
+
+The synthetic ledger (see synthetic.py) is served over HTTP from a
+temporary directory, so the server reads it as it would a published
+export; nothing outside this machine is used.
+
+Without --url, the app is served in this process by Werkzeug's threaded
+server, and server memory is this process's resident set.  With --url,
+a server already running on this machine is driven instead, e.g.,
+gunicorn with the intended number of workers, and --pid gives the
+process whose memory to report.  Memory is read from /proc, so it is
+only reported on Linux.
+
+The report gives, for each callback, the number of requests, errors,
+latency percentiles, and requests per second over the whole run.
+"""
+import argparse
+import functools
+import gzip
+import http.server
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+import synthetic
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+LOAD = '..data_store.children...meta_data.children...account_tree.children...records.children..'
+TREE_PAGE = '{"account":["MATCH"],"page":["MATCH"],"type":"tree_children"}.children'
+TAB = 'tab-content.children'
+TIME_SERIES = '..time_series_base.data...time_series_refresh.disabled..'
+SELECTION = '..selected_trans_display.children...time_series_selection_info.data...account_burst_base.data..'
+FLOWS = 'flow_sankey.figure'
+TRANS_TABLE = '..trans_table_records.data...selected_account_text.children...trans_table_text.children...' \
+              'trans_export.children..'
+BALANCE_SHEET = '..bsa_master_time_series.figure...bsl_master_time_series.figure...bse_master_time_series.figure..'
+BS_TABLE = '..bs_trans_table_records.data...bs_trans_table_text.children...bs_trans_export.children..'
+
+RESOLUTIONS = [3, 4, 2, 1]  # Quarter (the default), Month, Year, Era
+MAX_POLLS = 30  # for an exact time series, before giving up on it
+MEMORY_INTERVAL = 0.2  # seconds between memory samples
+
+
+class Stats:
+    """ Latencies and errors of each kind of request, from every user """
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, ok: bool = True) -> None:
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def report(self, wall: float) -> None:
+        print(f'{"request":22} {"count":>6} {"errors":>6} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} '
+              f'{"max ms":>8} {"req/s":>7}')
+        for name, latencies in self.latencies.items():
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            print(f'{name:22} {len(latencies):6,d} {self.errors.get(name, 0):6,d} {p50:8,.0f} {p95:8,.0f} '
+                  f'{p99:8,.0f} {max(latencies) * 1000:8,.0f} {len(latencies) / wall:7,.1f}')
+        total = sum(len(x) for x in self.latencies.values())
+        print(f'\n{total:,d} requests in {wall:,.1f} s: {total / wall:,.1f} requests/s, '
+              f'{sum(self.errors.values()):,d} errors')
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    """ The resident set of process pid, in MB, or None if it can't be read """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class MemoryMonitor(threading.Thread):
+    """ Samples the server's memory until stopped """
+
+    def __init__(self, pid: int):
+        super().__init__(daemon=True)
+        self.pid: int = pid
+        self.samples: List[float] = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            sample = rss_mb(self.pid)
+            if sample is not None:
+                self.samples.append(sample)
+            self.stopped.wait(MEMORY_INTERVAL)
+
+    def report(self) -> None:
+        if not self.samples:
+            print('Server memory: not available (it is read from /proc)')
+            return
+        print(f'Server memory: {self.samples[0]:,.0f} MB at start, {max(self.samples):,.0f} MB peak, '
+              f'{self.samples[-1]:,.0f} MB at end')
+
+
+def components(layout) -> Iterator[dict]:
+    """ Every component in a layout, as JSON from the server """
+    if isinstance(layout, list):
+        for child in layout:
+            yield from components(child)
+    elif isinstance(layout, dict) and 'props' in layout:
+        yield layout
+        yield from components(layout['props'].get('children'))
+
+
+def prop_key(component_id, prop: str) -> str:
+    """ The key of a property in the callback specs, e.g., 'tabs.value' """
+    if isinstance(component_id, dict):
+        component_id = json.dumps(component_id, sort_keys=True, separators=(',', ':'))
+    return f'{component_id}.{prop}'
+
+
+class Session:
+    """
+    One simulated user: the values of the components on the page, as the
+    browser holds them, and the requests it sends when they change
+    """
+
+    def __init__(self, url: str, dependencies: Dict[str, dict], stats: Stats, rng: np.random.Generator,
+                 think: float):
+        self.url: str = url.rstrip('/')
+        self.dependencies: Dict[str, dict] = dependencies
+        self.stats: Stats = stats
+        self.rng: np.random.Generator = rng
+        self.think: float = think
+        self.values: Dict[str, object] = {}
+
+    def send(self, name: str, path: str, body: dict = None) -> Optional[bytes]:
+        """ Time one request; return the response, or None for 204 or an error """
+        headers = {'Accept-Encoding': 'br, gzip' if brotli is not None else 'gzip'}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(urllib.request.Request(self.url + path, data, headers)) as response:
+                content = response.read()
+                encoding = response.headers.get('Content-Encoding')
+                status = response.status
+        except (urllib.error.URLError, ConnectionError) as E:
+            self.stats.record(name, time.perf_counter() - start, ok=False)
+            logging.warning(f'{name}: {E}')
+            return None
+        if encoding == 'br':
+            content = brotli.decompress(content)
+        elif encoding == 'gzip':
+            content = gzip.decompress(content)
+        self.stats.record(name, time.perf_counter() - start)
+        return content if status != 204 else None
+
+    def call(self, name: str, output: str, changed: Dict[str, object], match: dict = None) -> Optional[dict]:
+        """
+        Request the callback for output after the values in changed, and
+        keep what it returns, as the renderer would; return the response.
+        For a pattern-matching callback, match gives the MATCH values.
+        """
+        self.values.update(changed)
+        spec = self.dependencies[output]
+
+        def concrete(component_id: str):
+            if not component_id.startswith('{'):
+                return component_id
+            return {key: match[key] if value == ['MATCH'] else value
+                    for key, value in json.loads(component_id).items()}
+
+        def values(items: list) -> list:
+            return [dict(x, id=concrete(x['id']), value=self.values.get(prop_key(concrete(x['id']), x['property'])))
+                    for x in items]
+
+        body = dict(output=output, inputs=values(spec['inputs']), state=values(spec['state']),
+                    changedPropIds=[prop_key(concrete(x['id']), x['property']) for x in spec['inputs']
+                                    if prop_key(concrete(x['id']), x['property']) in changed])
+        if match is not None:
+            output_id, prop = output.rsplit('.', 1)
+            body['outputs'] = {'id': concrete(output_id), 'property': prop}
+        content = self.send(name, '/_dash-update-component', body)
+        if content is None:
+            return None
+        response = json.loads(content)['response']
+        for component_id, props in response.items():
+            for prop, value in props.items():
+                self.values[f'{component_id}.{prop}'] = value
+                if prop == 'children':
+                    self.read_layout(value)
+        return response
+
+    def read_layout(self, layout) -> None:
+        """ Keep the initial values of the components in layout """
+        for component in components(layout):
+            component_id = component['props'].get('id')
+            if component_id is not None:
+                for prop, value in component['props'].items():
+                    if prop != 'children':
+                        self.values.setdefault(prop_key(component_id, prop), value)
+
+    def pause(self) -> None:
+        if self.think:
+            time.sleep(self.rng.exponential(self.think))
+
+    def run(self, trans_url: str, eras_url: str) -> None:
+        self.values = {}
+        self.send('page', '/')
+        layout = self.send('layout', '/_dash-layout')
+        if layout is None:
+            return
+        self.read_layout(json.loads(layout))
+        self.call('tab: Data Source', TAB, {'tabs.value': 'ds'})
+        self.values.update({'transactions_url.value': trans_url, 'eras_url.value': eras_url})
+        if self.call('load', LOAD, {'data_load_button.n_clicks': 1}) is None:
+            return
+        self.pause()
+        self.expand_tree()
+        self.pause()
+        self.call('tab: Cash Flow', TAB, {'tabs.value': 'cf'})
+        for resolution in RESOLUTIONS:
+            self.time_series(resolution)
+            self.pause()
+        self.box_select()
+        self.pause()
+        self.sunburst_click()
+        self.pause()
+        self.call('tab: Balance Sheet', TAB, {'tabs.value': 'bs'})
+        self.balance_sheet()
+
+    def expand_tree(self) -> None:
+        """ Expand a top-level account, and a page of its children """
+        nodes = [x['props']['id'] for x in components(self.values.get('account_tree.children'))
+                 if isinstance(x['props'].get('id'), dict) and x['props']['id'].get('type') == 'tree_node']
+        for node_id in nodes[:1]:
+            self.call('tree page', TREE_PAGE, {prop_key(node_id, 'n_clicks'): 1}, match=node_id)
+
+    def time_series(self, resolution: int) -> None:
+        """ Choose a resolution, then poll, as time_series_refresh does, until it is exact """
+        response = self.call('time series', TIME_SERIES, {'time_series_resolution.value': resolution})
+        polls = 0
+        while response is not None and response.get('time_series_refresh', {}).get('disabled') is False \
+                and polls < MAX_POLLS:
+            time.sleep((self.values.get('time_series_refresh.interval') or 2000) / 1000)
+            polls += 1
+            response = self.call('time series poll', TIME_SERIES, {'time_series_refresh.n_intervals': polls}) or \
+                {'time_series_refresh': {'disabled': False}}
+        if response is not None:
+            self.call('selection', SELECTION, {'time_series_base.data': self.values['time_series_base.data']})
+
+    def box_select(self) -> None:
+        """ Select a few bars of one account, and show their flows """
+        base = self.values.get('time_series_base.data')
+        if not base or not base['figure']['data']:
+            return
+        curve = int(self.rng.integers(len(base['figure']['data'])))
+        x = base['figure']['data'][curve]['x']
+        if not len(x):
+            return
+        points = self.rng.choice(len(x), size=min(3, len(x)), replace=False)
+        selected = {'points': [{'curveNumber': curve, 'pointNumber': int(i), 'x': x[int(i)]} for i in points]}
+        self.call('box select', SELECTION, {'master_time_series.selectedData': selected})
+        self.call('flows', FLOWS, {'time_series_selection_info.data': self.values.get('time_series_selection_info.data')})
+
+    def sunburst_click(self) -> None:
+        """ Click a slice, which zooms the sunburst and fills the transaction table """
+        burst = self.values.get('account_burst_base.data')
+        if not burst or not burst['figure']['data']:
+            return
+        ids = burst['figure']['data'][0]['ids']
+        click = {'points': [{'id': ids[int(self.rng.integers(len(ids)))], 'curveNumber': 0}]}
+        self.call('sunburst click', SELECTION, {'account_burst.clickData': click})
+        self.call('transaction table', TRANS_TABLE, {'account_burst.clickData': click})
+
+    def balance_sheet(self) -> None:
+        """ Draw the balance sheet, and select a point, which fills its table """
+        response = self.call('balance sheet', BALANCE_SHEET, {'bs_period.value': self.values.get('bs_period.value')})
+        if not response:
+            return
+        traces = response['bsa_master_time_series']['figure']['data']
+        if not traces or not len(traces[0]['x']):
+            return
+        i = int(self.rng.integers(len(traces[0]['x'])))
+        point = {'points': [{'customdata': traces[0]['customdata'][i], 'x': traces[0]['x'][i]}]}
+        self.call('balance sheet table', BS_TABLE, {'bsa_master_time_series.selectedData': point})
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve(server) -> str:
+    """ Serve in a background thread; return the base URL """
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}'
+
+
+def main(users: int, sessions: int, think: float, splits: int, accounts: int, url: str, pid: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        synthetic.write_gnucash_csv(os.path.join(directory, 'transactions.csv'), n_splits=splits, n_accounts=accounts)
+        synthetic.write_eras_csv(os.path.join(directory, 'eras.csv'))
+        files = serve(http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      functools.partial(QuietHandler, directory=directory)))
+        if url is None:
+            from werkzeug.serving import make_server
+            import index
+            logging.getLogger('werkzeug').setLevel(logging.ERROR)
+            url = serve(make_server('127.0.0.1', 0, index.app.server, threaded=True))
+            pid = os.getpid()
+
+        with urllib.request.urlopen(url + '/_dash-dependencies') as response:
+            dependencies = {x['output']: x for x in json.loads(response.read())}
+        stats = Stats()
+        monitor = MemoryMonitor(pid) if pid else None
+        if monitor:
+            monitor.start()
+
+        def user(i: int):
+            session = Session(url, dependencies, stats, np.random.default_rng(i), think)
+            for _ in range(sessions):
+                session.run(f'{files}/transactions.csv', f'{files}/eras.csv')
+
+        print(f'{users} users, {sessions} sessions each, {splits:,d} splits, {accounts:,d} accounts, '
+              f'against {url}\n')
+        start = time.perf_counter()
+        threads = [threading.Thread(target=user, args=(i,)) for i in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+        if monitor:
+            monitor.stopped.set()
+            monitor.join()
+        stats.report(wall)
+        if monitor:
+            monitor.report()
+        else:
+            print('Server memory: give --pid to report it')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=8, help='concurrent users')
+    parser.add_argument('--sessions', type=int, default=2, help='sessions per user, one after another')
+    parser.add_argument('--think', type=float, default=0.5, help='mean seconds between a user\'s actions')
+    parser.add_argument('--splits', type=int, default=50_000)
+    parser.add_argument('--accounts', type=int, default=200)
+    parser.add_argument('--url', help='a running server to drive, instead of one in this process')
+    parser.add_argument('--pid', type=int, help='with --url, the server process, to report its memory')
+    args = parser.parse_args()
+    main(args.users, args.sessions, args.think, args.splits, args.accounts, args.url, args.pid)
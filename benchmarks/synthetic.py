@@ -0,0 +1,103 @@
+"""
+Synthetic ledgers for benchmarks and load tests.
+
+write_gnucash_csv() writes a transaction export in the same format as
+Gnucash's "Export Transactions to CSV", so it exercises the same loading
+path as real data.  Every transaction is a balanced pair of splits.
+"""
+import csv
+import os
+import sys
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Benchmarks run the app modules the same way the app does
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ledger_explorer'))
+
+ROOTS: List[str] = ['Assets', 'Liabilities', 'Equity', 'Income', 'Expenses']
+PAYEES: List[str] = ['Acme Grocery', 'Corner Cafe', 'City Utilities', 'Metro Transit', 'Book Barn',
+                     'Hardware Depot', 'Payroll ACME Corp', 'Dr. Smith', 'Online Market', 'Gas & Go']
+
+
+def make_accounts(n_accounts: int, rng: np.random.Generator) -> List[str]:
+    """ Return n_accounts full account names, spread over ROOTS, up to four levels deep.
+    Account names are unique, as Ledger Explorer requires. """
+    accounts: List[str] = []
+    parents: List[str] = list(ROOTS)
+    for i in range(n_accounts):
+        parent = parents[rng.integers(len(parents))]
+        account = f'{parent}:{parent.split(":")[0][:3]} {i}'
+        accounts.append(account)
+        if account.count(':') < 3:
+            parents.append(account)
+    return accounts
+
+
+def make_transactions(n_splits: int = 100_000,
+                      n_accounts: int = 200,
+                      years: int = 10,
+                      seed: int = 0) -> Tuple[pd.DataFrame, List[str]]:
+    """ Return a frame with one row per split, in Gnucash export column order, and the account list. """
+    rng = np.random.default_rng(seed)
+    accounts = make_accounts(n_accounts, rng)
+    by_root = {root: [a for a in accounts if a.split(':')[0] == root] or [root] for root in ROOTS}
+    n_trans = n_splits // 2
+    start = np.datetime64('2010-01-01')
+    days = np.sort(rng.integers(0, 365 * years, n_trans))
+    amounts = np.round(rng.lognormal(3.5, 1.2, n_trans), 2)
+    # Mostly spending from assets and liabilities, with some income into assets
+    income = rng.random(n_trans) < 0.15
+    debit_roots = np.where(income, 'Assets', 'Expenses')
+    credit_roots = np.where(income, 'Income', np.where(rng.random(n_trans) < 0.7, 'Assets', 'Liabilities'))
+    debits = [by_root[r][rng.integers(len(by_root[r]))] for r in debit_roots]
+    credits = [by_root[r][rng.integers(len(by_root[r]))] for r in credit_roots]
+    payees = np.array(PAYEES)[rng.integers(len(PAYEES), size=n_trans)]
+
+    first = pd.DataFrame({'Date': pd.to_datetime(start + days).strftime('%m/%d/%Y'),
+                          'Transaction ID': [f'{i:032x}' for i in range(n_trans)],
+                          'Description': [f'{p} #{i % 997}' for i, p in enumerate(payees)],
+                          'Notes': '',
+                          'Memo': '',
+                          'Full Account Name': debits,
+                          'Amount Num.': amounts})
+    second = first.assign(**{'Date': '', 'Description': '', 'Notes': '',
+                             'Full Account Name': credits,
+                             'Amount Num.': -amounts})
+    splits = pd.concat([first, second]).sort_index(kind='stable').reset_index(drop=True)
+    splits['Account Name'] = splits['Full Account Name'].str.rsplit(':', n=1).str[-1]
+    splits['Amount Num.'] = splits['Amount Num.'].map('{:,.2f}'.format)
+    return splits, accounts
+
+
+def write_gnucash_csv(path: str, **kwargs) -> List[str]:
+    """ Write a synthetic Gnucash transaction export to path, and return its account list. """
+    splits, accounts = make_transactions(**kwargs)
+    splits.to_csv(path, index=False, quoting=csv.QUOTE_MINIMAL)
+    return accounts
+
+
+def write_eras_csv(path: str, years: int = 10, days: int = 14) -> None:
+    """ Write one era per pay period of the given length. """
+    starts = pd.date_range('2010-01-01', periods=years * 365 // days, freq=f'{days}D')
+    pd.DataFrame({'name': [f'Pay period {i}' for i in range(len(starts))],
+                  'date_start': starts.strftime('%Y-%m-%d'),
+                  'date_end': (starts + pd.Timedelta(days=days - 1)).strftime('%Y-%m-%d')}).to_csv(path, index=False)
+
+
+def load_synthetic(directory: str, **kwargs) -> str:
+    """ Write a synthetic ledger and eras to directory, load them as the Reload
+    button would, and return the data_store contents.  Background warm-up is
+    cancelled, so it doesn't skew timings. """
+    from apps import data_source
+    import warmup
+
+    trans_path = os.path.join(directory, 'transactions.csv')
+    eras_path = os.path.join(directory, 'eras.csv')
+    write_gnucash_csv(trans_path, **kwargs)
+    write_eras_csv(eras_path, years=kwargs.get('years', 10))
+    data_source.DATA_DIR = directory  # local files are only read from the data directory
+    data_store = data_source.load_data.__wrapped__(1, trans_path, eras_path)[0]
+    warmup.cancel()
+    return data_store
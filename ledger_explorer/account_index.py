@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+from typing import List, NamedTuple
+
+from treelib import Tree
+
+from lazy import lazy_import
+from search import SearchIndex
+from utils import ROOT_ID, subtree_totals
+
+pd = lazy_import('pandas')
+
+
+PATH_SEPARATOR: str = ':'
+MAX_MATCHES: int = 20
+
+
+class AccountMatch(NamedTuple):
+    account: str    # account id, as in the account tree
+    path: str       # full account name, e.g., Expenses:Food:Groceries
+    subtotal: int   # total of the account and its descendents, over the whole ledger
+
+
+class AccountIndex:
+    """
+    Typeahead over a chart of accounts, built once per dataset.
+
+    A trie over the lower-case account paths answers prefix queries, where
+    the prefix may start at any level of the path, so 'exp:fo' is not
+    needed to find Expenses:Food, but 'fo' or 'expenses:fo' both do.  Each
+    trie node keeps the best MAX_MATCHES accounts below it, so a prefix
+    lookup is a walk along the query's characters and nothing more.  When
+    the prefixes run short, a SearchIndex over the same paths adds
+    accounts with a word containing each query term, e.g., 'groc'.
+
+    Accounts are ranked by the size of their subtree totals, largest
+    first, taken from the account totals the ledger already keeps, so
+    building the index doesn't read any transactions.
+    """
+
+    def __init__(self, account_tree: Tree, account_totals: pd.DataFrame):
+        subtotals = subtree_totals(account_totals, account_tree)['subtotal']
+        accounts = [x for x in account_tree.expand_tree(mode=Tree.WIDTH) if x != ROOT_ID]
+        matches = [AccountMatch(x, self._path(account_tree, x), subtotals.get(x, 0)) for x in accounts]
+        # search positions, and trie insertion order, are rank order
+        self.matches: List[AccountMatch] = sorted(matches, key=lambda x: (-abs(x.subtotal), x.path))
+        self.trie: tuple = ({}, [])  # (children by character, best matches below)
+        for rank, match in enumerate(self.matches):
+            segments = match.path.lower().split(PATH_SEPARATOR)
+            for i in range(len(segments)):
+                self._insert(PATH_SEPARATOR.join(segments[i:]), rank)
+        self.search_index: SearchIndex = SearchIndex(pd.Series([x.path for x in self.matches]))
+
+    @staticmethod
+    def _path(account_tree: Tree, account: str) -> str:
+        ancestors = [x for x in account_tree.rsearch(account) if x != ROOT_ID]
+        return PATH_SEPARATOR.join(account_tree[x].tag for x in reversed(ancestors))
+
+    def _insert(self, key: str, rank: int) -> None:
+        node = self.trie
+        for character in key:
+            node = node[0].setdefault(character, ({}, []))
+            best = node[1]
+            if len(best) < MAX_MATCHES and (not best or best[-1] != rank):
+                best.append(rank)
+
+    def prefixed(self, prefix: str) -> List[int]:
+        """ Ranks of the best accounts with a path level starting with prefix """
+        node = self.trie
+        for character in prefix.lower():
+            node = node[0].get(character)
+            if node is None:
+                return []
+        return node[1]
+
+    def find(self, query: str, limit: int = MAX_MATCHES) -> List[AccountMatch]:
+        """ The best accounts matching query, prefix matches first; for no query, the largest accounts """
+        query = query.strip()
+        if not query:
+            return self.matches[:limit]
+        ranks = self.prefixed(query)[:limit]
+        if len(ranks) < limit:
+            found = set(ranks)
+            for rank in self.search_index.search(query):
+                if len(ranks) >= limit:
+                    break
+                if rank not in found:
+                    ranks.append(int(rank))
+        return [self.matches[x] for x in ranks]
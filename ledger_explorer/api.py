@@ -0,0 +1,314 @@
+"""
+Read-only JSON API over the ledgers loaded in this server process, for
+tools that need the numbers behind the charts:
+
+    GET /api/ledgers
+    GET /api/memory
+    GET /api/ledgers/<id>/totals?account=Expenses&resolution=Month[&deep=0]
+    GET /api/ledgers/<id>/balances?account=Assets&resolution=Quarter[&deep=0]
+    GET /api/ledgers/<id>/balances?account=Assets&as_of=2020-06-30[&deep=0]
+    GET /api/ledgers/<id>/subtotals[?start=2020-01-01][&end=2020-12-31][&account=Expenses]
+    GET /api/ledgers/<id>/export.csv[?account=Expenses...][&start=...][&end=...][&q=words][&deep=0]
+    GET /api/ledgers/<id>/export.csv?through=2020-06-30:Cash[&through=...]
+
+<id> is a dataset id from /api/ledgers, or `latest` for the most recently
+used one.  Amounts are in the same units and signs as the charts.
+Results are computed once per ledger and kept (Ledger.cached).  Each
+ledger keeps its API_RESULTS most recently used ones, as every date
+range asked for is a new result.
+
+Every response has an ETag.  A dataset id is a hash of the data, so a
+poll with If-None-Match gets 304 Not Modified, without any computing,
+until the ledger changes.  Add format=arrow for Arrow IPC instead of
+JSON, if pyarrow is installed.
+
+memory gives the bytes each ledger holds (see Ledger.memory), by dataset
+id, and the worker's memory budget, if any (see memory.py).
+
+export streams the transactions selected in a Cash Flow table (accounts,
+dates and search words) or a Balance Sheet table (each account through a
+date, with the running total), in date order, as CSV, or as Parquet if
+pyarrow is installed.  It is written a chunk at a time, straight from the
+ledger, so memory use doesn't grow with the size of the selection.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+import hashlib
+import importlib.util
+import io
+import threading
+from typing import Callable, Dict, Hashable, Iterable, Iterator
+
+import flask
+
+from backend import CHUNK_ROWS, ROW_COLUMNS
+from ledger import Ledger, get_ledger, ledgers, memory_usage
+from memory import MEMORY_BUDGET
+from lazy import lazy_import
+from utils import TIME_RES_LOOKUP, get_descendents, subtree_totals
+
+pd = lazy_import('pandas')
+
+
+api = flask.Blueprint('api', __name__, url_prefix='/api')
+
+RESOLUTIONS: dict = {v['label'].lower(): k for k, v in TIME_RES_LOOKUP.items()}
+ARROW_MIMETYPE: str = 'application/vnd.apache.arrow.stream'
+EXPORT_MIMETYPES: dict = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}  # utils.EXPORT_FORMATS
+API_RESULTS: int = 64  # results kept per ledger
+
+_recent: Dict[str, OrderedDict] = {}  # by ledger id, the keys of its API results, least recently used first
+_recent_lock = threading.Lock()
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _error(status: int, message: str) -> flask.Response:
+    response = flask.jsonify(error=message)
+    response.status_code = status
+    return response
+
+
+@api.errorhandler(BadRequest)
+def _bad_request(e: BadRequest) -> flask.Response:
+    return _error(400, str(e))
+
+
+def _ledger(ledger_id: str) -> Ledger:
+    if ledger_id == 'latest':
+        registered = ledgers()
+        ledger = registered[-1] if registered else None
+    else:
+        ledger = get_ledger(ledger_id)
+    if ledger is None:
+        flask.abort(_error(404, f'No ledger {ledger_id} in this server process; load it in the Data Source tab'))
+    return ledger
+
+
+def _account(ledger: Ledger, required: bool = True) -> str:
+    account = flask.request.args.get('account')
+    if account is None and not required:
+        return None
+    if account is None or ledger.account_tree.get_node(account) is None:
+        raise BadRequest(f'Unknown account {account}')
+    return account
+
+
+def _accounts(ledger: Ledger, account: str) -> list:
+    if flask.request.args.get('deep', '1') in ('', '0', 'false'):
+        return [account]
+    return [account] + get_descendents(account, ledger.account_tree)
+
+
+def _resolution(allow_era: bool = True) -> int:
+    label = flask.request.args.get('resolution', 'month').lower()
+    if label not in RESOLUTIONS or (label == 'era' and not allow_era):
+        raise BadRequest(f'Unknown resolution {label}')
+    return RESOLUTIONS[label]
+
+
+def _date(name: str, value: str = None):
+    value = flask.request.args.get(name) if value is None else value
+    if not value:
+        return None
+    try:
+        return pd.Timestamp(value)
+    except ValueError:
+        raise BadRequest(f'Bad date {name}={value}')
+
+
+def _cached(ledger: Ledger, key: Hashable, compute: Callable):
+    """ ledger.cached(key, compute), forgetting the least recently used API results beyond API_RESULTS """
+    result = ledger.cached(key, compute)
+    with _recent_lock:
+        for dropped in set(_recent) - {x.id for x in ledgers()}:
+            del _recent[dropped]
+        recent = _recent.setdefault(ledger.id, OrderedDict())
+        recent[key] = None
+        recent.move_to_end(key)
+        while len(recent) > API_RESULTS:
+            ledger.forget(recent.popitem(last=False)[0])
+    return result
+
+
+def _respond(ledger: Ledger, compute: Callable[[], pd.DataFrame]) -> flask.Response:
+    """
+    Return compute() as JSON columns, or Arrow IPC, with an ETag.  The
+    ETag is fixed by the dataset and the request, so a matching
+    If-None-Match returns 304 before anything is computed.
+    """
+    etag = hashlib.sha1(f'{ledger.id} {flask.request.full_path}'.encode('utf-8')).hexdigest()
+    if flask.request.if_none_match.contains_weak(etag):
+        response = flask.Response(status=304)
+    else:
+        args = [x for x in flask.request.args.items(multi=True) if x[0] != 'format']
+        key = ('api', flask.request.path, tuple(sorted(args)))
+        frame: pd.DataFrame = _cached(ledger, key, compute).reset_index()
+        if flask.request.args.get('format') == 'arrow':
+            try:
+                import pyarrow  # optional, and slow to import, so only when asked for
+                import pyarrow.ipc
+            except ImportError:
+                return _error(406, 'format=arrow requires pyarrow')
+            sink = pyarrow.BufferOutputStream()
+            table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+            with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            response = flask.Response(sink.getvalue().to_pybytes(), mimetype=ARROW_MIMETYPE)
+        else:
+            for column in frame.columns:
+                if pd.api.types.is_datetime64_any_dtype(frame[column]):
+                    frame[column] = frame[column].dt.strftime('%Y-%m-%d')
+            response = flask.jsonify({column: frame[column].tolist() for column in frame.columns})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@api.route('/ledgers')
+def list_ledgers() -> flask.Response:
+    result = []
+    for ledger in ledgers():
+        earliest, latest = ledger.backend.date_range()
+        result.append({'id': ledger.id,
+                       'records': ledger.backend.count(),
+                       'earliest': earliest.strftime('%Y-%m-%d'),
+                       'latest': latest.strftime('%Y-%m-%d'),
+                       'eras': len(ledger.eras)})
+    return flask.jsonify(result)
+
+
+@api.route('/memory')
+def memory() -> flask.Response:
+    usage = memory_usage()
+    return flask.jsonify(budget=MEMORY_BUDGET or None,
+                         total=sum(sum(x.values()) for x in usage.values()),
+                         ledgers=usage)
+
+
+@api.route('/ledgers/<ledger_id>/totals')
+def totals(ledger_id: str) -> flask.Response:
+    """ Account total in each period, or each era, as in the Cash Flow time series """
+    ledger = _ledger(ledger_id)
+    account = _account(ledger)
+    accounts = _accounts(ledger, account)
+    time_resolution = _resolution()
+
+    def compute() -> pd.DataFrame:
+        if TIME_RES_LOOKUP[time_resolution]['label'] == 'Era':
+            result = ledger.backend.era_totals(accounts, ledger.eras).rename(columns={'value': 'total'})
+            return result.rename_axis('era')[['date_start', 'date_end', 'total']]
+        return ledger.backend.period_totals(accounts, time_resolution).\
+            rename('total').rename_axis('period_end').to_frame()
+    return _respond(ledger, compute)
+
+
+@api.route('/ledgers/<ledger_id>/balances')
+def balances(ledger_id: str) -> flask.Response:
+    """
+    Cumulative account balance at the end of each period, as in the Balance
+    Sheet, or, with as_of, the balance at the end of that date
+    """
+    ledger = _ledger(ledger_id)
+    account = _account(ledger)
+    accounts = _accounts(ledger, account)
+    as_of = _date('as_of')
+    time_resolution = _resolution(allow_era=False)
+
+    def compute() -> pd.DataFrame:
+        if as_of is not None:
+            return pd.DataFrame({'balance': [ledger.backend.balance(accounts, as_of)]},
+                                index=pd.Index([as_of], name='as_of'))
+        return ledger.backend.balances(accounts, time_resolution).\
+            rename('balance').rename_axis('period_end').to_frame()
+    return _respond(ledger, compute)
+
+
+@api.route('/ledgers/<ledger_id>/subtotals')
+def subtotals(ledger_id: str) -> flask.Response:
+    """ Total of each account, and of its subtree, between start and end inclusive """
+    ledger = _ledger(ledger_id)
+    account = _account(ledger, required=False)
+    start, end = _date('start'), _date('end')
+
+    def compute() -> pd.DataFrame:
+        tree = ledger.account_tree if account is None else ledger.account_tree.subtree(account)
+        totals = ledger.backend.account_totals(None if account is None else list(tree.nodes), start, end)
+        result = subtree_totals(totals, tree).rename_axis('account')
+        result.insert(0, 'parent', [getattr(tree.parent(x), 'identifier', None) for x in result.index])
+        return result
+    return _respond(ledger, compute)
+
+
+def _csv_stream(chunks: Iterable[pd.DataFrame], columns: list) -> Iterator[str]:
+    header = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=header, date_format='%Y-%m-%d')
+        header = False
+    if header:
+        yield pd.DataFrame(columns=columns).to_csv(index=False)
+
+
+def _parquet_stream(chunks: Iterable[pd.DataFrame], columns: list) -> Iterator[bytes]:
+    """ One row group per chunk, each sent as soon as it is written """
+    import pyarrow
+    import pyarrow.parquet
+
+    sink = io.BytesIO()
+
+    def drain() -> bytes:
+        data = sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+        return data
+
+    writer = None
+    for chunk in chunks:
+        table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pyarrow.parquet.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        yield drain()
+    if writer is None:
+        table = pyarrow.Table.from_pandas(pd.DataFrame(columns=columns), preserve_index=False)
+        writer = pyarrow.parquet.ParquetWriter(sink, table.schema)
+    writer.close()
+    yield drain()
+
+
+@api.route('/ledgers/<ledger_id>/export.<export_format>')
+def export(ledger_id: str, export_format: str) -> flask.Response:
+    """ The transactions in a table's selection, streamed as CSV or Parquet """
+    ledger = _ledger(ledger_id)
+    if export_format not in EXPORT_MIMETYPES:
+        return _error(404, f'Unknown export format {export_format}')
+    if export_format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        return _error(406, 'Parquet export requires pyarrow')
+
+    through = {}
+    for item in flask.request.args.getlist('through'):
+        date, _, account = item.partition(':')
+        if ledger.account_tree.get_node(account) is None:
+            raise BadRequest(f'Unknown account {account}')
+        through[account] = _date('through', date)
+    if through:
+        chunks = ledger.backend.running_chunks(through, CHUNK_ROWS)
+        columns = ROW_COLUMNS + ['total']
+    else:
+        accounts = []
+        for account in flask.request.args.getlist('account'):
+            if ledger.account_tree.get_node(account) is None:
+                raise BadRequest(f'Unknown account {account}')
+            accounts = accounts + _accounts(ledger, account)
+        chunks = ledger.backend.chunks(accounts or None, _date('start'), _date('end'),
+                                       flask.request.args.get('q'), CHUNK_ROWS)
+        columns = ROW_COLUMNS
+
+    stream = _csv_stream if export_format == 'csv' else _parquet_stream
+    return flask.Response(flask.stream_with_context(stream(chunks, columns)),
+                          mimetype=EXPORT_MIMETYPES[export_format],
+                          headers={'Content-Disposition': f'attachment; filename="transactions.{export_format}"'})
+
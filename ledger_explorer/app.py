@@ -1,5 +1,11 @@
 import dash
 
-app = dash.Dash(__name__, suppress_callback_exceptions=True)
+import serialization
+from api import api
+
+# compression is handled by serialization.compress_response instead
+app = dash.Dash(__name__, suppress_callback_exceptions=True, compress=False)
+serialization.init_app(app)
+app.server.register_blueprint(api)
 
 server = app.server
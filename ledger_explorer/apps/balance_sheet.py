@@ -1,90 +1,170 @@
+from __future__ import annotations
+
 import dash_core_components as dcc
 import dash_html_components as html
+import functools
 from more_itertools import intersperse
 import logging
-import pandas as pd
-
 
-import plotly.graph_objects as go
 import dash
-from dash.dependencies import Input, Output, State
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from dash.exceptions import PreventUpdate
 from utils import TIME_RES_LOOKUP, TIME_RES_OPTIONS
-from utils import chart_fig_layout, data_from_json_store, bs_trans_table
+from utils import chart_template, bs_trans_table, table_records
 from utils import get_descendents, pretty_date
-from utils import make_cum_area
+from utils import export_links, make_cum_area
+import figures
+from coalesce import coalesced
+from ledger import Ledger, ledger_from_json_store
+from parallel import parallel_map
+from warmup import standard_views
+from lazy import lazy_import
 
 from app import app
 
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
 
 ACCOUNTS: list = ['Assets', 'Liabilities', 'Equity']
+PERIOD_OPTIONS: list = [x for x in TIME_RES_OPTIONS if x['label'] != 'Era']
+PERIOD_VALUES: list = [x['value'] for x in PERIOD_OPTIONS]
+DEFAULT_PERIOD: int = 3  # Quarter
+
+
+@functools.lru_cache(maxsize=None)
+def layout() -> html.Div:
+    """ Tab layout, built on first use (see change_tab in index.py) """
+    return html.Div(
+        className="layout_box",
+        children=[
+            html.Div(
+                className='master_time_series dashbox',
+                id='bs_time_series_box',
+                children=[
+                    html.Fieldset(
+                        className='control_bar',
+                        children=[
+                            html.Span(
+                                children='Group By ',
+                            ),
+                            dcc.RadioItems(
+                                id='bs_period',
+                                options=PERIOD_OPTIONS,
+                                value=DEFAULT_PERIOD,
+                                style={'height': '1.2rem',
+                                       'color': 'var(--fg)',
+                                       'backgroundColor': 'var(--bg-more)'}
+                            ),
+                        ]),
+                    dcc.Graph(
+                        id='bsa_master_time_series'),
+                    dcc.Graph(
+                        id='bsl_master_time_series'),
+                    dcc.Graph(
+                        id='bse_master_time_series'),
+                ]),
+            html.Div(
+                id='bs_trans_table_box',
+                children=[
+                    html.Div(
+                        id='bs_trans_table_text',
+                        children=''
+                    ),
+                    html.Div(
+                        id='bs_trans_export',
+                        className='export_links'),
+                    dcc.Store(id='bs_trans_table_records',
+                              storage_type='memory'),
+                    bs_trans_table
+                ]),
+            html.Div(
+                id='kludge to eliminate "nonexistent object" errors',
+                style={'display': 'none'},
+                children=[
+                    html.Div(
+                        id='account_burst'),
+                    html.Div(
+                        id='burst_title'),
+                    html.Div(
+                        id='master_time_series'),
+                    html.Div(
+                        id='selected_trans_display'),
+                    html.Div(
+                        id='selected_account_text'),
+                    html.Div(
+                        id='time_series_resolution'),
+                    html.Div(
+                        id='time_series_selection_info'),
+                    html.Div(
+                        id='time_series_span'),
+                    html.Div(
+                        id='trans_table'),
+                    html.Div(
+                        id='trans_table_text'),
+                    html.Div(
+                        id='trans_export'),
+                    html.Div(
+                        id='trans_search'),
+                    html.Div(
+                        id='time_series_base'),
+                    html.Div(
+                        id='account_burst_base'),
+                    html.Div(
+                        id='trans_table_records'),
+                    html.Div(
+                        id='transaction_time_series'),
+                    html.Div(
+                        id='flow_sankey'),
+                    html.Div(
+                        id='account_search'),
+                    html.Div(
+                        id='sunburst_slices'),
+                    html.Div(
+                        id='time_series_refresh'),
+                    html.Div(
+                        id='cash_flow_precision'),
+                ]),
+        ])
+
+
+def bs_figures(ledger: Ledger, period_value: int) -> list:
+    """ The Assets, Liabilities and Equity figures, cumulative by period """
+    source, eras, account_tree, earliest_trans, latest_trans = ledger.view(ACCOUNTS)
+    # One task per (chart, subaccount) across all three charts, so the pool
+    # stays busy even when one chart has far more subaccounts than the others.
+    tasks = [(account, i, subaccount)
+             for account in ACCOUNTS
+             for i, subaccount in enumerate(get_descendents(account, account_tree))]
+
+    def area(subaccount: str, i: int) -> dict:
+        if source.count([subaccount]) > 0:
+            return make_cum_area(source, subaccount, i, period_value)
+
+    traces = parallel_map(lambda task: area(task[2], task[1]), tasks)
+    result = []
+    for account in ACCOUNTS:
+        result.append(figures.figure(
+            [trace for task, trace in zip(tasks, traces) if task[0] == account and trace is not None],
+            chart_template(
+                title={'text': account},
+                xaxis={'showgrid': True, 'dtick': 'M3'},
+                showlegend=True,
+                legend={'xanchor': 'left', 'x': 0, 'yanchor': 'bottom', 'y': 0, 'bgcolor': 'rgba(0, 0, 0, 0)'},
+                barmode='relative')))
+    return result
+
+
+def cached_bs_figures(ledger: Ledger, period_value: int) -> list:
+    return ledger.cached(('bs_figures', period_value), lambda: bs_figures(ledger, period_value))
+
 
-layout: html = html.Div(
-    className="layout_box",
-    children=[
-        html.Div(
-            className='master_time_series dashbox',
-            id='bs_time_series_box',
-            children=[
-                html.Fieldset(
-                    className='control_bar',
-                    children=[
-                        html.Span(
-                            children='Group By ',
-                        ),
-                        dcc.RadioItems(
-                            id='bs_period',
-                            options=[x for x in TIME_RES_OPTIONS if x['label'] != 'Era'],
-                            value=3,
-                            style={'height': '1.2rem',
-                                   'color': 'var(--fg)',
-                                   'backgroundColor': 'var(--bg-more)'}
-                        ),
-                    ]),
-                dcc.Graph(
-                    id='bsa_master_time_series'),
-                dcc.Graph(
-                    id='bsl_master_time_series'),
-                dcc.Graph(
-                    id='bse_master_time_series'),
-            ]),
-        html.Div(
-            id='bs_trans_table_box',
-            children=[
-                html.Div(
-                    id='bs_trans_table_text',
-                    children=''
-                ),
-                bs_trans_table
-            ]),
-        html.Div(
-            id='kludge to eliminate "nonexistent object" errors',
-            style={'display': 'none'},
-            children=[
-                html.Div(
-                    id='account_burst'),
-                html.Div(
-                    id='burst_title'),
-                html.Div(
-                    id='master_time_series'),
-                html.Div(
-                    id='selected_trans_display'),
-                html.Div(
-                    id='selected_account_text'),
-                html.Div(
-                    id='time_series_resolution'),
-                html.Div(
-                    id='time_series_selection_info'),
-                html.Div(
-                    id='time_series_span'),
-                html.Div(
-                    id='trans_table'),
-                html.Div(
-                    id='trans_table_text'),
-                html.Div(
-                    id='transaction_time_series'),
-            ]),
-    ])
+@standard_views
+def warm_up_views(ledger: Ledger) -> list:
+    """ Every period, default first, then the running balances used by selection """
+    periods = sorted(PERIOD_VALUES, key=lambda x: x != DEFAULT_PERIOD)
+    return [functools.partial(cached_bs_figures, ledger, x) for x in periods] + \
+        [lambda: ledger.view(ACCOUNTS)[0].prepare()]
 
 
 @app.callback(
@@ -93,37 +173,20 @@ layout: html = html.Div(
      Output('bse_master_time_series', 'figure')],
     [Input('bs_period', 'value')],
     state=[State('data_store', 'children')])
+@coalesced
 def bs_set_period(period_value, data_store):
     try:
         period = TIME_RES_LOOKUP[period_value]
     except IndexError:
         logging.critical(f'Bad data from period selectors: time_resolution {period}')
         return
-    trans, eras, account_tree, earliest_trans, latest_trans = data_from_json_store(data_store, ACCOUNTS)
-    result = []
-    for account in ACCOUNTS:
-        chart_fig = go.Figure(layout=chart_fig_layout)
-        subaccounts = get_descendents(account, account_tree)
-        for i, subaccount in enumerate(subaccounts):
-            tba = trans[trans['account'].isin([subaccount])]
-            if len(tba) > 0:
-                chart_fig.add_trace(make_cum_area(tba, subaccount, i, period_value))
-        chart_fig.update_layout(
-            title={'text': account},
-            xaxis={'showgrid': True, 'dtick': 'M3'},
-            showlegend=True,
-            legend={'xanchor': 'left', 'x': 0, 'yanchor': 'bottom', 'y': 0, 'bgcolor': 'rgba(0, 0, 0, 0)'},
-            barmode='relative')
-        if len(result) > 0:
-            result.append(chart_fig)
-        else:
-            result = [chart_fig]
-    return result
+    return cached_bs_figures(ledger_from_json_store(data_store), period_value)
 
 
 @app.callback(
-    [Output('bs_trans_table', 'data'),
-     Output('bs_trans_table_text', 'children')],
+    [Output('bs_trans_table_records', 'data'),
+     Output('bs_trans_table_text', 'children'),
+     Output('bs_trans_export', 'children')],
     [Input('bsa_master_time_series', 'selectedData'),
      Input('bsl_master_time_series', 'selectedData'),
      Input('bse_master_time_series', 'selectedData'),
@@ -142,9 +205,9 @@ def apply_selection_from_bs_time_series(bsa_master_time_series,
     inputs = {'bsa_master_time_series': bsa_master_time_series, 'bsl_master_time_series': bsl_master_time_series,
               'bse_master_time_series': bse_master_time_series}
     selection = inputs[click]
-    trans, eras, account_tree, earliest_trans, latest_trans = data_from_json_store(data_store, ACCOUNTS)
+    ledger = ledger_from_json_store(data_store)
+    source, eras, account_tree, earliest_trans, latest_trans = ledger.view(ACCOUNTS)
     trans_filter: dict = {}
-    sel_trans: pd.DataFrame = pd.DataFrame()
     sel_text: list = []
     for point in selection['points']:
         account = point['customdata']
@@ -154,22 +217,26 @@ def apply_selection_from_bs_time_series(bsa_master_time_series,
         except (KeyError, AttributeError):
             trans_filter[account] = [end_date]
 
-    for account in trans_filter.keys():
-        if not trans_filter[account]:
-            continue
-        end_date = max(trans_filter[account])
-        new_trans = trans.loc[(trans['account'] == account) & (trans['date'] <= end_date)]
-        sel_trans = sel_trans.append(new_trans)
-        new_text = f'{account}: {len(sel_trans)} records through {pretty_date(end_date)}'
+    through: dict = {account: max(dates) for account, dates in trans_filter.items() if dates}
+    sel_count: int = 0
+    for account, end_date in through.items():
+        sel_count += source.count([account], date_end=end_date)
+        new_text = f'{account}: {sel_count} records through {pretty_date(end_date)}'
         sel_text = sel_text + [new_text]
 
-    if len(sel_trans) == 0:
+    if sel_count == 0:
         raise PreventUpdate
 
-    sel_trans = sel_trans.set_index('date').sort_index()
-    sel_trans['total'] = sel_trans['amount'].cumsum()
-    sel_trans['date'] = pd.DatetimeIndex(sel_trans.index).strftime("%Y-%m-%d")
+    sel_trans: pd.DataFrame = source.running_rows(through)
 
     sel_output = [html.Span(children=x) for x in sel_text]
     final_label = list(intersperse(html.Br(), sel_output))
-    return [sel_trans.to_dict('records'), final_label]
+    links = export_links(ledger.id, [('through', f'{pretty_date(end_date)}:{account}')
+                                     for account, end_date in through.items()])
+    return [table_records(sel_trans), final_label, links]
+
+
+app.clientside_callback(
+    ClientsideFunction(namespace='ledger', function_name='format_table_dates'),
+    Output('bs_trans_table', 'data'),
+    [Input('bs_trans_table_records', 'data')])
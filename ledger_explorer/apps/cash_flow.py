@@ -1,162 +1,470 @@
+from __future__ import annotations
+
 import calendar
 import dash_core_components as dcc
-import dash_daq as daq
 import dash_html_components as html
 from datetime import datetime, timedelta
+import functools
 import logging
-import pandas as pd
-import numpy as np
 from typing import Tuple
 
-import plotly.graph_objects as go
-
-from dash.dependencies import Input, Output, State
+import dash
+from dash.dependencies import ClientsideFunction, Input, Output, State
 from dash.exceptions import PreventUpdate
-from utils import TIME_RES_OPTIONS, TIME_RES_LOOKUP, TIME_SPAN_LOOKUP, LEAF_SUFFIX, SUBTOTAL_SUFFIX
-from utils import chart_fig_layout, trans_table, data_from_json_store, pretty_date
-from utils import get_children, get_descendents
-from utils import make_bar, make_sunburst
+from utils import TIME_RES_OPTIONS, TIME_RES_LOOKUP, TIME_SPAN_LOOKUP, TIME_SPAN_JS, LEAF_SUFFIX, SUBTOTAL_SUFFIX
+from utils import MAX_SLICES, OTHER_SUFFIX, SLICES_OPTIONS, DAYS_PER_MONTH
+from utils import chart_template, export_links, trans_table, table_records, pretty_date
+from utils import get_children, get_descendents, era_at, NO_ERA
+from utils import make_bar, make_sankey, make_sunburst
+import figures
+from coalesce import coalesced
+from deadline import Candidate, within_budget
+from ledger import Ledger, ledger_from_json_store
+from sampling import SAMPLE_ROWS
+from parallel import parallel_map
+from warmup import standard_views
+from lazy import lazy_import
 
 from app import app
 
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
 
 ACCOUNTS = ['Income', 'Expenses']
 
-layout = html.Div(
-    className="layout_box",
-    children=[
-        html.Div(
-            id="time_series_box",
-            children=[
-                dcc.Graph(
-                    id='master_time_series'),
-                html.Div(
-                    className="control_bar",
-                    children=[
-                        dcc.Store(id='time_series_selection_info',
-                                  storage_type='memory'),
+# Figures are built in these spans and rescaled in the browser for the span toggle
+TIME_SERIES_BASE_SPAN = False  # Monthly
+SUNBURST_BASE_SPAN = True      # Annualized, so rounding to whole dollars loses less
+DEFAULT_TIME_RESOLUTION = 3    # Quarter
+REFRESH_INTERVAL_MS = 2000     # polling for an exact time series while a coarser one is shown
+PRECISION_OPTIONS = [{'label': 'Sampled', 'value': 'sampled'},
+                     {'label': 'Exact', 'value': 'exact'}]
+DEFAULT_PRECISION = 'sampled'  # where the ledger is sampled at all; see sampling.py
+
+
+@functools.lru_cache(maxsize=None)
+def layout() -> html.Div:
+    """ Tab layout, built on first use (see change_tab in index.py) """
+    import dash_daq as daq  # slow to import, and only needed here
+
+    return html.Div(
+        className="layout_box",
+        children=[
+            html.Div(
+                id="time_series_box",
+                children=[
+                    dcc.Graph(
+                        id='master_time_series'),
+                    dcc.Store(id='time_series_base',
+                              storage_type='memory'),
+                    dcc.Interval(id='time_series_refresh',
+                                 interval=REFRESH_INTERVAL_MS,
+                                 disabled=True),
+                    html.Div(
+                        className="control_bar",
+                        children=[
+                            dcc.Store(id='time_series_selection_info',
+                                      storage_type='memory'),
+                            html.Div(
+                                id='selected_trans_display',
+                                children=None),
+                            html.Fieldset(
+                                className='control_bar',
+                                children=[
+                                    html.Span(
+                                        children='Group By ',
+                                    ),
+                                    dcc.RadioItems(
+                                        id='time_series_resolution',
+                                        options=TIME_RES_OPTIONS,
+                                        value=DEFAULT_TIME_RESOLUTION,
+                                        style={'height': '1.2rem',
+                                               'color': 'var(--fg)',
+                                               'backgroundColor': 'var(--bg-more)'}
+                                    ),
+                                ]),
+                            html.Fieldset(
+                                className="control_bar",
+                                children=[
+                                    html.Span(
+                                        children='Monthly',
+                                    ),
+                                    daq.ToggleSwitch(
+                                        id='time_series_span',
+                                        value=False,
+                                    ),
+                                    html.Span(
+                                        children='Annualized',
+                                    ),
+                                ]),
+                            html.Fieldset(
+                                className='control_bar' if SAMPLE_ROWS else 'hidden',
+                                children=[
+                                    html.Span(
+                                        children='Totals ',
+                                    ),
+                                    dcc.RadioItems(
+                                        id='cash_flow_precision',
+                                        options=PRECISION_OPTIONS,
+                                        value=DEFAULT_PRECISION,
+                                        style={'height': '1.2rem',
+                                               'color': 'var(--fg)',
+                                               'backgroundColor': 'var(--bg-more)'}
+                                    ),
+                                ]),
+                        ]),
+                ]),
+            html.Div(
+                id="account_burst_box",
+                children=[
+                    html.Div([
+                        html.H3(
+                            id='burst_title',
+                            children=''),
                         html.Div(
-                            id='selected_trans_display',
-                            children=None),
-                        html.Fieldset(
-                            className='control_bar',
-                            children=[
-                                html.Span(
-                                    children='Group By ',
-                                ),
-                                dcc.RadioItems(
-                                    id='time_series_resolution',
-                                    options=TIME_RES_OPTIONS,
-                                    value=3,
-                                    style={'height': '1.2rem',
-                                           'color': 'var(--fg)',
-                                           'backgroundColor': 'var(--bg-more)'}
-                                ),
-                            ]),
-                        html.Fieldset(
-                            className="control_bar",
-                            children=[
-                                html.Span(
-                                    children='Monthly',
-                                ),
-                                daq.ToggleSwitch(
-                                    id='time_series_span',
-                                    value=False,
-                                ),
-                                html.Span(
-                                    children='Annualized',
-                                ),
-                            ]),
+                            id='selected_account_text',
+                            children='Click a pie slice to filter records'),
+                        dcc.Dropdown(
+                            id='account_search',
+                            placeholder='Find an account',
+                            options=[]),
                     ]),
-            ]),
-        html.Div(
-            id="account_burst_box",
-            children=[
-                html.Div([
-                    html.H3(
-                        id='burst_title',
-                        children=''),
+                    dcc.Graph(
+                        id='account_burst'),
+                    dcc.Store(id='account_burst_base',
+                              storage_type='memory'),
+                    html.Fieldset(
+                        className='control_bar',
+                        children=[
+                            html.Span(
+                                children='Slices ',
+                            ),
+                            dcc.RadioItems(
+                                id='sunburst_slices',
+                                options=SLICES_OPTIONS,
+                                value=MAX_SLICES,
+                                style={'height': '1.2rem',
+                                       'color': 'var(--fg)',
+                                       'backgroundColor': 'var(--bg-more)'}
+                            ),
+                        ]),
+                ]),
+            html.Div(
+                id='flow_sankey_box',
+                children=[
+                    dcc.Graph(
+                        id='flow_sankey'),
+                ]),
+            html.Div(
+                id='trans_table_box',
+                children=[
+                    dcc.Input(
+                        id='trans_search',
+                        type='search',
+                        debounce=True,
+                        placeholder='Search descriptions in all records'),
+                    html.Div(
+                        id='trans_table_text',
+                        children=''
+                    ),
                     html.Div(
-                        id='selected_account_text',
-                        children='Click a pie slice to filter records'),
+                        id='trans_export',
+                        className='export_links'),
+                    dcc.Store(id='trans_table_records',
+                              storage_type='memory'),
+                    trans_table
                 ]),
-                dcc.Graph(
-                    id='account_burst'),
-            ]),
-        html.Div(
-            id='trans_table_box',
-            children=[
-                html.Div(
-                    id='trans_table_text',
-                    children=''
-                ),
-                trans_table
-            ]),
-    ])
+        ])
+
+
+def cash_flow_view(ledger: Ledger, sampled: bool = False) -> tuple:
+    """ ledger.view of ACCOUNTS, or its sampled_view if sampled and the sample is ready """
+    return (sampled and ledger.sampled_view(ACCOUNTS)) or ledger.view(ACCOUNTS)
+
+
+def sampled_key(key: tuple, sampled: bool) -> tuple:
+    """ The ledger.cached key for the sampled variant of key """
+    return key + ('sampled',) if sampled else key
+
+
+def time_series_base(ledger: Ledger, time_resolution: int, sampled: bool = False) -> dict:
+    """
+    The time series in TIME_SERIES_BASE_SPAN units.  Monthly and
+    Annualized differ only by a constant factor, so the span toggle is
+    applied in the browser (scale_time_series in assets/clientside.js).
+    If sampled, the totals are estimated from the ledger's sample, and
+    marked as such, so a selection is totalled the same way.
+    """
+    source, eras, account_tree, earliest_trans, latest_trans = cash_flow_view(ledger, sampled)
+    root_account_id = account_tree.root  # TODO: Stub for controllable design
+    selected_accounts = get_children(root_account_id, account_tree)
+
+    traces = parallel_map(lambda i, account: make_bar(source, account_tree, eras, account, i, time_resolution,
+                                                      TIME_SERIES_BASE_SPAN, deep=True),
+                          range(len(selected_accounts)), selected_accounts)
+    result = _time_series_base(traces, time_resolution)
+    if sampled:
+        result['sampled'] = True
+    return result
+
+
+def _time_series_base(traces: list, time_resolution: int, note: str = None) -> dict:
+    chart_fig = figures.figure(traces, chart_template(
+        xaxis={'showgrid': True, 'dtick': 'M3'},
+        yaxis={'showgrid': True},
+        barmode='relative'))
+    result = dict(figure=chart_fig,
+                  months=TIME_SPAN_LOOKUP[TIME_SERIES_BASE_SPAN]['months'],
+                  spans=TIME_SPAN_JS,
+                  tr_label=TIME_RES_LOOKUP[time_resolution].get('label'))  # e.g., 'Era'
+    if note:
+        result['note'] = note
+    return result
+
+
+def burst_base(account_totals: pd.DataFrame,
+               start: np.datetime64,
+               end: np.datetime64,
+               max_slices: int = MAX_SLICES,
+               level: str = None) -> dict:
+    """
+    The sunburst in SUNBURST_BASE_SPAN units, rescaled in the browser by
+    scale_sunburst, zoomed to level, which is kept so the next zoom can
+    be worked out from it (see sunburst_level)
+    """
+    sun_fig = make_sunburst(account_totals, start, end, SUBTOTAL_SUFFIX, SUNBURST_BASE_SPAN, max_slices, level)
+    return dict(figure=sun_fig,
+                months=TIME_SPAN_LOOKUP[SUNBURST_BASE_SPAN]['months'],
+                spans=TIME_SPAN_JS,
+                start=pretty_date(start),
+                end=pretty_date(end),
+                level=level)
+
+
+def cached_time_series_base(ledger: Ledger, time_resolution: int, sampled: bool = False) -> dict:
+    return ledger.cached(sampled_key(('time_series_base', time_resolution), sampled),
+                         lambda: time_series_base(ledger, time_resolution, sampled))
+
+
+def time_series_candidate(ledger: Ledger, time_resolution: int, sampled: bool = False) -> Candidate:
+    """
+    cached_time_series_base, for within_budget, sized by the transactions
+    it reads, or sampled transactions, and the bars it draws
+    """
+    source, eras, account_tree, earliest_trans, latest_trans = cash_flow_view(ledger, sampled)
+    months = TIME_RES_LOOKUP[time_resolution].get('months')
+    if months:
+        periods = (latest_trans - earliest_trans) / np.timedelta64(1, 'D') / DAYS_PER_MONTH / months + 1
+    else:
+        periods = max(len(eras), 1)
+    bars = len(get_children(account_tree.root, account_tree)) * periods
+    return Candidate(sampled_key(('time_series_base', time_resolution), sampled),
+                     lambda: time_series_base(ledger, time_resolution, sampled),
+                     'time_series',
+                     (len(source.sample) if sampled else source.count()) + bars)
+
+
+def coarser_resolutions(time_resolution: int) -> list:
+    """ The resolutions with longer periods than time_resolution, finest first; none for Era """
+    months = TIME_RES_LOOKUP[time_resolution].get('months')
+    if not months:
+        return []
+    return sorted((key for key, value in TIME_RES_LOOKUP.items() if value.get('months', 0) > months),
+                  key=lambda x: TIME_RES_LOOKUP[x]['months'])
+
+
+def budgeted_time_series_base(ledger: Ledger,
+                              time_resolution: int,
+                              budget: float = None,
+                              sampled: bool = False) -> Tuple[dict, bool]:
+    """
+    The time series at time_resolution, sampled if asked and the sample
+    is ready, if it can be had within the time budget (see deadline.py),
+    or else the sampled one, or a coarser one, or an empty chart, noted as
+    such in its title, while the one asked for is computed.  Return the
+    time series, and whether it is the one asked for.
+
+    A coarser time series reads the same transactions as the exact one,
+    so it is only estimated to fit when it is ready already.
+    """
+    sampled = sampled and ledger.sampled_view(ACCOUNTS) is not None
+    exact = time_series_candidate(ledger, time_resolution, sampled)
+    stand_ins = [time_series_candidate(ledger, time_resolution, True)] \
+        if not sampled and ledger.sampled_view(ACCOUNTS) is not None else []
+    stand_ins += [time_series_candidate(ledger, x, sampled) for x in coarser_resolutions(time_resolution)
+                  if ledger.ready(sampled_key(('time_series_base', x), sampled))]
+    result, candidate = within_budget(ledger, exact, stand_ins, budget)
+    if candidate is exact:
+        return result, True
+    label = TIME_RES_LOOKUP[time_resolution]['label']
+    note = 'exact totals on their way' if candidate is not None and candidate.key[1] == time_resolution \
+        else f'{label} on its way'
+    if candidate is None:
+        return _time_series_base([], time_resolution, note), False
+    return dict(result, note=note), False
+
+
+def polled_time_series_base(ledger: Ledger, time_resolution: int, sampled: bool = False) -> Tuple[dict, bool]:
+    """
+    The time series budgeted_time_series_base is computing in the
+    background, if it is ready, without starting it again.  Return it, or
+    None, and whether it is still being computed.
+    """
+    sampled = sampled and ledger.sampled_view(ACCOUNTS) is not None
+    exact = time_series_candidate(ledger, time_resolution, sampled)
+    computing = ledger.computing(exact.key)
+    result, _ = within_budget(ledger, exact, [], 0, start=False)
+    return result, computing
+
+
+def cached_unfiltered_burst_base(ledger: Ledger,
+                                 max_slices: int = MAX_SLICES,
+                                 level: str = None,
+                                 sampled: bool = False) -> dict:
+    """
+    The sunburst of every Income and Expense transaction, shown when
+    nothing is selected.  The account totals are kept, so zooming only
+    rebuilds the figure, and the unzoomed figure is kept for each
+    max_slices, sampled or not.
+    """
+    sampled = sampled and ledger.sampled_view(ACCOUNTS) is not None
+    source, eras, account_tree, earliest_trans, latest_trans = cash_flow_view(ledger, sampled)
+    account_totals = ledger.cached(sampled_key(('account_totals', tuple(ACCOUNTS)), sampled), source.account_totals)
+    if level is not None:
+        return burst_base(account_totals, earliest_trans, latest_trans, max_slices, level)
+    return ledger.cached(sampled_key(('account_burst_base', max_slices), sampled),
+                         lambda: burst_base(account_totals, earliest_trans, latest_trans, max_slices))
+
+
+def sunburst_level(click_point: dict, level: str, account_tree) -> str:
+    """
+    The account to zoom the sunburst to after click_point: the account
+    clicked, if it has sub-accounts, or the parent of the current level if
+    the centre was clicked, as the chart itself zooms.  Clicks on leaves
+    don't zoom, except that an account chosen in the typeahead, whose
+    point has no curveNumber, is shown among its siblings.  Return level
+    if the zoom doesn't change, and None for the whole tree.
+    """
+    account = click_point.get('id', '')
+    if LEAF_SUFFIX in account or OTHER_SUFFIX in account or account_tree.get_node(account) is None:
+        return level
+    if account == level or not (account_tree.children(account) or 'curveNumber' in click_point):
+        parent = account_tree.parent(account)
+        account = parent.identifier if parent is not None else None
+    elif not account_tree.children(account):
+        return level
+    return None if account == account_tree.root else account
+
+
+def flow_sankey(ledger: Ledger, start: np.datetime64, end: np.datetime64) -> dict:
+    """ Flows between accounts between the dates, summed from the ledger's monthly flow matrix """
+    return make_sankey(ledger.flows().flows(start, end), ledger.account_tree, start, end)
+
+
+def cached_unfiltered_flow_sankey(ledger: Ledger) -> dict:
+    """ The flows over the whole time series, shown when nothing is selected """
+    source, eras, account_tree, earliest_trans, latest_trans = ledger.view(ACCOUNTS)
+    return ledger.cached(('flow_sankey',), lambda: flow_sankey(ledger, earliest_trans, latest_trans))
+
+
+@standard_views
+def warm_up_views(ledger: Ledger) -> list:
+    """
+    The sample, if any, the default time series resolution, the search
+    index, the other resolutions, the unfiltered sunburst, and the flows
+    """
+    resolutions = sorted((x['value'] for x in TIME_RES_OPTIONS), key=lambda x: x != DEFAULT_TIME_RESOLUTION)
+    return [ledger.sample, functools.partial(cached_time_series_base, ledger, resolutions[0]),
+            ledger.backend.prepare_search] + \
+        [functools.partial(cached_time_series_base, ledger, x) for x in resolutions[1:]] + \
+        [functools.partial(cached_unfiltered_burst_base, ledger),
+         functools.partial(cached_unfiltered_flow_sankey, ledger),
+         functools.partial(ledger.account_index, ACCOUNTS)]
 
 
 @app.callback(
-    [Output('master_time_series', 'figure')],
+    [Output('time_series_base', 'data'),
+     Output('time_series_refresh', 'disabled')],
     [Input('time_series_resolution', 'value'),
-     Input('time_series_span', 'value')],
+     Input('cash_flow_precision', 'value'),
+     Input('time_series_refresh', 'n_intervals')],
     state=[State('data_store', 'children')])
-def apply_time_series_resolution(time_resolution: int, time_span: bool, data_store: str):
+@coalesced
+def apply_time_series_resolution(time_resolution: int, precision: str, n_intervals: int, data_store: str):
+    """
+    The time series at the chosen resolution and precision, within the
+    time budget.  Until that one is ready, a sampled or coarser one is
+    shown, and time_series_refresh polls for it.
+    """
     try:
-        tr = TIME_RES_LOOKUP[time_resolution]
-        ts = TIME_SPAN_LOOKUP[time_span]
-        ts_label = ts.get('label')      # e.g., 'Annual' or 'Monthly'
-        tr_label = tr.get('label')          # e.g., 'by Era'
+        TIME_RES_LOOKUP[time_resolution]
     except KeyError:
         raise PreventUpdate
     except IndexError:
-        logging.critical(f'Bad data from period selectors: time_resolution {time_resolution}, time_span {time_span}')
+        logging.critical(f'Bad data from period selectors: time_resolution {time_resolution}')
+        raise PreventUpdate
+    if not data_store:
         raise PreventUpdate
 
-    trans, eras, account_tree, earliest_trans, latest_trans = data_from_json_store(data_store, ACCOUNTS)
-    chart_fig = go.Figure(layout=chart_fig_layout)
-    root_account_id = account_tree.root  # TODO: Stub for controllable design
-    selected_accounts = get_children(root_account_id, account_tree)
+    ledger = ledger_from_json_store(data_store)
+    triggers = [x['prop_id'] for x in dash.callback_context.triggered]
+    if triggers == ['time_series_refresh.n_intervals']:
+        # a poll doesn't wait: it picks up the exact time series once ready,
+        # and stops if its computation failed
+        base, computing = polled_time_series_base(ledger, time_resolution, precision == 'sampled')
+        if base is None and computing:
+            raise PreventUpdate
+        return [dash.no_update if base is None else base, True]
+    base, exact = budgeted_time_series_base(ledger, time_resolution, sampled=precision == 'sampled')
+    return [base, exact]
 
-    for i, account in enumerate(selected_accounts):
-        chart_fig.add_trace(make_bar(trans, account_tree, eras, account, i, time_resolution, time_span, deep=True))
 
-    ts_title = f'Average {ts_label} $, by {tr_label} '
-    chart_fig.update_layout(
-        title={'text': ts_title},
-        xaxis={'showgrid': True, 'dtick': 'M3'},
-        yaxis={'showgrid': True},
-        barmode='relative')
-
-    return [chart_fig]
+app.clientside_callback(
+    ClientsideFunction(namespace='ledger', function_name='scale_time_series'),
+    Output('master_time_series', 'figure'),
+    [Input('time_series_base', 'data'),
+     Input('time_series_span', 'value')])
 
 
 @app.callback(
     [Output('selected_trans_display', 'children'),
      Output('time_series_selection_info', 'data'),
-     Output('account_burst', 'figure'),
-     Output('burst_title', 'children')],
-    [Input('master_time_series', 'figure'),
-     Input('master_time_series', 'selectedData'),
-     Input('data_store', 'children')],
+     Output('account_burst_base', 'data')],
+    [Input('master_time_series', 'selectedData'),
+     Input('time_series_base', 'data'),
+     Input('data_store', 'children'),
+     Input('account_burst', 'clickData'),
+     Input('sunburst_slices', 'value')],
     state=[State('time_series_resolution', 'value'),
-           State('time_series_span', 'value')])
-def apply_selection_from_time_series(figure, selectedData, data_store, time_resolution, time_span):
+           State('account_burst_base', 'data')])
+@coalesced
+def apply_selection_from_time_series(selectedData, time_series_base, data_store, burst_clickData, max_slices,
+                                     time_resolution, account_burst_base):
     """
     Selecting specific points from the time series chart updates the
     account burst and the detail labels.
 
+    Clicking the sunburst, or changing its number of slices, only redraws
+    the sunburst, for the same selection.  The sunburst carries only a few
+    rings (see make_sunburst), so when a click zooms into an account, the
+    sunburst is redrawn with that account as its level, to bring in the
+    rings below it.
+
     Reminder to self: When you think selectedData input is broken, remember
     that unaltered default action in the graph is to zoom, not to select.
 
-    Note: all of the necessary information is in figure but that doesn't seem
-    to trigger reliably.  Adding selectedData as a second Input causes reliable
-    triggering.
+    Note: this reads the selection from selectedData, and the account for
+    each point from the base figure, rather than from the displayed figure,
+    so that toggling the time span (which only rescales the displayed
+    figure in the browser) doesn't call back to the server.  A new base
+    figure or dataset clears the selection.
 
     TODO: maybe check for input safety?
 
     """
 
-    if not figure or not data_store:  # prevent from crashing when triggered from other pages
+    if not time_series_base or not data_store:  # prevent from crashing when triggered from other pages
         raise PreventUpdate
 
     def _pretty_account_label(sel_accounts, desc_account_count, start, end, trans_count):
@@ -171,11 +479,11 @@ def apply_selection_from_time_series(figure, selectedData, data_store, time_reso
     min_period_start: np.datetime64 = None
     max_period_end: np.datetime64 = None
     sel_accounts = []
-    filtered_trans = pd.DataFrame()
+    selected_totals: list = []  # account totals of each selected point
+    filtered_count = 0
     desc_account_count = 0
     time_series_selection_info = None
-    tr_label = TIME_RES_LOOKUP[time_resolution]['label']
-    ts_label = TIME_SPAN_LOOKUP[time_span]['label']
+    tr_label = time_series_base['tr_label']  # while the exact time series is computed, maybe coarser than chosen
 
     def _month_end(date: np.datetime64) -> np.datetime64:
         # return the date of the last day of the month of the input date
@@ -190,9 +498,12 @@ def apply_selection_from_time_series(figure, selectedData, data_store, time_reso
     def _date_range_from_period(tr_label: str, period: str) -> Tuple[np.datetime64, np.datetime64]:
         # Convert period label to tuple of start and end dates, based on tr_label
         if tr_label == 'Era':
-            era = eras.loc[(eras['date_start'] < period) & (eras['date_end'] > period)]
-            period_start = era['date_start'][0]
-            period_end = era['date_end'][0]
+            # Era bars are plotted at the era midpoint
+            era = era_at(eras, period)
+            if era == NO_ERA:
+                raise PreventUpdate
+            period_start = eras['date_start'].iloc[era]
+            period_end = eras['date_end'].iloc[era]
         elif tr_label == 'Year':
             period_start = datetime(int(period), 1, 1)
             period_end = datetime(int(period), 12, 31)
@@ -215,15 +526,31 @@ def apply_selection_from_time_series(figure, selectedData, data_store, time_reso
             raise PreventUpdate
         return (np.datetime64(period_start), np.datetime64(period_end))
 
-    trans, eras, account_tree, earliest_trans, latest_trans = data_from_json_store(data_store, ACCOUNTS)
-    for trace in figure.get('data'):
-        account = trace.get('name')
-        points = trace.get('selectedpoints')
-        if not points:
-            continue
+    ledger = ledger_from_json_store(data_store)
+    source, eras, account_tree, earliest_trans, latest_trans = ledger.view(ACCOUNTS)
+    # totals the way the time series was drawn; counts are always exact
+    sampled = bool(time_series_base.get('sampled'))
+    totals_source = cash_flow_view(ledger, sampled)[0]
+    triggers = [x['prop_id'] for x in dash.callback_context.triggered]
+    max_slices = max_slices or MAX_SLICES
+    new_base = bool({'time_series_base.data', 'data_store.children'} & set(triggers))
+    sunburst_only = not new_base and 'master_time_series.selectedData' not in triggers
+    level = None if new_base or not account_burst_base else account_burst_base.get('level')
+    if 'account_burst.clickData' in triggers and burst_clickData:
+        new_level = sunburst_level(burst_clickData['points'][0], level, account_tree)
+        if sunburst_only and new_level == level:
+            raise PreventUpdate
+        level = new_level
+    selected_points: dict = {}
+    if selectedData and not new_base:
+        traces = time_series_base['figure']['data']
+        for point in selectedData.get('points', []):
+            account = traces[point['curveNumber']]['name']
+            selected_points.setdefault(account, []).append(point['x'])
+
+    for account, points in selected_points.items():
         sel_accounts.append(account)
-        for point in points:
-            point_x = trace['x'][point]
+        for point_x in points:
             period_start, period_end = _date_range_from_period(tr_label, point_x)
             if min_period_start is None:
                 min_period_start = period_start
@@ -236,17 +563,10 @@ def apply_selection_from_time_series(figure, selectedData, data_store, time_reso
             desc_accounts = get_descendents(account, account_tree)
             desc_account_count = desc_account_count + len(desc_accounts)
             subtree_accounts = [account] + desc_accounts
-            new_trans = trans.loc[trans['account'].isin(subtree_accounts)].\
-                loc[trans['date'] >= period_start].\
-                loc[trans['date'] <= period_end]
-
-            if len(filtered_trans) > 0:
-                filtered_trans = filtered_trans.append(new_trans)
-            else:
-                filtered_trans = new_trans
+            filtered_count += source.count(subtree_accounts, period_start, period_end)
+            selected_totals.append(totals_source.account_totals(subtree_accounts, period_start, period_end))
 
     # If no transactions are ultimately selected, show all accounts
-    filtered_count = len(filtered_trans)
     if filtered_count > 0:
         # TODO: desc_account_count is still wrong.
         sel_accounts_content = _pretty_account_label(sel_accounts, desc_account_count,
@@ -259,44 +579,117 @@ def apply_selection_from_time_series(figure, selectedData, data_store, time_reso
         # seleceted, in which case it would be confusing to get back
         # all trans instead of none, but this should never happen haha
         # because any clickable bar must have $$, and so, trans
-        sel_accounts_content = f'Click a bar in the graph to filter from {len(trans):,d} records'
-        filtered_trans = trans
+        selected_totals = []
+        filtered_count = source.count()
+        sel_accounts_content = f'Click a bar in the graph to filter from {filtered_count:,d} records'
         min_period_start = earliest_trans
         max_period_end = latest_trans
 
-    sun_fig = make_sunburst(filtered_trans, min_period_start, max_period_end,
-                            SUBTOTAL_SUFFIX,
-                            time_span)
-    time_series_selection_info = {'start': min_period_start, 'end': max_period_end, 'count': len(filtered_trans)}
+    time_series_selection_info = {'start': min_period_start, 'end': max_period_end, 'count': filtered_count}
+    if selected_totals:
+        account_totals = pd.concat(selected_totals)
+        sums = {x: (x, 'sum') for x in ['amount', 'variance'] if x in account_totals.columns}
+        account_totals = account_totals.\
+            groupby('full account name', sort=False).\
+            agg(account=('account', 'first'), **sums).\
+            reset_index()
+        sun_base = burst_base(account_totals, min_period_start, max_period_end, max_slices, level)
+    else:
+        sun_base = cached_unfiltered_burst_base(ledger, max_slices, level, sampled)
+
+    if sunburst_only:
+        return [dash.no_update, dash.no_update, sun_base]
+    return [sel_accounts_content, time_series_selection_info, sun_base]
+
 
-    title = f'Average {ts_label} $ from {pretty_date(min_period_start)} to {pretty_date(max_period_end)}'
-    return [sel_accounts_content, time_series_selection_info, sun_fig, title]
+app.clientside_callback(
+    ClientsideFunction(namespace='ledger', function_name='scale_sunburst'),
+    [Output('account_burst', 'figure'),
+     Output('burst_title', 'children')],
+    [Input('account_burst_base', 'data'),
+     Input('time_series_span', 'value')])
+
+
+@app.callback(
+    Output('flow_sankey', 'figure'),
+    [Input('time_series_selection_info', 'data'),
+     Input('data_store', 'children')])
+def apply_selection_to_flows(time_series_info, data_store):
+    """ The Sankey diagram shows where money moved in the dates selected in the time series """
+    if not data_store or not time_series_info:
+        raise PreventUpdate
+    ledger = ledger_from_json_store(data_store)
+    source, eras, account_tree, earliest_trans, latest_trans = ledger.view(ACCOUNTS)
+    start = pd.to_datetime(time_series_info.get('start', earliest_trans))
+    end = pd.to_datetime(time_series_info.get('end', latest_trans))
+    if start == earliest_trans and end == latest_trans:
+        return cached_unfiltered_flow_sankey(ledger)
+    return flow_sankey(ledger, start, end)
+
+
+@app.callback(
+    Output('account_search', 'options'),
+    [Input('account_search', 'search_value')],
+    state=[State('account_search', 'value'),
+           State('data_store', 'children')])
+def account_typeahead(search_value: str, value: str, data_store: str) -> list:
+    """
+    Offer the accounts matching the typed text, from the ledger's account
+    index, labelled with their totals over the whole ledger.  The selected
+    account stays among the options, so the dropdown can still show it.
+    """
+    if not data_store:
+        raise PreventUpdate
+    index = ledger_from_json_store(data_store).account_index(ACCOUNTS)
+    matches = index.find(search_value or '')
+    if value and value not in [x.account for x in matches]:
+        matches = matches + [x for x in index.matches if x.account == value]
+    return [{'label': f'{x.path}  {x.subtotal:,.0f}', 'value': x.account} for x in matches]
 
 
 @app.callback(
-    [Output('trans_table', 'data'),
+    Output('account_burst', 'clickData'),
+    [Input('account_search', 'value')])
+def apply_account_search(account: str) -> dict:
+    """ Choosing an account in the typeahead selects it as if its sunburst slice were clicked """
+    if not account:
+        raise PreventUpdate
+    return {'points': [{'id': account}]}
+
+
+@app.callback(
+    [Output('trans_table_records', 'data'),
      Output('selected_account_text', 'children'),
-     Output('trans_table_text', 'children')],
+     Output('trans_table_text', 'children'),
+     Output('trans_export', 'children')],
     [Input('account_burst', 'clickData'),
      Input('time_series_selection_info', 'data'),
-     Input('data_store', 'children')])
-def apply_burst_click(burst_clickData, time_series_info, data_store):
+     Input('data_store', 'children'),
+     Input('trans_search', 'value')])
+def apply_burst_click(burst_clickData, time_series_info, data_store, search_text):
     """
     Clicking on a slice in the Sunburst updates the transaction list with matching transactions
 
+    Text in the search box narrows the list to transactions with matching
+    descriptions, using the ledger's search index rather than the table's
+    own filter, so it covers every record in the selected accounts and dates.
+
     TODO: maybe check for input safety?
     """
 
-    if not burst_clickData:  # prevent from crashing when triggered from other pages
+    # prevent from crashing when triggered from other pages
+    if not data_store or not time_series_info or not (burst_clickData or search_text):
         raise PreventUpdate
 
-    trans, eras, account_tree, earliest_trans, latest_trans = data_from_json_store(data_store, ACCOUNTS)
+    ledger = ledger_from_json_store(data_store)
+    source, eras, account_tree, earliest_trans, latest_trans = ledger.view(ACCOUNTS)
 
     date_start: np.datetime64 = pd.to_datetime(time_series_info.get('start', earliest_trans))
     date_end: np.datetime64 = pd.to_datetime(time_series_info.get('end', latest_trans))
     max_trans_count = time_series_info.get('count', 0)
 
     sub_accounts: list = []
+    folded: list = []
 
     # Figure out which account(s) were selected in the sunburst click
     if burst_clickData:
@@ -306,32 +699,54 @@ def apply_burst_click(burst_clickData, time_series_info, data_store):
             revised_id = click_account.replace(LEAF_SUFFIX, '')
         elif SUBTOTAL_SUFFIX in click_account:
             revised_id = click_account.replace(SUBTOTAL_SUFFIX, '')
+        elif OTHER_SUFFIX in click_account:
+            # only the slices folded into Other, which the sunburst lists in the slice's customdata
+            revised_id = click_account.replace(OTHER_SUFFIX, '')
+            folded = burst_clickData['points'][0].get('customdata') or []
+            if not folded:
+                raise PreventUpdate
         else:
             revised_id = click_account
     else:
         revised_id = []
 
     # if any accounts are selected, get those transactions.  Otherwise, get all transactions.
-    if revised_id:
+    if folded:
+        # a folded leaf slice is its account's own transactions; other folded slices have subtrees
+        filter_accounts = list(dict.fromkeys(
+            x for slice_id in folded for x in
+            ([slice_id.replace(LEAF_SUFFIX, '')] if LEAF_SUFFIX in slice_id else
+             [slice_id] + get_descendents(slice_id, account_tree))))
+        account_text = f'{len(filter_accounts)} accounts in Other {revised_id} selected'
+    elif revised_id:
         # Add any sub-accounts
         sub_accounts = get_descendents(revised_id, account_tree)
         filter_accounts = [revised_id] + sub_accounts
-        sel_trans = trans[trans['account'].isin(filter_accounts)]
         if (len_sub := len(sub_accounts)) > 0:
             account_text = f'{revised_id} and {len_sub} sub-accounts selected'
         else:
             account_text = f'{revised_id} selected'
     else:
-        sel_trans = trans
+        filter_accounts = ledger.accounts(ACCOUNTS)
         account_text = f'Click a pie slice to filter from {max_trans_count} records'
 
-    try:
-        sel_trans = sel_trans[(sel_trans['date'] >= date_start) & (sel_trans['date'] <= date_end)]
-    except (KeyError, TypeError):
-        pass
-    sel_trans['date'] = pd.DatetimeIndex(sel_trans['date']).strftime("%Y-%m-%d")
+    if search_text:
+        sel_trans = ledger.search(search_text, filter_accounts, date_start, date_end)
+        account_text = f'{account_text}, matching "{search_text}"'
+    else:
+        sel_trans = source.rows(filter_accounts if revised_id else None, date_start, date_end)
     sel_trans = sel_trans.sort_values(['date'])
 
     trans_table_text: str = f'{len(sel_trans)} records'
+    export_accounts: list = filter_accounts if folded else [revised_id] if revised_id else ACCOUNTS
+    export_selection: list = [('account', x) for x in export_accounts] + ([('deep', '0')] if folded else []) + \
+        [('start', pretty_date(date_start)), ('end', pretty_date(date_end))] + \
+        ([('q', search_text)] if search_text else [])
+
+    return [table_records(sel_trans), account_text, trans_table_text, export_links(ledger.id, export_selection)]
+
 
-    return [sel_trans.to_dict('records'), account_text, trans_table_text]
+app.clientside_callback(
+    ClientsideFunction(namespace='ledger', function_name='format_table_dates'),
+    Output('trans_table', 'data'),
+    [Input('trans_table_records', 'data')])
@@ -1,77 +1,96 @@
-import numpy as np
+from __future__ import annotations
+
+import functools
 import json
-import pandas as pd
 from treelib import Tree
 from typing import Iterable, List
 from urllib import error
 
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output, State
-from utils import load_eras, load_transactions, make_account_tree_from_trans, ROOT_ACCOUNTS, get_descendents, pretty_date
-
+from dash.dependencies import Input, Output, State, MATCH
+from dash.exceptions import PreventUpdate
+from utils import load_eras, load_transactions, make_account_tree_from_trans, flip_signs, pretty_date
+from utils import DATA_DIR, assign_eras, data_file, transaction_sources
+from backend import SQLiteBackend
+from ledger import Ledger, admit, dataset_id, ledger_from_json_store, register_ledger, sqlite_dataset_id
+from memory import MemoryBudgetError, deep_size
+import snapshot
+import warmup
+from lazy import lazy_import
 
 from app import app
 
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+# e.g., sqlite:///ledger.sqlite, relative to DATA_DIR, like other files on the server
+SQLITE_PREFIX: str = 'sqlite:///'
+MAX_TREE_CHILDREN: int = 100  # account tree rows fetched per expand
 
-layout = html.Div(
-    className="layout_box",
-    children=[
-        html.Div(
-            id='data_tab_body',
-            className="control_bar dashbox",
-            children=[
-                html.Fieldset([
-                    html.Div([
-                        html.Label(
-                            htmlFor='transactions_url',
-                            children='Transaction Source URL'),
-                        dcc.Input(
-                            id='transactions_url',
-                            type='url',
-                            value='http://localhost/transactions.csv',
-                            placeholder='URL for transaction csv file'
-                        )]),
-                    html.Div([
-                        html.Label(
-                            htmlFor='eras_url',
-                            children='Eras source URL (optional)'),
-                        dcc.Input(
-                            id='eras_url',
-                            type='url',
-                            value='http://localhost/eras.csv',
-                            placeholder='URL for eras csv file'
-                        )]),
-                    html.Div([
-                        html.Button('Reload', id='data_load_button')
+
+@functools.lru_cache(maxsize=None)
+def layout() -> html.Div:
+    """ Tab layout, built on first use (see change_tab in index.py) """
+    return html.Div(
+        className="layout_box",
+        children=[
+            html.Div(
+                id='data_tab_body',
+                className="control_bar dashbox",
+                children=[
+                    html.Fieldset([
+                        html.Div([
+                            html.Label(
+                                htmlFor='transactions_url',
+                                children='Transaction Source URLs'),
+                            dcc.Input(
+                                id='transactions_url',
+                                type='text',
+                                value='http://localhost/transactions.csv',
+                                placeholder='URLs of transaction csv files, comma-separated; '
+                                            'or globs in the data directory'
+                            )]),
+                        html.Div([
+                            html.Label(
+                                htmlFor='eras_url',
+                                children='Eras source URL (optional)'),
+                            dcc.Input(
+                                id='eras_url',
+                                type='url',
+                                value='http://localhost/eras.csv',
+                                placeholder='URL for eras csv file'
+                            )]),
+                        html.Div([
+                            html.Button('Reload', id='data_load_button')
+                        ]),
                     ]),
                 ]),
-            ]),
-        html.Div(id='meta_data_box',
-                 children=[
-                     html.H4("Files Loaded"),
-                     html.Div(
-                         id='meta_data',
-                         children=[]),
-                 ]),
-        html.Div(id='account_tree_box',
-                 children=[
-                     html.H4("Account Tree Loaded"),
-                     html.Div(
-                         id='account_tree',
-                         className='code',
-                         children=[]),
+            html.Div(id='meta_data_box',
+                     children=[
+                         html.H4("Files Loaded"),
+                         html.Div(
+                             id='meta_data',
+                             children=[]),
                      ]),
-        html.Div(id='records_box',
-                 children=[
-                     html.H4("Transactions Loaded"),
-                     html.Div(
-                         id='records',
-                         className='code',
-                         children=[
+            html.Div(id='account_tree_box',
+                     children=[
+                         html.H4("Account Tree Loaded"),
+                         html.Div(
+                             id='account_tree',
+                             className='code',
+                             children=[]),
                          ]),
-                 ]),
-    ])
+            html.Div(id='records_box',
+                     children=[
+                         html.H4("Transactions Loaded"),
+                         html.Div(
+                             id='records',
+                             className='code',
+                             children=[
+                             ]),
+                     ]),
+        ])
 
 
 @app.callback(
@@ -83,40 +102,142 @@ layout = html.Div(
     state=[State('transactions_url', 'value'),
            State('eras_url', 'value')])
 def load_data(n_clicks: int, transactions_url: str, eras_url: str) -> Iterable:
-    try:
-        trans: pd.DataFrame = load_transactions(transactions_url)
-    except error.URLError as E:
-        return [None, f'Error loading transactions: {E}', None, None]
+    sources: list = [transactions_url, eras_url]
+    if not n_clicks:
+        # the page's first load, rather than Reload; a snapshot of the same sources saves reading them
+        response = snapshot.response_for(sources)
+        if response is not None:
+            return render_load(response)
 
-    account_tree: Tree = make_account_tree_from_trans(trans)
-    for account in [ra for ra in ROOT_ACCOUNTS if ra['flip_negative'] is True]:
-        trans['amount'] = np.where(trans['account'].isin(get_descendents(account['id'], account_tree)),
-                                   trans['amount'] * -1,
-                                   trans['amount'])
+    if transactions_url and transactions_url.strip().startswith(SQLITE_PREFIX):
+        source: str = transactions_url.strip()[len(SQLITE_PREFIX):]
+        try:
+            path: str = data_file(source, DATA_DIR)
+            backend = SQLiteBackend(path)
+        except (FileNotFoundError, PermissionError) as E:
+            return [None, f'Error loading transactions: {E}', None, None]
+        earliest_trans, latest_trans = backend.date_range()
+        eras = _load_eras(eras_url, earliest_trans, latest_trans)
+        data = dict(sqlite=path, eras=eras.to_json(orient='split', date_format='%Y%m%d'))
+        data['id'] = sqlite_dataset_id(path, data['eras'])
+        ledger = Ledger(backend, eras, data['id'])
+        source_text = source
+    else:
+        try:
+            files: List[str] = transaction_sources(transactions_url, files=DATA_DIR is not None, root=DATA_DIR)
+            trans: pd.DataFrame = load_transactions(files)
+        except (error.URLError, FileNotFoundError, PermissionError) as E:
+            return [None, f'Error loading transactions: {E}', None, None]
 
-    earliest_trans: np.datetime64 = trans['date'].min()
-    latest_trans: np.datetime64 = trans['date'].max()
+        trans = flip_signs(trans, make_account_tree_from_trans(trans))
 
-    try:
-        eras: pd.DataFrame = load_eras(eras_url, earliest_trans, latest_trans)
-    except error.URLError:
-        eras = pd.DataFrame()
+        earliest_trans: np.datetime64 = trans['date'].min()
+        latest_trans: np.datetime64 = trans['date'].max()
+        eras = _load_eras(eras_url, earliest_trans, latest_trans)
+
+        # era binning is done once here, so era bars and era selection are integer lookups
+        trans['era'] = assign_eras(trans['date'].to_numpy(), eras)
+
+        data = dict(trans=trans.to_json(orient='split', date_format='%Y%m%d'),
+                    eras=eras.to_json(orient='split', date_format='%Y%m%d'))
+        data['id'] = dataset_id(data['trans'], data['eras'])
+        # the frames, and their JSON while it is sent, must fit the worker's memory budget
+        try:
+            admit(deep_size(trans) + deep_size(eras) + deep_size(data['trans']), data['id'])
+        except MemoryBudgetError as E:
+            return [None, f'Error loading transactions: {E}', None, None]
+        ledger = Ledger(trans, eras, data['id'])
+        source_text = files[0] if len(files) == 1 else f'{len(files)} files'
 
-    data = dict(trans=trans.to_json(orient='split', date_format='%Y%m%d'),
-                eras=eras.to_json(orient='split', date_format='%Y%m%d'))
-    meta_info: list = [f'Data loaded: {len(trans)} records',
+    # precompute the standard Cash Flow and Balance Sheet views in the background
+    warm_up = warmup.start(register_ledger(ledger))
+    record_count: int = ledger.backend.count()
+    meta_info: list = [f'Data loaded: {record_count} records from {source_text}',
                        f'Earliest record: {pretty_date(earliest_trans)}',
                        f'Latest record: {pretty_date(latest_trans)}',
                        f'Eras loaded: {len(eras)}']
-    meta_html: list = [html.Div(children=x) for x in meta_info]
+    records: list = ['first 5 records'] + ledger.backend.rows(limit=5).values.tolist() + \
+        [''] + ['last 5 records'] + ledger.backend.rows(offset=max(record_count - 5, 0)).values.tolist()
+    account_tree: Tree = ledger.account_tree
+    tree_records: List[dict] = tree_nodes(ledger, account_tree.root)
 
-    records: list = ['first 5 records'] + trans.head(n=5).values.tolist() + \
-        [''] + ['last 5 records'] + trans.tail(n=5).values.tolist()
-    records_html: List[str] = [html.Div(children=x, className='code_row') for x in records]
+    response = dict(data_store=json.dumps(data), meta_info=meta_info, tree_size=len(account_tree),
+                    tree_records=tree_records, records=records)
+    snapshot.save_after(warm_up, ledger, sources, response)
+    return render_load(response)
 
-    tree_records: List[str] = [f'Tree nodes: {len(account_tree)}'] + [x.tag for x in account_tree.all_nodes()]
 
-    account_tree_html: List[str] = [html.Div(children=x, className='code_row') for x in tree_records]
-    result = [json.dumps(data), meta_html, account_tree_html, records_html]
+def render_load(response: dict) -> list:
+    """ The outputs of load_data, from the dataset and the text describing it """
+    meta_html: list = [html.Div(children=x) for x in response['meta_info']]
+    records_html: List[str] = [html.Div(children=x, className='code_row') for x in response['records']]
+    account_tree_html: list = [html.Div(children=f'Tree nodes: {response["tree_size"]}', className='code_row')] + \
+        render_tree_nodes(response['tree_records'])
+    return [response['data_store'], meta_html, account_tree_html, records_html]
 
+
+def tree_nodes(ledger: Ledger, parent: str, page: int = 0) -> List[dict]:
+    """
+    One page of the children of parent in the account tree, as records
+    for render_tree_nodes, with the transaction count and total of each
+    child's subtree from the ledger's account summary.  If there are more
+    children, a last record stands for the next page.
+    """
+    account_tree: Tree = ledger.account_tree
+    summary: pd.DataFrame = ledger.account_summary()
+    children: list = sorted(account_tree.children(parent), key=lambda x: x.tag)
+    start: int = page * MAX_TREE_CHILDREN
+    records: List[dict] = [{'account': x.identifier,
+                            'tag': x.tag,
+                            'count': int(summary.at[x.identifier, 'subcount']),
+                            'total': int(summary.at[x.identifier, 'subtotal']),
+                            'leaf': not account_tree.children(x.identifier)}
+                           for x in children[start:start + MAX_TREE_CHILDREN]]
+    if (more := len(children) - start - MAX_TREE_CHILDREN) > 0:
+        records.append({'account': parent, 'page': page + 1, 'more': more})
+    return records
+
+
+def render_tree_nodes(records: List[dict]) -> list:
+    """
+    Rows of the account tree.  Accounts with children, and further pages
+    of children, are collapsed, and fetch their rows when first clicked
+    (see expand_tree_node), so only the rows opened are ever sent.
+    """
+    result: list = []
+    for record in records:
+        if 'more' in record:
+            label = f'{record["more"]:,d} more account' + ('s' if record['more'] > 1 else '')
+            node_id = {'account': record['account'], 'page': record['page']}
+        else:
+            label = f'{record["tag"]}  {record["count"]:,d} records  {record["total"]:,d}'
+            if record['leaf']:
+                result.append(html.Div(children=label, className='code_row'))
+                continue
+            node_id = {'account': record['account'], 'page': 0}
+        result.append(html.Details(
+            className='tree_node',
+            children=[html.Summary(id={'type': 'tree_node', **node_id}, children=label),
+                      html.Div(id={'type': 'tree_children', **node_id}, className='tree_children')]))
     return result
+
+
+@app.callback(
+    Output({'type': 'tree_children', 'account': MATCH, 'page': MATCH}, 'children'),
+    [Input({'type': 'tree_node', 'account': MATCH, 'page': MATCH}, 'n_clicks')],
+    state=[State({'type': 'tree_node', 'account': MATCH, 'page': MATCH}, 'id'),
+           State('data_store', 'children')])
+def expand_tree_node(n_clicks: int, node_id: dict, data_store: str) -> list:
+    """ Fetch a node's rows on its first expand; after that, the browser shows and hides them """
+    if n_clicks != 1 or not data_store:
+        raise PreventUpdate
+    return render_tree_nodes(tree_nodes(ledger_from_json_store(data_store), node_id['account'], node_id['page']))
+
+
+def _load_eras(eras_url: str, earliest_trans: np.datetime64, latest_trans: np.datetime64) -> pd.DataFrame:
+    try:
+        # a local eras file, like the transactions, only from within DATA_DIR
+        sources = transaction_sources([eras_url or ''], files=DATA_DIR is not None, root=DATA_DIR)
+        return load_eras(sources[0] if sources else eras_url, earliest_trans, latest_trans)
+    except (error.URLError, FileNotFoundError, PermissionError):
+        return pd.DataFrame()
@@ -0,0 +1,57 @@
+/*
+ * Clientside callbacks.  These handle interactions that only rescale or
+ * reformat data the server already sent, so they need no round trip.
+ */
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    ledger: {
+        /*
+         * Figures are stored in base units (base.months per period) and
+         * rescaled here to the selected time span (Monthly or Annualized).
+         */
+        scale_time_series: function(base, time_span) {
+            if (!base || !base.figure) {
+                return window.dash_clientside.no_update;
+            }
+            const span = base.spans[String(Boolean(time_span))];
+            const factor = span.months / base.months;
+            const figure = base.figure;
+            const layout = Object.assign({}, figure.layout);
+            // base.note marks a coarser time series shown while the exact one is computed
+            const note = base.note ? ' (' + base.note + ')' : ' ';
+            layout.title = Object.assign({}, layout.title,
+                                         {text: 'Average ' + span.label + ' $, by ' + base.tr_label + note});
+            return {
+                data: figure.data.map(trace => Object.assign({}, trace, {y: trace.y.map(y => y * factor)})),
+                layout: layout
+            };
+        },
+
+        scale_sunburst: function(base, time_span) {
+            if (!base || !base.figure) {
+                return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+            }
+            const span = base.spans[String(Boolean(time_span))];
+            const factor = span.months / base.months;
+            const figure = base.figure;
+            const title = 'Average ' + span.label + ' $ from ' + base.start + ' to ' + base.end;
+            return [
+                {
+                    data: figure.data.map(trace => Object.assign({}, trace,
+                                                                 {values: trace.values.map(v => v * factor)})),
+                    layout: figure.layout
+                },
+                title
+            ];
+        },
+
+        /* Table records carry dates as epoch milliseconds; show them as YYYY-MM-DD. */
+        format_table_dates: function(records) {
+            if (!records) {
+                return window.dash_clientside.no_update;
+            }
+            return records.map(record => Object.assign({}, record,
+                                                       {date: new Date(record.date).toISOString().slice(0, 10)}));
+        }
+    }
+});
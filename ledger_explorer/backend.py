@@ -0,0 +1,704 @@
+"""
+Query backends: the operations the tabs and the API need from a ledger's
+transactions, so the transactions can live in memory or on disk.
+
+MemoryBackend keeps them in a pandas DataFrame, as loaded from CSV.
+SQLiteBackend queries an on-disk SQLite database instead, for ledgers too
+big for memory; only aggregates and the requested rows are read.  Create
+the database from Gnucash exports with:
+
+    python ledger_explorer/backend.py ledger.sqlite exports/*.csv
+
+and load it in the Data Source tab as sqlite:///path/to/ledger.sqlite.
+
+Every operation takes optional filters: accounts, a list of account names
+(with no subtree expansion; see Ledger.accounts), and date_start and
+date_end, inclusive.  Rows come back in the order they were loaded.
+"""
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from flows import FLOW_COLUMNS, pair_splits
+from lazy import lazy_import
+from search import SearchIndex
+import utils
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+ROW_COLUMNS: list = ['date', 'description', 'amount', 'account', 'full account name']
+CHUNK_ROWS: int = 10_000
+
+
+def _timestamp(date) -> pd.Timestamp:
+    return None if date is None else pd.Timestamp(date)
+
+
+class QueryBackend(ABC):
+    """ Read-only access to a ledger's transactions """
+
+    @abstractmethod
+    def accounts(self) -> pd.DataFrame:
+        """ One row per account, with 'account' and 'full account name', in order of first appearance """
+
+    @abstractmethod
+    def date_range(self, accounts: Iterable[str] = None) -> Tuple[pd.Timestamp, pd.Timestamp]:
+        """ Earliest and latest transaction dates """
+
+    @abstractmethod
+    def count(self, accounts: Iterable[str] = None, date_start=None, date_end=None) -> int:
+        pass
+
+    @abstractmethod
+    def daily_totals(self, accounts: Iterable[str] = None, date_start=None, date_end=None) -> pd.Series:
+        """ Total amount on each date with transactions, indexed by date """
+
+    @abstractmethod
+    def account_totals(self, accounts: Iterable[str] = None, date_start=None, date_end=None) -> pd.DataFrame:
+        """ Total amount and number of transactions of each account with
+        transactions, as columns 'account', 'full account name', 'amount' and
+        'count', in order of first appearance """
+
+    @abstractmethod
+    def rows(self,
+             accounts: Iterable[str] = None,
+             date_start=None,
+             date_end=None,
+             offset: int = 0,
+             limit: int = None) -> pd.DataFrame:
+        """ Transactions, with at least the ROW_COLUMNS, starting at offset, and at most limit of them """
+
+    @abstractmethod
+    def search(self, query: str, accounts: Iterable[str] = None, date_start=None, date_end=None) -> pd.DataFrame:
+        """ Transactions whose description contains every word in query """
+
+    @abstractmethod
+    def daily_flows(self, flipped: Iterable[str]) -> pd.DataFrame:
+        """
+        Flows between accounts on each date, as flows.pair_splits, for all
+        transactions; flipped are the accounts whose amounts flip_signs reversed.
+        """
+
+    def scoped(self, accounts: Iterable[str]) -> QueryBackend:
+        """ This backend, limited to transactions in accounts """
+        return ScopedBackend(self, accounts)
+
+    def period_totals(self, accounts: Iterable[str], time_resolution: int) -> pd.Series:
+        """ As utils.period_totals, for the transactions in accounts """
+        daily = self.daily_totals(accounts)
+        return utils.period_totals(pd.DataFrame({'date': daily.index, 'amount': daily.values}), time_resolution)
+
+    def period_variances(self, accounts: Iterable[str], time_resolution: int) -> Optional[pd.Series]:
+        """
+        Variances of period_totals, for backends that estimate them from a
+        sample (see sampling.py); None for exact totals.  Such backends'
+        era_totals and account_totals have a 'variance' column too.
+        """
+        return None
+
+    def period_estimates(self, accounts: Iterable[str],
+                         time_resolution: int) -> Tuple[pd.Series, Optional[pd.Series]]:
+        """ period_totals and period_variances together, so a sample is only estimated from once """
+        return self.period_totals(accounts, time_resolution), self.period_variances(accounts, time_resolution)
+
+    def balances(self, accounts: Iterable[str], time_resolution: int) -> pd.Series:
+        """ Cumulative total at the end of each period """
+        return self.period_totals(accounts, time_resolution).cumsum()
+
+    def era_totals(self, accounts: Iterable[str], eras: pd.DataFrame) -> pd.DataFrame:
+        """ As utils.era_totals, for the transactions in accounts """
+        daily = self.daily_totals(accounts)
+        return utils.era_totals(pd.DataFrame({'date': daily.index, 'amount': daily.values}), eras)
+
+    def balance(self, accounts: Iterable[str], date_end) -> int:
+        """ Total of the transactions in accounts through date_end """
+        return int(self.daily_totals(accounts, date_end=date_end).sum())
+
+    def running_rows(self, through: Dict[str, object]) -> pd.DataFrame:
+        """
+        Transactions in each account of through up to the date it maps to,
+        in date order, with the running balance as 'total'.  Transactions on
+        the same date are in the order of the accounts in through, then as loaded.
+        """
+        frames = [self.rows([account], date_end=date_end) for account, date_end in through.items()]
+        if not frames:
+            return pd.DataFrame(columns=ROW_COLUMNS + ['total'])
+        result = pd.concat(frames).sort_values('date', kind='stable')
+        return result.assign(total=result['amount'].cumsum())
+
+    @abstractmethod
+    def chunks(self,
+               accounts: Iterable[str] = None,
+               date_start=None,
+               date_end=None,
+               query: str = None,
+               size: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+        """
+        The transactions, or those matching query as in search, in date
+        order (as loaded within a date), as frames of up to size rows with
+        the ROW_COLUMNS, e.g., for streaming an export.
+        """
+
+    @abstractmethod
+    def running_chunks(self, through: Dict[str, object], size: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+        """ running_rows(through), as frames of up to size rows with the ROW_COLUMNS and 'total' """
+
+    def prepare(self) -> None:
+        """ Build any indexes now, rather than on first use """
+
+    def prepare_search(self) -> None:
+        """ Build the index behind search now, rather than on the first search """
+
+
+class ScopedBackend(QueryBackend):
+    """ Another backend, limited to some accounts; for filter arguments of None """
+
+    def __init__(self, backend: QueryBackend, accounts: Iterable[str]):
+        self.backend: QueryBackend = backend
+        self.scope: list = list(accounts)
+
+    def _accounts(self, accounts: Iterable[str]) -> list:
+        return self.scope if accounts is None else list(accounts)
+
+    def accounts(self) -> pd.DataFrame:
+        accounts = self.backend.accounts()
+        return accounts[accounts['account'].isin(self.scope)]
+
+    def date_range(self, accounts=None):
+        return self.backend.date_range(self._accounts(accounts))
+
+    def count(self, accounts=None, date_start=None, date_end=None):
+        return self.backend.count(self._accounts(accounts), date_start, date_end)
+
+    def daily_totals(self, accounts=None, date_start=None, date_end=None):
+        return self.backend.daily_totals(self._accounts(accounts), date_start, date_end)
+
+    def account_totals(self, accounts=None, date_start=None, date_end=None):
+        return self.backend.account_totals(self._accounts(accounts), date_start, date_end)
+
+    def rows(self, accounts=None, date_start=None, date_end=None, offset=0, limit=None):
+        return self.backend.rows(self._accounts(accounts), date_start, date_end, offset, limit)
+
+    def search(self, query, accounts=None, date_start=None, date_end=None):
+        return self.backend.search(query, self._accounts(accounts), date_start, date_end)
+
+    def daily_flows(self, flipped):
+        # the other side of a transaction may be outside the scope
+        return self.backend.daily_flows(flipped)
+
+    def scoped(self, accounts):
+        return ScopedBackend(self.backend, accounts)
+
+    def period_totals(self, accounts, time_resolution):
+        return self.backend.period_totals(self._accounts(accounts), time_resolution)
+
+    def period_variances(self, accounts, time_resolution):
+        return self.backend.period_variances(self._accounts(accounts), time_resolution)
+
+    def period_estimates(self, accounts, time_resolution):
+        return self.backend.period_estimates(self._accounts(accounts), time_resolution)
+
+    def era_totals(self, accounts, eras):
+        return self.backend.era_totals(self._accounts(accounts), eras)
+
+    def balance(self, accounts, date_end):
+        return self.backend.balance(self._accounts(accounts), date_end)
+
+    def running_rows(self, through):
+        return self.backend.running_rows(through)
+
+    def chunks(self, accounts=None, date_start=None, date_end=None, query=None, size=CHUNK_ROWS):
+        return self.backend.chunks(self._accounts(accounts), date_start, date_end, query, size)
+
+    def running_chunks(self, through, size=CHUNK_ROWS):
+        return self.backend.running_chunks(through, size)
+
+    def prepare(self):
+        self.backend.prepare()
+
+    def prepare_search(self):
+        self.backend.prepare_search()
+
+
+def _running_of(rows: np.ndarray, dates: np.ndarray, amounts: np.ndarray) -> tuple:
+    """ MemoryBackend.running for the row positions of one account """
+    rows = rows[np.argsort(dates[rows], kind='stable')]
+    return rows, dates[rows], np.concatenate([[0], np.cumsum(amounts[rows])])
+
+
+def _monthly_of(months: np.ndarray, amounts: np.ndarray) -> tuple:
+    """ The distinct months, in order, and the total of the amounts in each """
+    distinct, index = np.unique(months, return_inverse=True)
+    sums = np.zeros(len(distinct), dtype=amounts.dtype)
+    np.add.at(sums, index, amounts)
+    return distinct, sums
+
+
+class MemoryBackend(QueryBackend):
+    """
+    Transactions in a DataFrame.  Row positions for each account are
+    indexed on first use, so account filters don't scan every row, and so
+    are each account's running balances, so counts, balances and running
+    rows through a date are binary searches, and its monthly totals, from
+    which period totals add up.  append() extends these indexes for a
+    batch of new transactions rather than rebuilding them, and scoped()
+    carries them over.
+    """
+
+    def __init__(self, trans: pd.DataFrame):
+        # positions are row numbers; a frame already numbered so isn't copied
+        self.trans: pd.DataFrame = trans if trans.index.equals(pd.RangeIndex(len(trans))) else \
+            trans.reset_index(drop=True)
+        self._positions: dict = None
+        self._running: dict = None
+        self._monthly: dict = None
+        self._search_index: SearchIndex = None
+        self._lock = threading.RLock()
+
+    @property
+    def positions(self) -> dict:
+        """ Row positions of each account's transactions """
+        with self._lock:
+            if self._positions is None:
+                self._positions = self.trans.groupby('account', sort=False).indices
+            return self._positions
+
+    @property
+    def running(self) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        For each account, the row positions of its transactions in date
+        order (as loaded within a date), their dates, and the running
+        balance before each position, which has one more item for the end.
+        """
+        with self._lock:
+            if self._running is None:
+                dates = self.trans['date'].to_numpy()
+                amounts = self.trans['amount'].to_numpy()
+                self._running = {account: _running_of(rows, dates, amounts)
+                                 for account, rows in self.positions.items()}
+            return self._running
+
+    @property
+    def monthly(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """ For each account, the months of its transactions, in order, and its total amount in each """
+        with self._lock:
+            if self._monthly is None:
+                months = self.trans['date'].to_numpy().astype('datetime64[M]')
+                amounts = self.trans['amount'].to_numpy()
+                self._monthly = {account: _monthly_of(months[rows], amounts[rows])
+                                 for account, rows in self.positions.items()}
+            return self._monthly
+
+    def adopt(self, monthly: dict, running: dict) -> None:
+        """
+        Take monthly totals and running balances computed elsewhere, e.g.,
+        by rollup(), as the monthly and running indexes, unless built already
+        """
+        with self._lock:
+            if self._monthly is None:
+                self._monthly = monthly
+            if self._running is None:
+                self._running = running
+
+    def append(self, batch: pd.DataFrame) -> MemoryBackend:
+        """
+        A backend with batch's transactions, which must have the same
+        columns, after these.  The indexes built so far are carried over,
+        and updated for just the accounts in batch: their row positions
+        and monthly totals are extended, and so are their running
+        balances, which are recomputed only for accounts with transactions
+        in batch dated before their latest one.  Indexes of other accounts
+        are shared with this backend, which is unchanged.  The search
+        index is built afresh, on first use.
+        """
+        result = MemoryBackend(pd.concat([self.trans, batch], ignore_index=True))
+        with self._lock:
+            positions, running, monthly = self._positions, self._running, self._monthly
+        if positions is None:
+            return result
+        dates = result.trans['date'].to_numpy()
+        amounts = result.trans['amount'].to_numpy()
+        months = dates.astype('datetime64[M]')
+        added = {account: rows + len(self.trans)
+                 for account, rows in batch.groupby('account', sort=False).indices.items()}
+        result._positions = dict(positions)
+        for account, rows in added.items():
+            result._positions[account] = np.concatenate([positions[account], rows]) if account in positions else rows
+        if running is not None:
+            result._running = dict(running)
+            for account, rows in added.items():
+                if account in running and dates[rows].min() >= running[account][1][-1]:
+                    old_rows, old_dates, old_balances = running[account]
+                    rows = rows[np.argsort(dates[rows], kind='stable')]
+                    result._running[account] = (np.concatenate([old_rows, rows]),
+                                                np.concatenate([old_dates, dates[rows]]),
+                                                np.concatenate([old_balances,
+                                                                old_balances[-1] + np.cumsum(amounts[rows])]))
+                else:
+                    result._running[account] = _running_of(result._positions[account], dates, amounts)
+        if monthly is not None:
+            result._monthly = dict(monthly)
+            for account, rows in added.items():
+                old_months, old_sums = monthly.get(account, (months[:0], amounts[:0]))
+                result._monthly[account] = _monthly_of(np.concatenate([old_months, months[rows]]),
+                                                       np.concatenate([old_sums, amounts[rows]]))
+        return result
+
+    def _bounds(self, account: str, date_start=None, date_end=None) -> Tuple[int, int]:
+        """ The slice of running[account] between the dates, inclusive """
+        rows, dates, balances = self.running[account]
+        start = 0 if date_start is None else np.searchsorted(dates, np.datetime64(_timestamp(date_start)), 'left')
+        end = len(rows) if date_end is None else np.searchsorted(dates, np.datetime64(_timestamp(date_end)), 'right')
+        return int(start), int(max(start, end))
+
+    @property
+    def search_index(self) -> SearchIndex:
+        with self._lock:
+            if self._search_index is None:
+                self._search_index = SearchIndex(self.trans['description'])
+            return self._search_index
+
+    def _select(self, rows: np.ndarray, accounts=None, date_start=None, date_end=None) -> np.ndarray:
+        """ The positions in rows matching the filters """
+        if accounts is not None:
+            rows = rows[np.isin(rows, self._account_rows(accounts))]
+        if date_start is not None or date_end is not None:
+            dates = self.trans['date'].to_numpy()[rows]
+            keep = np.ones(len(rows), dtype=bool)
+            if date_start is not None:
+                keep &= dates >= np.datetime64(_timestamp(date_start))
+            if date_end is not None:
+                keep &= dates <= np.datetime64(_timestamp(date_end))
+            rows = rows[keep]
+        return rows
+
+    def _account_rows(self, accounts: Iterable[str]) -> np.ndarray:
+        positions = self.positions
+        parts = [positions[x] for x in set(accounts) if x in positions]
+        return np.sort(np.concatenate(parts)) if parts else np.array([], dtype=np.int64)
+
+    def _frame(self, accounts=None, date_start=None, date_end=None) -> pd.DataFrame:
+        if accounts is None and date_start is None and date_end is None:
+            return self.trans
+        if accounts is None:
+            rows = np.arange(len(self.trans))
+        else:
+            rows = self._account_rows(accounts)
+        return self.trans.iloc[self._select(rows, None, date_start, date_end)]
+
+    def accounts(self) -> pd.DataFrame:
+        return self.trans[['account', 'full account name']].drop_duplicates('full account name')
+
+    def date_range(self, accounts=None):
+        dates = self._frame(accounts)['date']
+        return dates.min(), dates.max()
+
+    def count(self, accounts=None, date_start=None, date_end=None):
+        if accounts is None:
+            return len(self._frame(accounts, date_start, date_end))
+        bounds = [self._bounds(x, date_start, date_end) for x in set(accounts) if x in self.positions]
+        return sum(end - start for start, end in bounds)
+
+    def daily_totals(self, accounts=None, date_start=None, date_end=None):
+        return self._frame(accounts, date_start, date_end).groupby('date')['amount'].sum()
+
+    def account_totals(self, accounts=None, date_start=None, date_end=None):
+        frame = self._frame(accounts, date_start, date_end)
+        return frame.groupby('full account name', sort=False).\
+            agg(account=('account', 'first'), amount=('amount', 'sum'), count=('amount', 'size')).\
+            reset_index()[['account', 'full account name', 'amount', 'count']]
+
+    def rows(self, accounts=None, date_start=None, date_end=None, offset=0, limit=None):
+        frame = self._frame(accounts, date_start, date_end)
+        return frame.iloc[offset:None if limit is None else offset + limit]
+
+    def search(self, query, accounts=None, date_start=None, date_end=None):
+        """ The text search runs on the index; the other filters only look at the matching rows. """
+        rows = self._select(self.search_index.search(query), accounts, date_start, date_end)
+        return self.trans.iloc[rows]
+
+    def daily_flows(self, flipped):
+        if 'transaction' not in self.trans.columns:
+            return pd.DataFrame(columns=FLOW_COLUMNS)
+        splits = self.trans[['transaction', 'date', 'account', 'amount']]
+        return pair_splits(splits.assign(amount=np.where(splits['account'].isin(list(flipped)),
+                                                         -splits['amount'], splits['amount'])))
+
+    def scoped(self, accounts):
+        """ The monthly and running indexes built so far carry over, for the accounts kept """
+        rows = self._account_rows(accounts)
+        result = MemoryBackend(self.trans.iloc[rows])
+        with self._lock:
+            monthly, running = self._monthly, self._running
+        kept = set(accounts)
+        if monthly is not None:
+            result._monthly = {x: monthly[x] for x in kept if x in monthly}
+        if running is not None:
+            # the kept rows are in their order here, so their new positions are their ranks
+            result._running = {x: (np.searchsorted(rows, running[x][0]), *running[x][1:])
+                               for x in kept if x in running}
+        return result
+
+    def period_totals(self, accounts, time_resolution):
+        monthly = self.monthly
+        parts = [monthly[x] for x in (monthly if accounts is None else set(accounts)) if x in monthly]
+        if not parts:
+            return utils.period_totals(self.trans.iloc[:0], time_resolution)
+        months, sums = (np.concatenate(x) for x in zip(*parts))
+        totals = pd.DataFrame({'date': months.astype('datetime64[ns]'), 'amount': sums}).groupby('date').sum()
+        return utils.period_totals(totals.reset_index(), time_resolution)
+
+    def era_totals(self, accounts, eras):
+        # the frame has era numbers, assigned at load time
+        return utils.era_totals(self._frame(accounts), eras)
+
+    def balance(self, accounts, date_end):
+        result = 0
+        for account in set(accounts):
+            if account in self.positions:
+                result += int(self.running[account][2][self._bounds(account, None, date_end)[1]])
+        return result
+
+    def _running_rows(self, through: Dict[str, object]) -> np.ndarray:
+        """ Positions of running_rows(through); each account's are a leading slice of its date-ordered positions """
+        parts = [self.running[account][0][:self._bounds(account, None, date_end)[1]]
+                 for account, date_end in through.items() if account in self.positions]
+        if not parts:
+            return np.array([], dtype=np.int64)
+        rows = np.concatenate(parts)
+        return rows[np.argsort(self.trans['date'].to_numpy()[rows], kind='stable')]
+
+    def running_rows(self, through):
+        rows = self._running_rows(through)
+        if len(rows) == 0:
+            return super().running_rows({})
+        result = self.trans.iloc[rows]
+        return result.assign(total=result['amount'].cumsum())
+
+    def chunks(self, accounts=None, date_start=None, date_end=None, query=None, size=CHUNK_ROWS):
+        """ Only the selected positions are held; each chunk is copied from the frame as it is needed """
+        if query:
+            rows = self._select(self.search_index.search(query), accounts, date_start, date_end)
+        elif accounts is None:
+            rows = self._select(np.arange(len(self.trans)), None, date_start, date_end)
+        else:
+            rows = self._select(self._account_rows(accounts), None, date_start, date_end)
+        rows = rows[np.argsort(self.trans['date'].to_numpy()[rows], kind='stable')]
+        for start in range(0, len(rows), size):
+            yield self.trans.iloc[rows[start:start + size]][ROW_COLUMNS]
+
+    def running_chunks(self, through, size=CHUNK_ROWS):
+        rows = self._running_rows(through)
+        total = 0
+        for start in range(0, len(rows), size):
+            chunk = self.trans.iloc[rows[start:start + size]][ROW_COLUMNS]
+            chunk = chunk.assign(total=total + chunk['amount'].cumsum())
+            total = chunk['total'].iloc[-1]
+            yield chunk
+
+    def prepare(self):
+        self.running  # built on first use
+
+    def prepare_search(self):
+        self.search_index
+
+
+class SQLiteBackend(QueryBackend):
+    """
+    Transactions in an SQLite database created by import_sqlite, opened
+    read-only.  Each thread gets its own connection.
+    """
+
+    SCHEMA: str = '''
+        CREATE TABLE IF NOT EXISTS trans (
+            id INTEGER PRIMARY KEY,
+            date TEXT NOT NULL,
+            description TEXT NOT NULL,
+            amount INTEGER NOT NULL,
+            account TEXT NOT NULL,
+            full_account_name TEXT NOT NULL,
+            transaction_id TEXT NOT NULL,
+            split INTEGER NOT NULL,
+            UNIQUE (transaction_id, split));
+        CREATE INDEX IF NOT EXISTS trans_account_date ON trans (account, date, amount);
+        CREATE INDEX IF NOT EXISTS trans_date ON trans (date);
+        '''
+    SELECT_ROWS: str = 'SELECT date, description, amount, account, full_account_name AS "full account name" FROM trans'
+
+    def __init__(self, path: str):
+        self.path: str = path
+        if not os.path.exists(path):
+            raise FileNotFoundError(f'No SQLite ledger at {path}')
+        self._local = threading.local()
+        self._accounts: pd.DataFrame = None
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+            self._local.connection = connection
+        return connection
+
+    def _query(self, sql: str, parameters: list = ()) -> pd.DataFrame:
+        return pd.read_sql_query(sql, self._connection(), params=list(parameters))
+
+    @staticmethod
+    def _where(accounts=None, date_start=None, date_end=None) -> Tuple[str, list]:
+        clauses: List[str] = []
+        parameters: list = []
+        if accounts is not None:
+            clauses.append('account IN (SELECT value FROM json_each(?))')
+            parameters.append(json.dumps(list(accounts)))
+        if date_start is not None:
+            clauses.append('date >= ?')
+            parameters.append(_timestamp(date_start).strftime('%Y-%m-%d'))
+        if date_end is not None:
+            clauses.append('date <= ?')
+            parameters.append(_timestamp(date_end).strftime('%Y-%m-%d'))
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), parameters
+
+    @staticmethod
+    def _dates(frame: pd.DataFrame) -> pd.DataFrame:
+        frame['date'] = pd.to_datetime(frame['date'], format='%Y-%m-%d')
+        return frame
+
+    def accounts(self):
+        if self._accounts is None:
+            self._accounts = self._query('SELECT account, full_account_name AS "full account name" FROM trans '
+                                         'GROUP BY full_account_name ORDER BY MIN(id)')
+        return self._accounts
+
+    def date_range(self, accounts=None):
+        where, parameters = self._where(accounts)
+        earliest, latest = self._connection().execute(f'SELECT MIN(date), MAX(date) FROM trans{where}',
+                                                      parameters).fetchone()
+        return _timestamp(earliest), _timestamp(latest)
+
+    def count(self, accounts=None, date_start=None, date_end=None):
+        where, parameters = self._where(accounts, date_start, date_end)
+        return self._connection().execute(f'SELECT COUNT(*) FROM trans{where}', parameters).fetchone()[0]
+
+    def daily_totals(self, accounts=None, date_start=None, date_end=None):
+        where, parameters = self._where(accounts, date_start, date_end)
+        frame = self._dates(self._query(f'SELECT date, SUM(amount) AS amount FROM trans{where} '
+                                        'GROUP BY date ORDER BY date', parameters))
+        return frame.set_index('date')['amount'].astype('int64')
+
+    def account_totals(self, accounts=None, date_start=None, date_end=None):
+        where, parameters = self._where(accounts, date_start, date_end)
+        return self._query('SELECT account, full_account_name AS "full account name", SUM(amount) AS amount, '
+                           'COUNT(*) AS count '
+                           f'FROM trans{where} GROUP BY full_account_name ORDER BY MIN(id)', parameters)
+
+    def rows(self, accounts=None, date_start=None, date_end=None, offset=0, limit=None):
+        where, parameters = self._where(accounts, date_start, date_end)
+        return self._dates(self._query(f'{self.SELECT_ROWS}{where} ORDER BY id LIMIT ? OFFSET ?',
+                                       parameters + [-1 if limit is None else limit, offset]))
+
+    @staticmethod
+    def _search_where(query: str, where: str, parameters: list) -> Tuple[str, list]:
+        for term in query.split():
+            escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            where = where + (' AND ' if where else ' WHERE ') + "description LIKE ? ESCAPE '\\'"
+            parameters.append(f'%{escaped}%')
+        return where, parameters
+
+    def search(self, query, accounts=None, date_start=None, date_end=None):
+        """ Case-insensitive (for ASCII) substring match of each word, with SQL LIKE """
+        where, parameters = self._search_where(query, *self._where(accounts, date_start, date_end))
+        return self._dates(self._query(f'{self.SELECT_ROWS}{where} ORDER BY id', parameters))
+
+    def _chunks(self, sql: str, parameters: list, size: int) -> Iterator[pd.DataFrame]:
+        """ The query's rows, read from the cursor size at a time """
+        for chunk in pd.read_sql_query(sql, self._connection(), params=parameters, chunksize=size):
+            yield self._dates(chunk)
+
+    def chunks(self, accounts=None, date_start=None, date_end=None, query=None, size=CHUNK_ROWS):
+        where, parameters = self._where(accounts, date_start, date_end)
+        if query:
+            where, parameters = self._search_where(query, where, parameters)
+        return self._chunks(f'{self.SELECT_ROWS}{where} ORDER BY date, id', parameters, size)
+
+    def running_chunks(self, through, size=CHUNK_ROWS):
+        if not through:
+            return
+        accounts = list(through)
+        where = ' OR '.join(['(account = ? AND date <= ?)'] * len(accounts))
+        order = 'CASE account ' + ' '.join(f'WHEN ? THEN {i}' for i in range(len(accounts))) + ' END'
+        parameters = [x for account in accounts for x in (account, _timestamp(through[account]).strftime('%Y-%m-%d'))]
+        total = 0
+        for chunk in self._chunks(f'{self.SELECT_ROWS} WHERE {where} ORDER BY date, {order}, id',
+                                  parameters + accounts, size):
+            chunk = chunk.assign(total=total + chunk['amount'].cumsum())
+            total = chunk['total'].iloc[-1]
+            yield chunk
+
+    def daily_flows(self, flipped):
+        """ As pair_splits, in SQL """
+        frame = self._query('''
+            WITH splits AS (
+                SELECT transaction_id, date, account,
+                       CASE WHEN account IN (SELECT value FROM json_each(?)) THEN -amount ELSE amount END AS amount
+                FROM trans),
+            debits AS (
+                SELECT transaction_id, account,
+                       amount * 1.0 / SUM(amount) OVER (PARTITION BY transaction_id) AS share
+                FROM splits WHERE amount > 0)
+            SELECT c.date AS date, c.account AS source, d.account AS target, SUM(-c.amount * d.share) AS amount
+            FROM splits c JOIN debits d ON d.transaction_id = c.transaction_id
+            WHERE c.amount < 0 AND c.account != d.account
+            GROUP BY c.date, c.account, d.account
+            ORDER BY c.date, c.account, d.account''', [json.dumps(list(flipped))])
+        return self._dates(frame)
+
+
+def import_sqlite(path: str, sources: Iterable[str]) -> int:
+    """
+    Add the transactions in Gnucash CSV exports to the SQLite ledger at
+    path, creating it if needed, and return the number of rows added.
+    Files are read one at a time, so no more than one export is in memory.
+    Splits already in the database (same Transaction ID and position) are
+    skipped, so overlapping exports can be imported in any order.
+    """
+    connection = sqlite3.connect(path)
+    added = 0
+    try:
+        connection.executescript(SQLiteBackend.SCHEMA)
+        for source in utils.transaction_sources(sources):
+            trans = utils.read_transactions(source)
+            if len(trans) == 0:
+                continue
+            trans = utils.flip_signs_by_name(trans)
+            records = zip(trans['date'].dt.strftime('%Y-%m-%d'),
+                          trans['description'],
+                          trans['amount'].astype(int).tolist(),
+                          trans['account'],
+                          trans['full account name'],
+                          trans['transaction id'],
+                          trans['split'].astype(int).tolist())
+            with connection:
+                before = connection.total_changes
+                connection.executemany('INSERT OR IGNORE INTO trans (date, description, amount, account, '
+                                       'full_account_name, transaction_id, split) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                       records)
+                added += connection.total_changes - before
+        connection.execute('ANALYZE')
+    finally:
+        connection.close()
+    return added
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('database', help='SQLite file to create or add to')
+    parser.add_argument('sources', nargs='+', help='Gnucash transaction CSV exports; globs allowed')
+    args = parser.parse_args()
+    print(f'{import_sqlite(args.database, args.sources):,d} rows added to {args.database}')
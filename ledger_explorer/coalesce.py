@@ -0,0 +1,106 @@
+"""
+Single-flight coalescing for expensive callbacks.
+
+When several browsers ask for the same figure at about the same time, e.g.,
+everyone opening Cash Flow after a Reload, only the first request computes
+it; the others wait for that computation and return its result, or raise
+its exception.  Nothing is cached: once the computation finishes, the next
+request computes again.
+
+Calls are keyed by (dataset id, callback, inputs), so this works within
+one server process; each worker process coalesces its own requests.
+"""
+from concurrent.futures import Future, TimeoutError
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+from typing import Callable, Dict, Hashable
+
+import dash
+import flask
+
+from ledger import store_id
+
+
+# Seconds a request waits for an identical one in progress before giving up
+COALESCE_TIMEOUT: float = float(os.environ.get('LEDGER_EXPLORER_COALESCE_TIMEOUT') or 120)
+
+
+class SingleFlight:
+    """ Run at most one call per key at a time, sharing its outcome with concurrent callers. """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, function: Callable, timeout: float = None):
+        """
+        Return function(), unless a call with the same key is already in
+        progress, in which case wait up to timeout seconds for it and
+        return its result instead.  Raises the exception of whichever call
+        ran, or TimeoutError if it took too long.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            return future.result(timeout)
+        try:
+            result = function()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+flights = SingleFlight()
+
+
+def inputs_key(arguments: dict) -> str:
+    """
+    Normalize callback arguments to a short key: the dataset is identified
+    by its id rather than its contents, and everything else is hashed as
+    sorted JSON.  Callbacks that check which input fired also depend on
+    the triggering inputs, so those are included.
+    """
+    normal = {name: (store_id(value) if name == 'data_store' and value else value)
+              for name, value in arguments.items()}
+    if flask.has_request_context():
+        normal['triggered'] = sorted(x['prop_id'] for x in dash.callback_context.triggered)
+    encoded = json.dumps(normal, sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def coalesced(function: Callable) -> Callable:
+    """
+    Decorator for an expensive callback with a data_store argument.  Put it
+    below @app.callback, so Dash registers the coalescing version.
+    """
+    signature = inspect.signature(function)
+    name = f'{function.__module__}.{function.__qualname__}'
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        key = (name, inputs_key(signature.bind(*args, **kwargs).arguments))
+        try:
+            return flights.do(key, lambda: function(*args, **kwargs), COALESCE_TIMEOUT)
+        except TimeoutError:
+            logging.warning(f'{name}: gave up after {COALESCE_TIMEOUT}s waiting for an identical request')
+            raise
+    return wrapper
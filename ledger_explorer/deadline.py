@@ -0,0 +1,120 @@
+"""
+Time budgets for expensive callbacks.
+
+A callback given a budget (see within_budget) estimates how long its
+exact result would take, from the size of the work and the seconds per
+unit of work measured for the same kind of computation so far (see
+CostModel).  If the estimate is over the budget, the exact result is
+computed in the background (Ledger.cached_in_background), and the
+callback answers with a coarser stand-in instead: one already computed,
+or one whose own estimate fits.  The callback can then poll, e.g., with
+a dcc.Interval, and show the exact result once it is ready.  If there is
+no stand-in, the callback waits for the exact result for the rest of its
+budget, and no longer.
+
+Set LEDGER_EXPLORER_TIME_BUDGET to the seconds a callback may take, e.g.,
+somewhat less than the proxy's timeout.
+"""
+from concurrent.futures import TimeoutError
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+from ledger import Ledger
+
+
+TIME_BUDGET: float = float(os.environ.get('LEDGER_EXPLORER_TIME_BUDGET') or 10)
+DEFAULT_RATE: float = 2e-6  # seconds per unit of work, until a computation of the kind is timed
+SMOOTHING: float = 0.3  # weight of the latest timing in the rate
+
+
+class CostModel:
+    """
+    Seconds per unit of work for each kind of computation, as a moving
+    average of the timings recorded, e.g., per transaction read.  Units
+    only need to be proportional to the work within a kind.
+    """
+
+    def __init__(self, default_rate: float = DEFAULT_RATE):
+        self.default_rate: float = default_rate
+        self._rates: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def rate(self, kind: str) -> float:
+        with self._lock:
+            return self._rates.get(kind, self.default_rate)
+
+    def estimate(self, kind: str, units: float) -> float:
+        """ Seconds expected for units of work of kind """
+        return self.rate(kind) * units
+
+    def record(self, kind: str, units: float, seconds: float) -> None:
+        if units <= 0:
+            return
+        with self._lock:
+            rate = seconds / units
+            previous = self._rates.get(kind)
+            self._rates[kind] = rate if previous is None else SMOOTHING * rate + (1 - SMOOTHING) * previous
+
+    def timed(self, kind: str, units: float, compute: Callable) -> Callable:
+        """ compute, recording how long it takes """
+        def run():
+            start = time.perf_counter()
+            result = compute()
+            self.record(kind, units, time.perf_counter() - start)
+            return result
+        return run
+
+
+costs = CostModel()
+
+
+class Candidate(NamedTuple):
+    """ One way to answer a callback: a result computed once per ledger by ledger.cached """
+    key: Hashable       # for ledger.cached
+    compute: Callable
+    kind: str           # for the CostModel
+    units: float
+
+
+def within_budget(ledger: Ledger,
+                  exact: Candidate,
+                  coarser: List[Candidate] = (),
+                  budget: float = None,
+                  cost_model: CostModel = None,
+                  start: bool = True) -> Tuple[object, Optional[Candidate]]:
+    """
+    The exact result, if it is ready or expected within budget seconds;
+    otherwise the first of coarser that is, while the exact result is
+    computed in the background; otherwise the exact result if it comes
+    within the budget after all.  Return the result and the candidate it
+    came from, or (None, None) if nothing came in time.  Without start,
+    e.g., for a poll, the exact result is only picked up if it is ready
+    or being computed, not started again, e.g., after it failed.
+    """
+    began = time.monotonic()
+    budget = TIME_BUDGET if budget is None else budget
+    cost_model = cost_model or costs
+
+    def fits(candidate: Candidate) -> bool:
+        return ledger.ready(candidate.key) or cost_model.estimate(candidate.kind, candidate.units) <= budget
+
+    def compute(candidate: Candidate) -> Callable:
+        return cost_model.timed(candidate.kind, candidate.units, candidate.compute)
+
+    if ledger.ready(exact.key) or (start and fits(exact)):
+        return ledger.cached(exact.key, compute(exact)), exact
+    if not start and not ledger.computing(exact.key):
+        return None, None
+    future = ledger.cached_in_background(exact.key, compute(exact))
+    for candidate in coarser:
+        if fits(candidate):
+            logging.info(f'{exact.key} is expected to take '
+                         f'{cost_model.estimate(exact.kind, exact.units):,.1f} s; answering with {candidate.key}')
+            return ledger.cached(candidate.key, compute(candidate)), candidate
+    try:
+        return future.result(max(budget - (time.monotonic() - began), 0)), exact
+    except TimeoutError:
+        return None, None
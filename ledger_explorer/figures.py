@@ -0,0 +1,87 @@
+"""
+Plotly figures as plain dicts, without Plotly's property validation.
+
+go.Figure, go.Bar and friends validate and copy every property as it is
+set, and plotly.express builds a DataFrame of its own before doing the
+same; for figures with many traces, that is most of a callback's time.
+Dash only needs the figure's JSON, so here traces are dicts in the form
+validation would produce (as from to_plotly_json), made directly from
+NumPy arrays, and the properties that every figure of a kind shares,
+such as chart_fig_layout and Plotly's default template, are validated
+once, on first use, as a Template.
+
+Dicts use nested properties, e.g., {'marker': {'color': ...}}, not the
+magic underscores (marker_color) that go objects accept.  Figures share
+the unchanged parts of their templates, so treat them as read-only.  Set
+LEDGER_EXPLORER_VALIDATE_FIGURES=1 to have figure() build validated
+go.Figure objects from the same dicts instead, e.g., when changing a
+trace; tests/test_figures.py checks the two give the same JSON.
+"""
+from __future__ import annotations
+
+import os
+from typing import Callable, List, Union
+
+import plotly.graph_objects as go
+
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+VALIDATE_FIGURES: bool = os.environ.get('LEDGER_EXPLORER_VALIDATE_FIGURES', '0') not in ('', '0')
+
+
+def merge(base: dict, updates: dict) -> dict:
+    """
+    base updated with updates, as update_layout does: nested dicts are
+    merged, anything else replaced.  Neither argument is changed; the
+    result shares whatever updates leave alone with base.
+    """
+    result = dict(base)
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = merge(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+class Template:
+    """
+    Figure properties shared by every figure of a kind, e.g., a layout,
+    as validate() returns them, which is called once, on first use.
+    Calling the template returns its properties merged with updates.
+    """
+
+    def __init__(self, validate: Callable[[], dict]):
+        self.validate: Callable[[], dict] = validate
+        self._properties: dict = None
+
+    @property
+    def properties(self) -> dict:
+        # a race only validates twice, to the same result
+        if self._properties is None:
+            self._properties = self.validate()
+        return self._properties
+
+    def __call__(self, **updates) -> dict:
+        return merge(self.properties, updates)
+
+
+def layout_template(layout: dict) -> Template:
+    """ A Template for layout, with Plotly's default template, as go.Figure(layout=layout) has """
+    return Template(lambda: go.Figure(layout=layout).to_plotly_json()['layout'])
+
+
+def dates(values) -> np.ndarray:
+    """ datetime64 values as the object array of datetimes that validation makes of them """
+    return pd.DatetimeIndex(values).to_pydatetime()
+
+
+def figure(data: List[dict], layout: dict) -> Union[dict, go.Figure]:
+    """ A figure from trace dicts and a layout dict; see VALIDATE_FIGURES """
+    if VALIDATE_FIGURES:
+        return go.Figure({'data': data, 'layout': layout})
+    return {'data': data, 'layout': layout}
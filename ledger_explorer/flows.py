@@ -0,0 +1,79 @@
+"""
+Where money moved: flows between accounts, from pairing the splits of
+each double-entry transaction.
+
+In each transaction, money flows out of the accounts with credits
+(negative amounts, in Gnucash's signs, before flip_signs) into the
+accounts with debits.  A transaction with several splits on both sides is
+apportioned: each credit is divided among the debits in proportion to
+their amounts.  The pairs are found once, at load time (see
+QueryBackend.daily_flows), and kept as a FlowMatrix: a sparse
+account × account matrix per month, plus the daily flows of each month
+for the ends of date ranges that don't fall on month boundaries.
+"""
+from __future__ import annotations
+
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+FLOW_COLUMNS: list = ['date', 'source', 'target', 'amount']
+
+
+def pair_splits(splits: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return the total flow between each pair of accounts on each date, as
+    FLOW_COLUMNS, for splits with columns 'transaction', 'date', 'account'
+    and 'amount', in double-entry signs.  Transfers within one account are
+    left out.
+    """
+    credits = splits.loc[splits['amount'] < 0, ['transaction', 'date', 'account', 'amount']]
+    debits = splits.loc[splits['amount'] > 0, ['transaction', 'account', 'amount']]
+    debits = debits.assign(share=debits['amount'] / debits.groupby('transaction')['amount'].transform('sum'))
+    pairs = credits.merge(debits[['transaction', 'account', 'share']], on='transaction', suffixes=('', '_to'))
+    pairs = pairs[pairs['account'] != pairs['account_to']]
+    pairs = pairs.assign(amount=-pairs['amount'] * pairs['share'])
+    return pairs.rename(columns={'account': 'source', 'account_to': 'target'}).\
+        groupby(['date', 'source', 'target'], sort=True)['amount'].sum().\
+        reset_index()[FLOW_COLUMNS]
+
+
+class FlowMatrix:
+    """
+    Flows between accounts, summed by month, so the flows for a date range
+    are sums of the months inside it, plus the days at either end outside
+    whole months.  Frames are shared and must not be modified.
+    """
+
+    def __init__(self, daily: pd.DataFrame):
+        self.daily: pd.DataFrame = daily.sort_values('date', kind='stable').reset_index(drop=True)
+        self.dates: np.ndarray = self.daily['date'].to_numpy()
+        months = self.daily['date'].dt.to_period('M').dt.start_time
+        self.monthly: pd.DataFrame = self.daily.groupby([months, 'source', 'target'], sort=True)['amount'].\
+            sum().reset_index()
+        self.months: np.ndarray = self.monthly['date'].to_numpy()
+
+    @staticmethod
+    def _slice(frame: pd.DataFrame, dates: np.ndarray, start, end) -> pd.DataFrame:
+        """ Rows of frame, sorted by dates, from start up to but not including end """
+        start, end = np.datetime64(start), np.datetime64(end)
+        return frame.iloc[np.searchsorted(dates, start, 'left'):np.searchsorted(dates, end, 'left')]
+
+    def flows(self, date_start=None, date_end=None) -> pd.DataFrame:
+        """ Total flow between each pair of accounts between the dates, inclusive, largest first """
+        if len(self.daily) == 0:
+            return pd.DataFrame(columns=['source', 'target', 'amount'])
+        start = pd.Timestamp(date_start if date_start is not None else self.dates[0]).normalize()
+        end = pd.Timestamp(date_end if date_end is not None else self.dates[-1]).normalize() + pd.Timedelta(days=1)
+        first_month = start if start.day == 1 else start + pd.offsets.MonthBegin()
+        end_month = end - pd.offsets.MonthBegin() if end.day != 1 else end
+        if first_month < end_month:
+            parts = [self._slice(self.daily, self.dates, start, first_month),
+                     self._slice(self.monthly, self.months, first_month, end_month),
+                     self._slice(self.daily, self.dates, end_month, end)]
+        else:
+            parts = [self._slice(self.daily, self.dates, start, end)]
+        return pd.concat(parts).groupby(['source', 'target'], sort=False)['amount'].sum().\
+            sort_values(ascending=False).reset_index()
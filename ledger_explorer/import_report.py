@@ -0,0 +1,70 @@
+"""
+Report how long the app takes to import, and which modules account for it.
+
+Run from anywhere:
+
+    python ledger_explorer/import_report.py [--top 20] [--budget-ms 600] [--eager]
+
+Uses `python -X importtime` in a fresh interpreter, so results aren't
+affected by anything already imported.  With --budget-ms, exits with status
+1 if importing index takes longer, so slow imports creeping back in fail a
+build instead of going unnoticed.
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, NamedTuple
+
+
+class ImportTime(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def import_times(eager: bool = False, module: str = 'index') -> List[ImportTime]:
+    """ Import module in a fresh interpreter and return the -X importtime results. """
+    env = dict(os.environ, LEDGER_EXPLORER_EAGER_START='1' if eager else '0')
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               cwd=os.path.dirname(os.path.abspath(__file__)),
+                               env=env,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE,
+                               universal_newlines=True,
+                               check=True)
+    result: List[ImportTime] = []
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        result.append(ImportTime(name.strip(), int(self_us), int(cumulative_us), depth))
+    return result
+
+
+def report(times: List[ImportTime], top: int = 20, module: str = 'index') -> int:
+    """ Print a summary of times and return the total for module, in microseconds. """
+    total = next((x.cumulative_us for x in times if x.module == module), 0)
+    print(f'import {module}: {total / 1000:,.0f} ms, {len(times)} modules')
+    print()
+    print(f'{"cumulative ms":>14} {"self ms":>8}  top-level packages')
+    packages = [x for x in times if '.' not in x.module]
+    for x in sorted(packages, key=lambda x: x.cumulative_us, reverse=True)[:top]:
+        print(f'{x.cumulative_us / 1000:14,.1f} {x.self_us / 1000:8,.1f}  {x.module}')
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=20, help='number of packages to list')
+    parser.add_argument('--budget-ms', type=float, help='fail if importing takes longer than this')
+    parser.add_argument('--eager', action='store_true', help='measure with LEDGER_EXPLORER_EAGER_START=1')
+    args = parser.parse_args()
+
+    total_us = report(import_times(eager=args.eager), top=args.top)
+    if args.budget_ms is not None and total_us / 1000 > args.budget_ms:
+        print(f'\nOver budget: {total_us / 1000:,.0f} ms > {args.budget_ms:,.0f} ms')
+        sys.exit(1)
@@ -1,3 +1,4 @@
+import argparse
 import logging
 
 import dash_core_components as dcc
@@ -6,7 +7,10 @@ from dash.dependencies import Input, Output
 import plotly.io as pio
 
 from app import app
+# the tab modules, unlike their layouts, are imported up front: Dash needs every callback registered before serving
 from apps import balance_sheet, cash_flow, data_source
+from lazy import EAGER_START
+import snapshot
 
 
 app.layout = html.Div(
@@ -30,18 +34,42 @@ app.layout = html.Div(
               [Input('tabs', 'value')])
 def change_tab(selected_tab: str):
     if selected_tab == 'bs':
-        layout = balance_sheet.layout
+        layout = balance_sheet.layout()
     elif selected_tab == 'cf':
-        layout = cash_flow.layout
+        layout = cash_flow.layout()
     else:
-        layout = data_source.layout
+        layout = data_source.layout()
 
     return layout
 
 
+if EAGER_START:
+    for tab in (balance_sheet, cash_flow, data_source):
+        tab.layout()
+
+
+def create_server(snapshot_dir: str = None):
+    """
+    The Flask server, for WSGI servers, with the snapshot in snapshot_dir,
+    or $LEDGER_EXPLORER_SNAPSHOT, restored, e.g., gunicorn --chdir
+    ledger_explorer 'index:create_server()'.  Importing this module
+    doesn't restore it, since process pools import it again in each
+    worker process.
+    """
+    snapshot.restore(snapshot_dir)
+    return app.server
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the Ledger Explorer server.')
+    parser.add_argument('--snapshot', default=snapshot.SNAPSHOT_DIR,
+                        help='directory to restore the last loaded ledger from, and save it to '
+                             '(default: $LEDGER_EXPLORER_SNAPSHOT)')
+    args = parser.parse_args()
     logging.basicConfig(
         level=logging.DEBUG,
         format='%(asctime)s %(levelname)-8s %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S %z')
+    snapshot.SNAPSHOT_DIR = args.snapshot
+    snapshot.restore()
     app.run_server(debug=True, host='0.0.0.0')
@@ -0,0 +1,33 @@
+import importlib
+import importlib.util
+import os
+import sys
+from types import ModuleType
+
+
+# Set LEDGER_EXPLORER_EAGER_START=1 to import everything and build every
+# layout before the server starts, e.g., to surface import errors at startup
+# instead of on the first request.
+EAGER_START: bool = os.environ.get('LEDGER_EXPLORER_EAGER_START', '0') not in ('', '0')
+
+
+def lazy_import(name: str) -> ModuleType:
+    """
+    Return the named module, deferring its actual import until one of its
+    attributes is first used.  Use as `pd = lazy_import('pandas')` in place
+    of `import pandas as pd` for heavy modules that are only needed inside
+    callbacks.  Modules using this for names in annotations need
+    `from __future__ import annotations`, or the annotations trigger the import.
+    """
+    if name in sys.modules:
+        # not import_module, which would touch the module's attributes and load it
+        return sys.modules[name]
+    if EAGER_START:
+        return importlib.import_module(name)
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
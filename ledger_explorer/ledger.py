@@ -0,0 +1,484 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Callable, Dict, Hashable, Iterable, List, Union
+
+from dash.exceptions import PreventUpdate
+from treelib import Tree
+
+from lazy import lazy_import
+from account_index import AccountIndex
+from backend import MemoryBackend, QueryBackend, SQLiteBackend
+from flows import FlowMatrix
+from memory import MB, MEMORY_BUDGET, MemoryBudgetError, deep_size
+import parallel
+from rollup import ROLLUP_ROWS, rollup
+from sampling import SAMPLE_ROWS, SampledBackend, StratifiedSample
+from utils import DATA_DIR, add_accounts, assign_eras, data_file, eras_from_json, flip_signs, flipped_accounts
+from utils import get_descendents, make_account_tree_from_trans, subtree_totals, trans_from_json
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+MAX_LEDGERS: int = 4  # datasets kept in memory per worker
+# the top-level "id" key: within the stored frames, which are JSON strings, every quote is escaped
+_STORE_ID = re.compile(r'[{,]\s*"id"\s*:\s*"([0-9a-f]{40})"')
+
+
+class Ledger:
+    """
+    Server-side copy of one loaded dataset.
+
+    The browser keeps the dataset in the data_store component, and Dash
+    sends it with every callback.  Parsing it with pandas on every callback
+    is slow, so each worker keeps the parsed frames here, keyed by a hash
+    of the stored JSON, along with anything derived from them at load
+    time.  The transactions are reached through a query backend (see
+    backend.py), in memory or on disk.  Frames returned from a Ledger are
+    shared between callbacks and must not be modified in place.
+    """
+
+    def __init__(self,
+                 source: Union[pd.DataFrame, QueryBackend],
+                 eras: pd.DataFrame,
+                 dataset_id: str,
+                 account_tree: Tree = None):
+        self.id: str = dataset_id
+        if isinstance(source, QueryBackend):
+            self.backend: QueryBackend = source
+        else:
+            self.backend = MemoryBackend(source)
+        self.eras: pd.DataFrame = eras
+        if account_tree is None:
+            account_tree = make_account_tree_from_trans(self.backend.accounts())
+        self.account_tree: Tree = account_tree
+        self._views: dict = {}
+        self._results: dict = {}
+        self._lock = threading.Lock()
+
+    def accounts(self, filter: Iterable[str]) -> list:
+        """ Return the filter accounts and all of their descendents. """
+        result: list = []
+        for account in filter:
+            result = result + [account] + get_descendents(account, self.account_tree)
+        return result
+
+    def view(self, filter: Iterable[str]) -> tuple:
+        """
+        Return (source, eras, account_tree, earliest_trans, latest_trans)
+        for the transactions in the filter accounts and their descendents,
+        where source is the backend limited to those accounts, and the
+        other items are as from data_from_json_store.  Views are cached.
+        """
+        key = tuple(filter)
+        with self._lock:
+            if key not in self._views:
+                filter_accounts = self.accounts(filter)
+                source = self.backend.scoped(filter_accounts) if filter_accounts else self.backend
+                account_tree = make_account_tree_from_trans(source.accounts())
+                self._views[key] = (source, self.eras, account_tree, *source.date_range())
+            return self._views[key]
+
+    def sample(self) -> StratifiedSample:
+        """
+        A stratified sample of SAMPLE_ROWS transactions (see sampling.py),
+        computed once, or None if the ledger is smaller than that, sampling
+        is off, or the transactions aren't in memory
+        """
+        return self.cached(('sample',), self._sample)
+
+    def _sample(self) -> StratifiedSample:
+        if not SAMPLE_ROWS or not isinstance(self.backend, MemoryBackend) or self.backend.count() <= SAMPLE_ROWS:
+            return None
+        return StratifiedSample(self.backend.trans, SAMPLE_ROWS)
+
+    def sampled_view(self, filter: Iterable[str]) -> tuple:
+        """
+        As view(filter), with the source's totals estimated from the
+        sample, or None if there is no sample, or it isn't built yet, in
+        which case it is built in the background
+        """
+        if not SAMPLE_ROWS:
+            return None
+        if not self.ready(('sample',)):
+            self.cached_in_background(('sample',), self._sample)
+            return None
+        if self.sample() is None:
+            return None
+        source, *rest = self.view(filter)
+        accounts = self.accounts(filter) or list(self.backend.accounts()['account'])
+        return (SampledBackend(self.backend, accounts, self.sample()), *rest)
+
+    def cached(self, key: Hashable, compute: Callable, timeout: float = None):
+        """
+        Return compute(), computing it only once per key for this ledger.
+        Callers that arrive while it is being computed wait for it.  If
+        compute raises, its waiters get the exception and nothing is kept.
+        Results are shared and must not be modified.
+        """
+        future, owner = self._claim(key)
+        if not owner:
+            return future.result(timeout)
+        return self._fulfil(key, future, compute)
+
+    def cached_in_background(self, key: Hashable, compute: Callable) -> Future:
+        """
+        The future result of cached(key, compute), computed on a new thread
+        unless it is already kept or being computed, so the caller needn't wait.
+        """
+        future, owner = self._claim(key)
+        if owner:
+            def run():
+                try:
+                    self._fulfil(key, future, compute)
+                except Exception:
+                    pass  # the future has it, for whoever asks
+            threading.Thread(target=run, name=f'ledger-{self.id[:8]}-background', daemon=True).start()
+        return future
+
+    def ready(self, key: Hashable) -> bool:
+        """ Whether cached() would return the result for key straight away """
+        with self._lock:
+            future = self._results.get(key)
+        return future is not None and future.done() and future.exception() is None
+
+    def computing(self, key: Hashable) -> bool:
+        """ Whether the result for key is being computed """
+        with self._lock:
+            future = self._results.get(key)
+        return future is not None and not future.done()
+
+    def _claim(self, key: Hashable) -> tuple:
+        """ The future for key, and whether the caller must compute it """
+        with self._lock:
+            future = self._results.get(key)
+            owner = future is None
+            if owner:
+                future = self._results[key] = Future()
+        return future, owner
+
+    def _fulfil(self, key: Hashable, future: Future, compute: Callable):
+        try:
+            result = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._results[key]
+            future.set_exception(e)
+            raise
+        future.set_result(result)
+        return result
+
+    def warm_views(self) -> List[Hashable]:
+        """ Keys of the results computed and kept by cached() """
+        with self._lock:
+            return [key for key, future in self._results.items() if future.done()]
+
+    def results(self) -> Dict[Hashable, object]:
+        """ The results computed and kept by cached(), e.g., to save them """
+        with self._lock:
+            futures = [(key, future) for key, future in self._results.items() if future.done()]
+        return {key: future.result() for key, future in futures if future.exception() is None}
+
+    def restore_results(self, results: Dict[Hashable, object]) -> None:
+        """ Keep results, as from results(), as if computed by cached() """
+        with self._lock:
+            for key, result in results.items():
+                if key not in self._results:
+                    future = Future()
+                    future.set_result(result)
+                    self._results[key] = future
+
+    def forget(self, key: Hashable) -> None:
+        """ Drop the result cached for key, unless it is being computed; it is recomputed on demand """
+        with self._lock:
+            future = self._results.get(key)
+            if future is not None and future.done():
+                del self._results[key]
+
+    def memory(self) -> Dict[str, int]:
+        """
+        Bytes held by this ledger: its transactions, the backend's indexes
+        of them, eras, account tree and views, and each cached result, by
+        repr of its key.  Whatever is shared is counted once, under the
+        first of these that holds it.
+        """
+        seen: set = set()
+        result = {'transactions': deep_size(getattr(self.backend, 'trans', None), seen),
+                  'indexes': deep_size(self.backend, seen),
+                  'eras': deep_size(self.eras, seen),
+                  'account tree': deep_size(self.account_tree, seen)}
+        with self._lock:
+            result['views'] = deep_size(list(self._views.values()), seen)
+            futures = list(self._results.items())
+        for key, future in futures:
+            if future.done() and future.exception() is None:
+                result[repr(key)] = deep_size(future.result(), seen)
+        return result
+
+    def evict(self) -> None:
+        """ Drop the views and cached results, except those being computed; they are recomputed on demand """
+        with self._lock:
+            self._views.clear()
+            for key in [key for key, future in self._results.items() if future.done()]:
+                del self._results[key]
+
+    def append(self, batch: pd.DataFrame) -> Ledger:
+        """
+        A new ledger with batch's splits, as loaded (before flip_signs),
+        after this ledger's, whose derived structures are updated for the
+        batch rather than rebuilt from every transaction: the batch's new
+        accounts are added to the account tree, only the batch's amounts
+        are sign-flipped and assigned eras, the backend's indexes are
+        extended (MemoryBackend.append), and so are the views and the
+        account summary, if they have been computed.  The tree and the
+        summary are built again only if the batch has accounts outside the
+        tree's root, whose branch trim_excess_root removed.  Batch
+        transactions are numbered after this ledger's.  Other cached
+        results are computed again when needed.  This ledger is unchanged.
+
+        The new ledger's id is the content hash that load_data gives the
+        same transactions and eras, so it serializes them all.  The Data
+        Source tab doesn't append: Reload reads every source again, since
+        exports may overlap, and merge_transactions drops the splits they
+        share and orders splits by date across all of them.
+        """
+        if not isinstance(self.backend, MemoryBackend):
+            raise TypeError('only ledgers in memory can be appended to; '
+                            'add exports to SQLite ledgers with backend.py')
+        columns = list(self.backend.trans.columns)
+        names = batch['full account name'].unique()
+        account_tree = add_accounts(self.account_tree, names)
+        regrown = account_tree is None  # a new root, over the old one
+        if regrown:
+            account_tree = make_account_tree_from_trans(pd.concat([self.backend.accounts(), batch]))
+        batch = flip_signs(batch.copy(), account_tree)
+        if 'era' in columns:
+            batch['era'] = assign_eras(batch['date'].to_numpy(), self.eras)
+        if 'transaction' in columns and len(self.backend.trans):
+            batch['transaction'] += self.backend.trans['transaction'].max() + 1
+        batch = batch[columns].reset_index(drop=True)
+
+        backend = self.backend.append(batch)
+        ledger = Ledger(backend, self.eras,
+                        dataset_id(backend.trans.to_json(orient='split', date_format='%Y%m%d'),
+                                   self.eras.to_json(orient='split', date_format='%Y%m%d')),
+                        account_tree)
+        with self._lock:
+            views = dict(self._views)
+        for key, (source, eras, view_tree, earliest, latest) in views.items():
+            filter_accounts = ledger.accounts(key)
+            part = batch[batch['account'].isin(filter_accounts)] if filter_accounts else batch
+            if len(part):
+                source = ledger.backend if not filter_accounts else source.append(part)
+                view_tree = add_accounts(view_tree, part['full account name'].unique())
+                if view_tree is None:
+                    view_tree = make_account_tree_from_trans(source.accounts())
+                earliest = part['date'].min() if pd.isna(earliest) else min(earliest, part['date'].min())
+                latest = part['date'].max() if pd.isna(latest) else max(latest, part['date'].max())
+            elif not filter_accounts:
+                source = ledger.backend
+            ledger._views[key] = (source, eras, view_tree, earliest, latest)
+        if self.ready(('account_summary',)) and not regrown:
+            ledger.restore_results({('account_summary',): self._summary_with(batch, account_tree)})
+        return ledger
+
+    def _summary_with(self, batch: pd.DataFrame, account_tree: Tree) -> pd.DataFrame:
+        """ account_summary, over account_tree, with batch's amounts and counts added up the tree from its accounts """
+        summary = self.account_summary().reindex(list(account_tree.nodes), fill_value=0)
+        columns = {name: summary[name].to_numpy().copy() for name in summary.columns}
+        position = {account: i for i, account in enumerate(summary.index)}
+        direct = batch.groupby('account')['amount'].agg(['sum', 'size'])
+        for account, amount, count in zip(direct.index, direct['sum'], direct['size']):
+            columns['total'][position[account]] += amount
+            columns['count'][position[account]] += count
+            node = account_tree.get_node(account)
+            while node is not None:
+                columns['subtotal'][position[node.identifier]] += amount
+                columns['subcount'][position[node.identifier]] += count
+                node = account_tree.parent(node.identifier)
+        return pd.DataFrame(columns, index=summary.index)
+
+    def flows(self) -> FlowMatrix:
+        """ Flows between accounts, by month (see flows.py), computed once """
+        return self.cached(('flow_matrix',),
+                           lambda: FlowMatrix(self.backend.daily_flows(flipped_accounts(self.account_tree))))
+
+    def account_summary(self) -> pd.DataFrame:
+        """
+        For every account in the tree, the number of transactions and the
+        total amount of its own ('count', 'total') and of its subtree
+        ('subcount', 'subtotal'), indexed by account, computed once, in
+        worker processes for big ledgers (see rollup.py), whose monthly
+        totals and running balances then become the backend's indexes
+        """
+        def compute() -> pd.DataFrame:
+            if isinstance(self.backend, MemoryBackend) and parallel.WORKERS > 1 and \
+                    self.backend.count() >= ROLLUP_ROWS:
+                result = rollup(self.backend.trans)
+                self.backend.adopt(result.monthly_index(), result.running_index(self.backend.trans['date'].to_numpy()))
+                return result.summary(self.account_tree)
+            totals = self.backend.account_totals()
+            amounts = subtree_totals(totals, self.account_tree)
+            counts = subtree_totals(totals.assign(amount=totals['count']), self.account_tree)
+            return amounts.assign(count=counts['total'], subcount=counts['subtotal'])
+        return self.cached(('account_summary',), compute)
+
+    def prepare(self) -> None:
+        """ Build the backend's indexes now, from the account summary's rollup for big ledgers """
+        self.account_summary()
+        self.backend.prepare()
+
+    def account_index(self, filter: Iterable[str] = ()) -> AccountIndex:
+        """ Typeahead over the accounts in view(filter) (see account_index.py), built once """
+        key = tuple(filter)
+
+        def compute() -> AccountIndex:
+            source, eras, account_tree, earliest_trans, latest_trans = self.view(key)
+            return AccountIndex(account_tree, source.account_totals())
+        return self.cached(('account_index', key), compute)
+
+    def search(self,
+               query: str,
+               accounts: Iterable[str] = None,
+               date_start: np.datetime64 = None,
+               date_end: np.datetime64 = None) -> pd.DataFrame:
+        """
+        Return all transactions whose description matches query, optionally
+        limited to the listed accounts and to the date range.
+        """
+        return self.backend.search(query, accounts, date_start, date_end)
+
+
+_ledgers: OrderedDict = OrderedDict()
+_ledgers_lock = threading.Lock()
+
+
+def dataset_id(*parts: str) -> str:
+    """ Content hash of the serialized dataset, so every worker derives the same id. """
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def sqlite_dataset_id(path: str, eras_json: str) -> str:
+    """ dataset_id of a SQLite ledger, whose file's size and time stand in for its contents """
+    stat = os.stat(path)
+    return dataset_id(os.path.abspath(path), str(stat.st_size), str(stat.st_mtime_ns), eras_json)
+
+
+def register_ledger(ledger: Ledger) -> Ledger:
+    """ Keep ledger in this worker's registry, dropping the least recently used beyond MAX_LEDGERS. """
+    with _ledgers_lock:
+        _ledgers[ledger.id] = ledger
+        _ledgers.move_to_end(ledger.id)
+        while len(_ledgers) > MAX_LEDGERS:
+            _ledgers.popitem(last=False)
+    return ledger
+
+
+def admit(size: int, dataset: str = None) -> None:
+    """
+    Make room within MEMORY_BUDGET for a dataset taking size bytes,
+    evicting the cached results of registered ledgers, least recently
+    used first, and then the ledgers themselves, until it fits.  dataset,
+    if registered, is being replaced, so it doesn't count.  Raise
+    MemoryBudgetError if the dataset can't fit at all.
+    """
+    if not MEMORY_BUDGET:
+        return
+    if size > MEMORY_BUDGET:
+        raise MemoryBudgetError(f'the dataset needs {size / MB:,.1f} MB, more than the memory budget of '
+                                f'{MEMORY_BUDGET / MB:,.1f} MB (LEDGER_EXPLORER_MEMORY_BUDGET_MB)')
+    others = [x for x in ledgers() if x.id != dataset]
+    sizes = {x.id: sum(x.memory().values()) for x in others}
+    for ledger in others:
+        if sum(sizes.values()) + size <= MEMORY_BUDGET:
+            break
+        ledger.evict()
+        sizes[ledger.id] = sum(ledger.memory().values())
+        logging.info(f'Evicted the cached results of ledger {ledger.id[:8]} to make room for {size / MB:,.0f} MB')
+    for ledger in others:
+        if sum(sizes.values()) + size <= MEMORY_BUDGET:
+            break
+        with _ledgers_lock:
+            _ledgers.pop(ledger.id, None)
+        del sizes[ledger.id]
+        logging.info(f'Dropped ledger {ledger.id[:8]} to make room for {size / MB:,.0f} MB')
+
+
+def memory_usage() -> Dict[str, Dict[str, int]]:
+    """ Ledger.memory of each registered ledger, by dataset id, least recently used first """
+    return {ledger.id: ledger.memory() for ledger in ledgers()}
+
+
+def get_ledger(key: str) -> Ledger:
+    """ Return the registered ledger with this dataset id, or None. """
+    with _ledgers_lock:
+        ledger = _ledgers.get(key)
+        if ledger is not None:
+            _ledgers.move_to_end(key)
+        return ledger
+
+
+def store_id(data_store: str) -> str:
+    """
+    Return the dataset id of the Dash data_store component, found without
+    parsing the whole dataset, whatever the key order and separators;
+    load_data writes the id last, so it is usually found in the last few
+    characters.
+    """
+    match = _STORE_ID.search(data_store, max(0, len(data_store) - 128)) or _STORE_ID.search(data_store)
+    if match:
+        return match.group(1)
+    data = json.loads(data_store)
+    return data.get('id') or dataset_id(data['trans'], data['eras'])
+
+
+def ledgers() -> List[Ledger]:
+    """ Registered ledgers, least recently used first """
+    with _ledgers_lock:
+        return list(_ledgers.values())
+
+
+def ledger_from_json_store(data_store: str) -> Ledger:
+    """
+    Return the Ledger for the dataset in the Dash data_store component.
+    Parses the stored frames only if this worker hasn't seen the dataset yet.
+    If they don't fit its memory budget, the calling callback doesn't update,
+    and neither does it for a SQLite path outside DATA_DIR, or one whose
+    file isn't the one the dataset id was derived from: the path comes back
+    from the browser, which may have changed it.
+    """
+    key = store_id(data_store)
+    ledger = get_ledger(key)
+    if ledger is None:
+        data = json.loads(data_store)
+        eras = eras_from_json(data['eras'])
+        if 'sqlite' in data:
+            path = data['sqlite']
+            try:
+                if data_file(path, DATA_DIR) != path or sqlite_dataset_id(path, data['eras']) != key:
+                    raise PermissionError(f'{path} is not the SQLite ledger {key[:8]}')
+            except (FileNotFoundError, PermissionError) as E:
+                logging.error(f'Not opening ledger {key[:8]}: {E}')
+                raise PreventUpdate
+            ledger = Ledger(SQLiteBackend(path), eras, key)
+        else:
+            trans = trans_from_json(data.pop('trans'))
+            try:
+                admit(deep_size(trans) + deep_size(eras), key)
+            except MemoryBudgetError as E:
+                logging.error(f'Not loading ledger {key[:8]}: {E}')
+                raise PreventUpdate
+            ledger = Ledger(trans, eras, key)
+        register_ledger(ledger)
+    return ledger
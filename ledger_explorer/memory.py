@@ -0,0 +1,81 @@
+"""
+Memory accounting for the datasets a worker keeps.
+
+deep_size measures what an object holds, following references, so a
+ledger can say how many bytes its transactions, indexes and each cached
+result take (Ledger.memory, and GET /api/memory).  With
+LEDGER_EXPLORER_MEMORY_BUDGET_MB set, a worker keeps its ledgers within
+that many MB: before a dataset is loaded, the cached results of the
+least recently used ledgers are dropped, then those ledgers themselves,
+until the new one fits (see ledger.admit), and a dataset too big to fit
+at all is refused.  Its size is known only once it is parsed, so the
+budget doesn't bound the memory used while parsing.
+"""
+from __future__ import annotations
+
+from collections import deque
+import os
+import sys
+import threading
+import types
+from typing import Set
+
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+MEMORY_BUDGET: int = int(float(os.environ.get('LEDGER_EXPLORER_MEMORY_BUDGET_MB') or 0) * 2 ** 20)  # 0: no budget
+MB: int = 2 ** 20
+
+# not data: their size doesn't grow with the dataset, and they lead to the rest of the program
+_SKIP = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+         type(threading.Lock()), type(threading.RLock()), threading.Thread)
+
+
+class MemoryBudgetError(Exception):
+    pass
+
+
+def deep_size(obj, seen: Set[int] = None) -> int:
+    """
+    Bytes held by obj and everything it refers to, except what is in
+    seen, which is updated, so that objects shared between several calls,
+    e.g., the transactions behind several views, are counted once.
+    Frames count their deep memory usage, including object strings, and
+    arrays their buffers.
+    """
+    seen = set() if seen is None else seen
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, _SKIP):
+            continue
+        seen.add(id(item))
+        if isinstance(item, pd.DataFrame):
+            total += int(item.memory_usage(deep=True).sum())
+        elif isinstance(item, (pd.Series, pd.Index)):
+            total += int(item.memory_usage(deep=True))
+        elif isinstance(item, np.ndarray):
+            total += sys.getsizeof(item)  # with its buffer, unless it is a view of base
+            if item.base is not None:
+                stack.append(item.base)
+            if item.dtype == object:
+                total += sum(map(sys.getsizeof, item.ravel()))
+        elif isinstance(item, dict):
+            total += sys.getsizeof(item)
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            total += sys.getsizeof(item)
+            stack.extend(item)
+        else:
+            total += sys.getsizeof(item)
+            if hasattr(item, '__dict__'):
+                stack.append(vars(item))
+            for slot in getattr(type(item), '__slots__', ()):
+                if hasattr(item, slot):
+                    stack.append(getattr(item, slot))
+    return total
@@ -0,0 +1,83 @@
+"""
+Run independent pieces of a callback, such as the traces of a figure,
+concurrently on a shared thread pool, or, for work that holds the GIL,
+such as parsing CSV files, in worker processes.
+
+The work is mostly pandas and NumPy (filtering, resampling, grouping),
+which releases the GIL for much of its time, and it only reads the shared
+frames, so threads are enough and no data is copied.  Set
+LEDGER_EXPLORER_WORKERS to the degree of parallelism per server process;
+the default is one thread per CPU, and 1 runs everything serially.
+"""
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+import os
+import threading
+from typing import Callable, Dict, Iterable, List
+
+
+WORKERS: int = int(os.environ.get('LEDGER_EXPLORER_WORKERS') or 0) or os.cpu_count() or 1
+THREAD_NAME_PREFIX: str = 'ledger-explorer-worker'
+
+_pool: ThreadPoolExecutor = None
+_pool_lock = threading.Lock()
+_processes: Dict[int, ProcessPoolExecutor] = {}
+
+
+def pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix=THREAD_NAME_PREFIX)
+        return _pool
+
+
+def in_worker() -> bool:
+    return threading.current_thread().name.startswith(THREAD_NAME_PREFIX)
+
+
+def parallel_map(function: Callable, *iterables: Iterable) -> List:
+    """
+    Return list(map(function, *iterables)), computed on the worker pool.
+    Results keep the input order, and the first exception raised by any
+    call is raised here.  Calls from inside a worker run serially, so
+    nested use can't deadlock the pool.
+    """
+    arguments = list(zip(*iterables))
+    if WORKERS <= 1 or len(arguments) <= 1 or in_worker():
+        return [function(*x) for x in arguments]
+    return list(pool().map(lambda x: function(*x), arguments))
+
+
+def process_map(function: Callable, *iterables: Iterable) -> List:
+    """
+    Return list(map(function, *iterables)), computed in up to WORKERS
+    worker processes.  function, its arguments and its results must be
+    picklable.  Workers are started fresh (spawn) rather than forked, since
+    the server has other threads running, and last for this call only, so
+    this is for work that takes seconds per item.
+    """
+    arguments = list(zip(*iterables))
+    if WORKERS <= 1 or len(arguments) <= 1:
+        return [function(*x) for x in arguments]
+    with ProcessPoolExecutor(max_workers=min(WORKERS, len(arguments)),
+                             mp_context=multiprocessing.get_context('spawn')) as processes:
+        return list(processes.map(function, *zip(*arguments)))
+
+
+def process_pool(workers: int = None) -> ProcessPoolExecutor:
+    """
+    A pool of workers (default WORKERS) worker processes, started fresh
+    (spawn) on first use and kept, for work that is done again and again,
+    such as the rollups in rollup.py, where starting processes for each
+    call would cost more than it saves.  Each worker imports the main
+    module, e.g., index.py, as __mp_main__, which defines the app but
+    loads no data (see index.create_server); LEDGER_EXPLORER_WORKERS caps
+    how many are started.
+    """
+    workers = workers or WORKERS
+    with _pool_lock:
+        if workers not in _processes:
+            _processes[workers] = ProcessPoolExecutor(max_workers=workers,
+                                                      mp_context=multiprocessing.get_context('spawn'))
+        return _processes[workers]
@@ -0,0 +1,253 @@
+"""
+Whole-ledger aggregates computed on several cores.
+
+The monthly totals of every account, and the running balance of each
+account after each transaction, are CPU-bound NumPy work over every row,
+which the thread pool in parallel.py can't spread much, since sorting
+and grouping hold the GIL for much of their time.  rollup() copies the
+columns they need (account codes, dates and amounts) once into shared
+memory, ordered by partition, and worker processes (parallel.process_pool)
+attach to them without copying, each aggregating one partition:
+
+- by 'subtree': whole accounts, in order of their top-level account
+  subtrees, packed into partitions of about equal numbers of rows, so no
+  account is split, or
+- by 'time': consecutive date ranges of about equal numbers of rows.
+
+Each partition's monthly totals come back to be merged, adding up the
+months that two date ranges share.  Running balances are written by the
+workers straight into a shared output column; with time partitions, a
+second pass adds each account's balance carried in from the earlier
+partitions.  Account and subtree totals follow from the monthly totals
+(Rollup.summary), and the workers also write each account's row
+positions in date order, so the monthly totals and running balances can
+serve as MemoryBackend's indexes (Rollup.monthly_index, running_index).
+
+Ledgers with at least LEDGER_EXPLORER_ROLLUP_ROWS transactions in memory
+use rollup() for their account summary, and its aggregates for their
+period totals and balances; smaller ones, and servers with one worker,
+aggregate in process, where starting work in other processes would cost
+more than it saves.
+"""
+from __future__ import annotations
+
+import os
+from multiprocessing import shared_memory
+from typing import Dict, List, NamedTuple, Tuple
+
+from treelib import Tree
+
+import parallel
+from lazy import lazy_import
+from utils import subtree_totals
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+ROLLUP_ROWS: int = int(os.environ.get('LEDGER_EXPLORER_ROLLUP_ROWS') or 1_000_000)
+PARTITIONS_PER_WORKER: int = 2  # so a slow partition doesn't hold up the rest
+PARTITIONS = ('subtree', 'time')
+
+ColumnsSpec = Tuple[str, int, List[Tuple[str, str, int]]]  # shared memory name, rows, (column, dtype, offset)
+
+
+class Rollup(NamedTuple):
+    """ Aggregates of a ledger's transactions, from rollup() """
+    monthly: pd.DataFrame    # 'account', 'month', 'amount', 'count' of each account in each month it has transactions
+    balances: np.ndarray     # the balance of each transaction's account after it, in the order of the transactions
+    accounts: pd.Index       # the accounts, by code
+    rows: np.ndarray         # the row positions of the transactions by account code, each account's in date order
+
+    def account_totals(self) -> pd.DataFrame:
+        """ Total amount and number of transactions of each account with transactions """
+        return self.monthly.groupby('account', sort=False)[['amount', 'count']].sum().reset_index()
+
+    def summary(self, account_tree: Tree) -> pd.DataFrame:
+        """ As Ledger.account_summary """
+        totals = self.account_totals()
+        amounts = subtree_totals(totals, account_tree)
+        counts = subtree_totals(totals.assign(amount=totals['count']), account_tree)
+        return amounts.assign(count=counts['total'], subcount=counts['subtotal'])
+
+    def monthly_index(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """ As MemoryBackend.monthly """
+        result = {}
+        for account, group in self.monthly.groupby('account', sort=False):
+            months = group['month'].to_numpy().astype('datetime64[M]')
+            order = np.argsort(months)
+            result[account] = months[order], group['amount'].to_numpy()[order]
+        return result
+
+    def running_index(self, dates: np.ndarray) -> Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """ As MemoryBackend.running, given the dates of the transactions """
+        counts = self.account_totals().set_index('account')['count'].reindex(self.accounts).to_numpy()
+        ends = np.cumsum(counts)
+        result = {}
+        for account, start, end in zip(self.accounts, ends - counts, ends):
+            rows = self.rows[start:end]
+            result[account] = rows, dates[rows], np.concatenate([[0], self.balances[rows]])
+        return result
+
+
+def _share(columns: Dict[str, np.ndarray], order: np.ndarray = None) -> Tuple[shared_memory.SharedMemory, ColumnsSpec]:
+    """ Copy columns of equal length, in order if given, into a new block of shared memory """
+    layout, offset = [], 0
+    for name, column in columns.items():
+        layout.append((name, column.dtype.str, offset))
+        offset += -(-column.nbytes // 8) * 8
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 8))
+    rows = len(next(iter(columns.values())))
+    spec = (block.name, rows, layout)
+    for name, column in _attach(block, spec).items():
+        if order is None:
+            column[:] = columns[name]
+        else:
+            np.take(columns[name], order, out=column)
+    return block, spec
+
+
+def _attach(block: shared_memory.SharedMemory, spec: ColumnsSpec) -> Dict[str, np.ndarray]:
+    name, rows, layout = spec
+    return {column: np.ndarray(rows, dtype=dtype, buffer=block.buf, offset=offset) for column, dtype, offset in layout}
+
+
+def _aggregate(codes: np.ndarray, days: np.ndarray, amounts: np.ndarray, positions: np.ndarray,
+               balances: np.ndarray, ordered: np.ndarray) -> tuple:
+    """
+    For one partition: the codes, months, amounts and counts of each
+    account's transactions in each month, and each transaction's running
+    balance within the partition, written to balances, and the positions
+    of the transactions by account and date, written to ordered.
+    Transactions within a date keep their order.
+    """
+    first_day = days.min() if len(days) else 0
+    order = np.argsort(codes.astype('int64') * (days.max() - first_day + 1 if len(days) else 1) + (days - first_day),
+                       kind='stable')
+    codes, amounts = codes[order], amounts[order]
+    months = days[order].astype('datetime64[D]').astype('datetime64[M]').astype('int64')
+    running = np.cumsum(amounts)
+    account_starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else np.array([], 'int64')
+    before = np.r_[0, running][account_starts]
+    balances[order] = running - np.repeat(before, np.diff(np.r_[account_starts, len(codes)]))
+    ordered[:] = positions[order]
+    starts = np.flatnonzero(np.r_[True, (codes[1:] != codes[:-1]) | (months[1:] != months[:-1])]) \
+        if len(codes) else np.array([], 'int64')
+    sums = np.add.reduceat(amounts, starts) if len(codes) else amounts[:0]
+    return codes[starts], months[starts], sums, np.diff(np.r_[starts, len(codes)])
+
+
+def _aggregate_shared(columns: ColumnsSpec, output: ColumnsSpec, start: int, end: int) -> tuple:
+    """ _aggregate for rows start to end of the shared columns, in a worker process """
+    block, out_block = shared_memory.SharedMemory(columns[0]), shared_memory.SharedMemory(output[0])
+    try:
+        arrays, out = _attach(block, columns), _attach(out_block, output)
+        result = _aggregate(arrays['code'][start:end], arrays['day'][start:end], arrays['amount'][start:end],
+                            arrays['row'][start:end], out['balance'][start:end], out['row'][start:end])
+        del arrays, out  # views of the blocks, which can't be closed while they exist
+        return result
+    finally:
+        block.close()
+        out_block.close()
+
+
+def _carry_shared(columns: ColumnsSpec, output: ColumnsSpec, start: int, end: int, carry: np.ndarray) -> None:
+    """ Add to the running balances of rows start to end their accounts' balances carried in, by code """
+    block, out_block = shared_memory.SharedMemory(columns[0]), shared_memory.SharedMemory(output[0])
+    try:
+        arrays, out = _attach(block, columns), _attach(out_block, output)
+        out['balance'][start:end] += carry[arrays['code'][start:end]]
+        del arrays, out
+    finally:
+        block.close()
+        out_block.close()
+
+
+def _partition(trans: pd.DataFrame, codes: np.ndarray, days: np.ndarray, by: str, parts: int) -> tuple:
+    """ The order of the rows by partition, and the bounds of the partitions in that order """
+    if by == 'subtree':
+        # whole accounts, in order of top-level account and account, so no account is split
+        names = trans['full account name'].to_numpy()
+        first = np.unique(codes, return_index=True)
+        account_names = np.empty(codes.max() + 1 if len(codes) else 0, dtype=object)
+        account_names[first[0]] = names[first[1]]
+        rank = np.empty(len(account_names), dtype='int64')
+        rank[np.argsort(account_names.astype(str), kind='stable')] = np.arange(len(account_names))
+        # a radix sort, for up to 32,767 accounts
+        order = np.argsort(rank[codes].astype('int16' if len(rank) < 2 ** 15 else 'int64'), kind='stable')
+        counts = np.bincount(rank[codes], minlength=len(rank))
+        account_ends = np.cumsum(counts)
+        targets = np.arange(1, parts) * len(codes) / parts
+        bounds = account_ends[np.searchsorted(account_ends, targets)] if len(codes) else np.array([], 'int64')
+    elif by == 'time':
+        order = np.argsort(days, kind='stable')
+        bounds = (np.arange(1, parts) * len(codes)) // parts
+    else:
+        raise ValueError(f'partition by {by}, not one of {PARTITIONS}')
+    bounds = np.unique(np.r_[0, bounds, len(codes)])
+    return order, list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def rollup(trans: pd.DataFrame, by: str = 'subtree', workers: int = None) -> Rollup:
+    """
+    The monthly totals and running balances of transactions, computed
+    in workers (default parallel.WORKERS) worker processes, partitioned
+    by account subtree or by time (see above); with one worker, they are
+    computed here.  The worker processes import the main module afresh
+    (see parallel.process_pool).
+    """
+    workers = workers or parallel.WORKERS
+    account_codes, accounts = pd.factorize(trans['account'], sort=False)
+    codes = account_codes.astype('int32')
+    days = trans['date'].to_numpy().astype('datetime64[D]').astype('int64')
+    amounts = trans['amount'].to_numpy()
+    if workers <= 1:
+        if by not in PARTITIONS:
+            raise ValueError(f'partition by {by}, not one of {PARTITIONS}')
+        balances = np.empty(len(codes), dtype=amounts.dtype)
+        ordered = np.empty(len(codes), dtype='int64')
+        parts = [_aggregate(codes, days, amounts, np.arange(len(codes)), balances, ordered)]
+        return Rollup(_merge(parts, accounts), balances, accounts, ordered)
+
+    order, bounds = _partition(trans, codes, days, by, workers * PARTITIONS_PER_WORKER)
+    block, spec = _share({'code': codes, 'day': days, 'amount': amounts, 'row': np.arange(len(codes))}, order)
+    out_block, out_spec = _share({'balance': np.zeros(len(order), dtype=amounts.dtype),
+                                  'row': np.zeros(len(order), dtype='int64')})
+    try:
+        pool = parallel.process_pool(workers)
+        parts = list(pool.map(_aggregate_shared, *zip(*[(spec, out_spec, start, end) for start, end in bounds])))
+        if by == 'time':
+            # each account's balance at the end of the partitions before each partition
+            totals = np.zeros((len(parts), len(accounts)), dtype=amounts.dtype)
+            for i, (part_codes, months, sums, counts) in enumerate(parts):
+                np.add.at(totals[i], part_codes, sums)
+            carries = np.cumsum(totals, axis=0) - totals
+            list(pool.map(_carry_shared, *zip(*[(spec, out_spec, start, end, carry)
+                                                for (start, end), carry in zip(bounds, carries)])))
+        out = _attach(out_block, out_spec)
+        sorted_balances, sorted_rows = out['balance'].copy(), out['row'].copy()
+        del out
+    finally:
+        for shared in (block, out_block):
+            shared.close()
+            shared.unlink()
+
+    balances = np.empty_like(sorted_balances)
+    balances[order] = sorted_balances
+    # each partition's rows are by account and date; partitions by time are in date order
+    rows = sorted_rows[np.argsort(codes[sorted_rows], kind='stable')]
+    return Rollup(_merge(parts, accounts), balances, accounts, rows)
+
+
+def _merge(parts: list, accounts: pd.Index) -> pd.DataFrame:
+    """ The monthly totals of the partitions, added up where two partitions have the same account and month """
+    codes, months, sums, counts = (np.concatenate(x) for x in zip(*parts))
+    keys = pd.MultiIndex.from_arrays([codes, months])
+    if not keys.is_unique:
+        merged = pd.DataFrame({'amount': sums, 'count': counts}, index=keys).groupby(level=[0, 1], sort=False).sum()
+        codes, months = merged.index.get_level_values(0).to_numpy(), merged.index.get_level_values(1).to_numpy()
+        sums, counts = merged['amount'].to_numpy(), merged['count'].to_numpy()
+    return pd.DataFrame({'account': accounts[codes],
+                         'month': months.astype('datetime64[M]').astype('datetime64[ns]'),
+                         'amount': sums,
+                         'count': counts.astype('int64')})
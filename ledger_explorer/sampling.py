@@ -0,0 +1,150 @@
+"""
+Approximate aggregates from a sample, for exploring very large ledgers.
+
+With LEDGER_EXPLORER_SAMPLE_ROWS set, a ledger with more transactions
+than that keeps a StratifiedSample of about that many (see
+Ledger.sample), built in the background after loading.  Cash Flow then
+draws its time series and sunburst from the sample, with the margin of
+error of each bar and slice in its hover text, until Exact is chosen;
+counts and the transaction table are always exact.
+
+The strata are each account's transactions in each month, so a
+period's or an account's total is a sum of whole strata, and every
+stratum is sampled, at the same rate, but at least MIN_PER_STRATUM
+transactions, or all of them if it has fewer.  Totals are estimated by
+weighting each stratum's sample by its size, and their variances by the
+usual stratified sampling formula, which also holds for totals over
+part of a stratum, e.g., an era starting mid-month.
+"""
+from __future__ import annotations
+
+import os
+from typing import Iterable
+
+from backend import MemoryBackend, QueryBackend, ScopedBackend
+from lazy import lazy_import
+from utils import TIME_RES_LOOKUP, assign_eras, era_bounds
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+SAMPLE_ROWS: int = int(os.environ.get('LEDGER_EXPLORER_SAMPLE_ROWS') or 0)  # 0 turns sampling off
+MIN_PER_STRATUM: int = 2  # so each stratum's variance can be estimated
+
+
+class StratifiedSample:
+    """ A sample of about size of trans, stratified by account and month """
+
+    def __init__(self, trans: pd.DataFrame, size: int, seed: int = 0):
+        months = trans['date'].to_numpy().astype('datetime64[M]')
+        strata = trans.groupby([trans['account'].to_numpy(), months], sort=False).ngroup().to_numpy()
+        population = np.bincount(strata)
+        sizes = np.round(population * (size / max(len(trans), 1))).astype('int64')
+        sizes = np.minimum(population, np.maximum(sizes, MIN_PER_STRATUM))
+
+        # a random order within each stratum; the first of each are the sample
+        order = np.lexsort((np.random.default_rng(seed).random(len(trans)), strata))
+        starts = np.concatenate([[0], np.cumsum(population)[:-1]])
+        rank = np.empty(len(trans), dtype='int64')
+        rank[order] = np.arange(len(trans)) - starts[strata[order]]
+        keep = rank < sizes[strata]
+
+        columns = [x for x in ['date', 'account', 'full account name', 'amount', 'era'] if x in trans.columns]
+        self.rows: pd.DataFrame = trans.loc[keep, columns].assign(stratum=strata[keep]).reset_index(drop=True)
+        self.population: np.ndarray = population  # transactions in each stratum
+        self.sizes: np.ndarray = sizes            # of which sampled
+        self.backend: MemoryBackend = MemoryBackend(self.rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def estimate(self, rows: pd.DataFrame, groups) -> pd.DataFrame:
+        """
+        For sample rows (e.g., those of some accounts) grouped by groups,
+        the estimated total amount of each group's transactions, and its
+        variance, as columns 'amount' and 'variance', indexed by group.
+        """
+        amounts = rows['amount'].to_numpy(dtype='float64')
+        sums = pd.DataFrame({'group': groups, 'stratum': rows['stratum'].to_numpy(),
+                             's1': amounts, 's2': amounts * amounts}).\
+            groupby(['group', 'stratum'], sort=False).sum()
+        strata = sums.index.get_level_values('stratum').to_numpy()
+        population = self.population[strata].astype('float64')
+        sizes = self.sizes[strata].astype('float64')
+        s1 = sums['s1'].to_numpy()
+        s2 = sums['s2'].to_numpy()
+        # rows outside the group count as zeros in the stratum's variance
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variance = np.where(sizes > 1,
+                                population * (population - sizes) / sizes * (s2 - s1 * s1 / sizes) / (sizes - 1),
+                                0)
+        result = pd.DataFrame({'amount': population / sizes * s1, 'variance': np.maximum(variance, 0)},
+                              index=sums.index.get_level_values('group'))
+        return result.groupby(level=0, sort=False).sum()
+
+    def period_estimates(self, accounts: Iterable[str], time_resolution: int) -> pd.DataFrame:
+        """ As utils.period_totals, with variances, as columns 'amount' and 'variance' """
+        rows = self.backend.rows(accounts)
+        months = self.estimate(rows, rows['date'].to_numpy().astype('datetime64[M]'))
+        months.index = pd.DatetimeIndex(months.index).rename('date')
+        resample_keyword = TIME_RES_LOOKUP[time_resolution]['resample_keyword']
+        return months.sort_index().resample(resample_keyword).sum()
+
+    def era_estimates(self, accounts: Iterable[str], eras: pd.DataFrame) -> pd.DataFrame:
+        """ As utils.era_totals, with variances as column 'variance' """
+        rows = self.backend.rows(accounts)
+        era_index = rows['era'].to_numpy() if 'era' in rows.columns else assign_eras(rows['date'].to_numpy(), eras)
+        in_era = era_index >= 0
+        estimates = self.estimate(rows[in_era], era_index[in_era]).sort_index()
+        era_starts, era_ends = era_bounds(eras)
+        occupied = estimates.index.to_numpy()
+        return pd.DataFrame({'value': estimates['amount'].to_numpy(),
+                             'date_start': era_starts[occupied],
+                             'date_end': era_ends[occupied],
+                             'variance': estimates['variance'].to_numpy()},
+                            index=eras.index[occupied])
+
+    def account_estimates(self, accounts: Iterable[str], date_start=None, date_end=None) -> pd.DataFrame:
+        """ As QueryBackend.account_totals, with variances as column 'variance' """
+        rows = self.backend.rows(accounts, date_start, date_end)
+        estimates = self.estimate(rows, rows['full account name'].to_numpy())
+        counts = pd.Series(self.population[rows['stratum']] / self.sizes[rows['stratum']]).\
+            groupby(rows['full account name'].to_numpy(), sort=False).sum()
+        names = rows.drop_duplicates('full account name').set_index('full account name')['account']
+        return pd.DataFrame({'account': names.reindex(estimates.index).to_numpy(),
+                             'full account name': estimates.index.to_numpy(),
+                             'amount': estimates['amount'].to_numpy(),
+                             'count': np.round(counts.reindex(estimates.index).to_numpy()).astype('int64'),
+                             'variance': estimates['variance'].to_numpy()})
+
+
+class SampledBackend(ScopedBackend):
+    """
+    Another backend, limited to some accounts, whose period, era and
+    account totals are estimated from a StratifiedSample, with their
+    variances; everything else, such as counts and rows, is exact.
+    """
+
+    def __init__(self, backend: QueryBackend, accounts: Iterable[str], sample: StratifiedSample):
+        super().__init__(backend, accounts)
+        self.sample: StratifiedSample = sample
+
+    def scoped(self, accounts):
+        return SampledBackend(self.backend, accounts, self.sample)
+
+    def account_totals(self, accounts=None, date_start=None, date_end=None):
+        return self.sample.account_estimates(self._accounts(accounts), date_start, date_end)
+
+    def period_totals(self, accounts, time_resolution):
+        return self.sample.period_estimates(self._accounts(accounts), time_resolution)['amount']
+
+    def period_variances(self, accounts, time_resolution):
+        return self.sample.period_estimates(self._accounts(accounts), time_resolution)['variance']
+
+    def period_estimates(self, accounts, time_resolution):
+        estimates = self.sample.period_estimates(self._accounts(accounts), time_resolution)
+        return estimates['amount'], estimates['variance']
+
+    def era_totals(self, accounts, eras):
+        return self.sample.era_estimates(self._accounts(accounts), eras)
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import bisect
+import re
+from typing import Dict, List
+
+from lazy import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+
+TOKEN_PATTERN: str = r'\w+'
+TRIGRAM_LENGTH: int = 3
+
+
+class SearchIndex:
+    """
+    Full-text index over transaction descriptions, built once per dataset.
+
+    Each description is split into lower-case word tokens.  The index keeps
+    an inverted list of row positions per token, plus a trigram index over
+    the token vocabulary, so that a query term matches every row with a
+    token that contains the term anywhere, not just as a whole word.
+    Multiple query terms must all match (AND).
+
+    Row positions refer to the rows of the frame the index was built from,
+    i.e., they are suitable for DataFrame.iloc.
+    """
+
+    def __init__(self, descriptions: pd.Series):
+        tokens = descriptions.fillna('').astype(str).str.lower().str.findall(TOKEN_PATTERN)
+        tokens.index = np.arange(len(tokens))
+        exploded = tokens.explode().dropna()
+        positions = exploded.index.to_numpy(dtype='int64')
+        groups = pd.Series(positions).groupby(exploded.to_numpy(), sort=True)
+        self.postings: Dict[str, np.ndarray] = {token: np.unique(rows.to_numpy())
+                                                for token, rows in groups}
+        self.vocabulary: List[str] = sorted(self.postings.keys())
+        self.row_count: int = len(descriptions)
+
+        trigrams: Dict[str, set] = {}
+        for token in self.vocabulary:
+            for i in range(len(token) - TRIGRAM_LENGTH + 1):
+                trigrams.setdefault(token[i:i + TRIGRAM_LENGTH], set()).add(token)
+        self.trigrams: Dict[str, frozenset] = {k: frozenset(v) for k, v in trigrams.items()}
+
+    def matching_tokens(self, term: str) -> List[str]:
+        """ Return every indexed token that contains term. """
+        if len(term) < TRIGRAM_LENGTH:
+            # too short for trigrams, so fall back to a prefix match on the sorted vocabulary
+            start = bisect.bisect_left(self.vocabulary, term)
+            end = bisect.bisect_left(self.vocabulary, term + '￿')
+            return self.vocabulary[start:end]
+
+        candidates = None
+        for i in range(len(term) - TRIGRAM_LENGTH + 1):
+            tokens = self.trigrams.get(term[i:i + TRIGRAM_LENGTH])
+            if not tokens:
+                return []
+            candidates = tokens if candidates is None else candidates & tokens
+        # trigrams can match out of order, so confirm the substring
+        return [token for token in candidates if term in token]
+
+    def search(self, query: str) -> np.ndarray:
+        """ Return the sorted row positions of all rows matching every term in query. """
+        terms = re.findall(TOKEN_PATTERN, query.lower())
+        if not terms:
+            return np.arange(self.row_count)
+        result = None
+        for term in terms:
+            postings = [self.postings[token] for token in self.matching_tokens(term)]
+            if not postings:
+                return np.array([], dtype='int64')
+            rows = np.unique(np.concatenate(postings))
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+            if len(result) == 0:
+                break
+        return result
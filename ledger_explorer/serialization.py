@@ -0,0 +1,112 @@
+"""
+Response pipeline for the Flask server behind Dash: a faster JSON encoder
+for callback responses, and gzip/brotli compression negotiated per request.
+
+Install with init_app(app) before the server handles any requests, and
+create the Dash app with compress=False so responses aren't compressed twice.
+"""
+import gzip
+import logging
+from typing import Optional
+
+import flask
+import plotly.utils
+from _plotly_utils.utils import PlotlyJSONEncoder
+
+try:
+    import orjson
+except ImportError:  # optional; falls back to Plotly's encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional; falls back to gzip
+    brotli = None
+
+
+COMPRESS_MIMETYPES: set = {'application/json', 'application/javascript', 'text/css', 'text/html', 'text/xml'}
+COMPRESS_MIN_SIZE: int = 500  # bytes; smaller responses aren't worth the CPU
+GZIP_LEVEL: int = 6
+BROTLI_QUALITY: int = 5  # brotli's default of 11 is far too slow for per-request compression
+
+
+class FastPlotlyJSONEncoder(PlotlyJSONEncoder):
+    """
+    Drop-in replacement for PlotlyJSONEncoder.
+
+    Plotly's encoder dumps, loads and dumps again, to turn NaN and
+    Infinity into null, and converts every NumPy array to a Python list on
+    the way.  With orjson installed, this encodes in one pass instead:
+    NumPy arrays are written directly from their buffers, NaN becomes
+    null, and anything else orjson doesn't know is handed to Plotly's
+    default() as before.
+
+    The plotly.js bundled with this version of Dash predates Plotly's
+    typed-array (base64) encoding, so arrays are still written as JSON
+    lists; the saving is in encoding time.
+    """
+
+    def encode(self, o) -> str:
+        if orjson is None:
+            return super().encode(o)
+        return orjson.dumps(o,
+                            default=self.default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """ Return 'br', 'gzip', or None, from an Accept-Encoding header, preferring brotli. """
+    accepted = {}
+    for item in accept_encoding.lower().split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip()] = quality
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def compress_response(response: flask.Response) -> flask.Response:
+    """ after_request hook: compress the response body with the best encoding the client accepts. """
+    if (response.direct_passthrough
+            or response.is_streamed
+            or response.status_code < 200
+            or response.status_code >= 300
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding(flask.request.headers.get('Accept-Encoding', ''))
+    data = response.get_data()
+    if encoding is None or len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # the compressed bytes differ, but the content is the same
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(app) -> None:
+    """ Install the fast encoder and response compression on a Dash app. """
+    # Dash encodes callback responses with plotly.utils.PlotlyJSONEncoder,
+    # looked up at call time, so replacing it there is enough.
+    plotly.utils.PlotlyJSONEncoder = FastPlotlyJSONEncoder
+    if orjson is None:
+        logging.info('orjson is not installed; using the standard Plotly JSON encoder')
+    app.server.after_request(compress_response)
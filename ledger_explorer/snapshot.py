@@ -0,0 +1,205 @@
+"""
+Warm start: keep the most recently loaded ledger in a snapshot directory,
+and restore it when the server starts, so the first page load gets the
+ledger at once instead of repeating the download, parsing, sign flips,
+tree and era building and the warm-up of the standard views.
+
+Set LEDGER_EXPLORER_SNAPSHOT to the directory, or run
+`python ledger_explorer/index.py --snapshot DIR`.  A snapshot is written
+after each load, once its warm-up is done, and replaces the previous one.
+On startup, the snapshot is served in place of the first load of the same
+transaction and era sources; pressing Reload reads the sources again.
+
+The directory holds snapshot.json, naming the current snapshot, and one
+subdirectory per snapshot, with the normalized transactions (unless they
+are in an SQLite file), the eras, the account tree, the cached results
+and the load response.  These are pickles, so only point this at a
+directory you trust.  Snapshots of any other SNAPSHOT_VERSION are
+rejected; bump it whenever what is saved, or how the app reads it,
+changes.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from backend import MemoryBackend, SQLiteBackend
+from ledger import Ledger, register_ledger
+import warmup
+
+
+SNAPSHOT_VERSION: int = 3  # 2: transactions have 'transaction' numbers; 3: tree_records are node records
+SNAPSHOT_DIR: Optional[str] = os.environ.get('LEDGER_EXPLORER_SNAPSHOT') or None
+MANIFEST: str = 'snapshot.json'
+
+_current: dict = None  # manifest and load response of the current snapshot
+_current_lock = threading.Lock()
+_save_lock = threading.Lock()
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _write_pickle(path: str, value) -> None:
+    with open(path, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _read_pickle(path: str):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _picklable(results: dict) -> dict:
+    """ The results that can be saved; e.g., figures can, but not everything a view might cache """
+    keep = {}
+    for key, value in results.items():
+        try:
+            pickle.dumps((key, value), protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            continue
+        keep[key] = value
+    return keep
+
+
+def save(ledger: Ledger, sources: list, response: dict, directory: str = None) -> str:
+    """
+    Write ledger, loaded from sources ([transactions_url, eras_url]), and
+    the load response that displayed it, as the current snapshot in
+    directory, and return the snapshot's path.  The new snapshot is written
+    in full before snapshot.json is switched to it, so a crash part way
+    leaves the previous one in place.
+    """
+    directory = directory or SNAPSHOT_DIR
+    with _save_lock:
+        os.makedirs(directory, exist_ok=True)
+        path = tempfile.mkdtemp(prefix=f'{ledger.id[:8]}-', dir=directory)
+        if isinstance(ledger.backend, MemoryBackend):
+            _write_pickle(os.path.join(path, 'trans.pkl'), ledger.backend.trans)
+        _write_pickle(os.path.join(path, 'eras.pkl'), ledger.eras)
+        _write_pickle(os.path.join(path, 'account_tree.pkl'), ledger.account_tree)
+        _write_pickle(os.path.join(path, 'results.pkl'), _picklable(ledger.results()))
+        from plotly.utils import PlotlyJSONEncoder  # as Dash encodes the response, e.g., for dates
+        with open(os.path.join(path, 'response.json'), 'w') as f:
+            json.dump(response, f, cls=PlotlyJSONEncoder)
+
+        manifest = {'version': SNAPSHOT_VERSION,
+                    'id': ledger.id,
+                    'sources': list(sources),
+                    'path': os.path.basename(path),
+                    'created': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+        manifest_path = os.path.join(directory, MANIFEST)
+        with open(manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        _set_current(manifest, response)
+
+        # earlier snapshots, and any left half-written
+        for name in os.listdir(directory):
+            if name != manifest['path'] and os.path.isdir(os.path.join(directory, name)):
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return path
+
+
+def save_after(warm_up: Optional[threading.Thread], ledger: Ledger, sources: list, response: dict) -> None:
+    """
+    Save the snapshot in the background once warm_up, if any, is done, so
+    the snapshot includes the warm views.  Nothing is saved if there is no
+    SNAPSHOT_DIR, or if the warm-up was cancelled by a newer load.
+    """
+    if not SNAPSHOT_DIR:
+        return
+
+    def run():
+        if warm_up is not None:
+            warm_up.join()
+            if warm_up.cancelled.is_set():
+                return
+        try:
+            start = time.perf_counter()
+            path = save(ledger, sources, response)
+            logging.info(f'Snapshot of {ledger.id[:8]} saved to {path} in {time.perf_counter() - start:,.1f} s')
+        except Exception:
+            logging.exception(f'Snapshot of {ledger.id[:8]} failed')
+
+    threading.Thread(name=f'snapshot-{ledger.id[:8]}', target=run, daemon=True).start()
+
+
+def read(directory: str = None) -> tuple:
+    """
+    Return (manifest, ledger, response) for the current snapshot in
+    directory.  Raise SnapshotError if there is none, or it is from an
+    incompatible version or can't be read.
+    """
+    directory = directory or SNAPSHOT_DIR
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f'No snapshot in {directory}: {e}')
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        raise SnapshotError(f'Snapshot in {directory} is version {manifest.get("version")}, '
+                            f'not {SNAPSHOT_VERSION}')
+    path = os.path.join(directory, manifest['path'])
+    try:
+        with open(os.path.join(path, 'response.json')) as f:
+            response = json.load(f)
+        data = json.loads(response['data_store'])
+        if 'sqlite' in data:
+            source = SQLiteBackend(data['sqlite'])
+        else:
+            source = _read_pickle(os.path.join(path, 'trans.pkl'))
+        ledger = Ledger(source,
+                        _read_pickle(os.path.join(path, 'eras.pkl')),
+                        manifest['id'],
+                        _read_pickle(os.path.join(path, 'account_tree.pkl')))
+        ledger.restore_results(_read_pickle(os.path.join(path, 'results.pkl')))
+    except Exception as e:
+        # e.g., missing files, or pickles from an incompatible pandas
+        raise SnapshotError(f'Snapshot in {path} is unreadable: {e!r}')
+    return manifest, ledger, response
+
+
+def restore(directory: str = None) -> Optional[Ledger]:
+    """
+    Register the ledger in the current snapshot, if there is a usable one,
+    and serve its load response to the first load of the same sources.
+    Warm-up then fills in any standard views the snapshot lacks.
+    """
+    directory = directory or SNAPSHOT_DIR
+    if not directory:
+        return None
+    start = time.perf_counter()
+    try:
+        manifest, ledger, response = read(directory)
+    except SnapshotError as e:
+        logging.warning(f'{e}; starting without a snapshot')
+        return None
+    register_ledger(ledger)
+    _set_current(manifest, response)
+    warmup.start(ledger)
+    logging.info(f'Restored snapshot of {ledger.id[:8]} from {manifest["created"]} '
+                 f'in {time.perf_counter() - start:,.1f} s; {len(ledger.warm_views())} warm views')
+    return ledger
+
+
+def _set_current(manifest: dict, response: dict) -> None:
+    global _current
+    with _current_lock:
+        _current = {'manifest': manifest, 'response': response}
+
+
+def response_for(sources: list) -> Optional[dict]:
+    """ The load response of the current snapshot, if it was loaded from sources """
+    with _current_lock:
+        if _current is not None and _current['manifest']['sources'] == list(sources):
+            return _current['response']
+    return None
@@ -1,17 +1,34 @@
+from __future__ import annotations
+
+import glob
+import importlib.util
 import json
-import numpy as np
-import pandas as pd
+import os
+import re
 from treelib import Tree
 from treelib import exceptions as tlexceptions
+from typing import TYPE_CHECKING, Iterable, List, Union
 import urllib
+import urllib.parse
 
 from dash.exceptions import PreventUpdate
+import dash_html_components as html
 import dash_table
-import plotly.express as px
+from plotly.colors import qualitative
 import plotly.graph_objects as go
 
+import figures
+from lazy import lazy_import
+from parallel import process_map
+
+if TYPE_CHECKING:
+    from backend import QueryBackend
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
 
-disc_colors = px.colors.qualitative.D3
+disc_colors = qualitative.D3
 
 big_font = dict(
     family='IBM Plex Sans Medium',
@@ -49,6 +66,30 @@ chart_fig_layout = dict(
         font_color='var(--fg)',
         font=medium_font))
 
+# the parts of each kind of figure that don't change, validated once (see figures.py)
+chart_template = figures.layout_template(chart_fig_layout)
+
+sunburst_template = figures.layout_template(dict(
+    legend={'tracegroupgap': 0},  # as from px.sunburst
+    height=600,
+    font=big_font,
+    paper_bgcolor='rgba(0,0,0,0)',
+    plot_bgcolor='rgba(0,0,0,0)',
+    margin=dict(
+        t=10,
+        l=5,  # NOQA
+        r=5,
+        b=5)))
+
+sunburst_trace_template = figures.Template(lambda: go.Sunburst(
+    branchvalues='total',
+    domain={'x': [0.0, 1.0], 'y': [0.0, 1.0]},
+    name='',
+    marker={'colorscale': 'Aggrnyl'},
+    insidetextorientation='horizontal',
+    hovertemplate='%{label}<br>%{value:,.0f}',
+    texttemplate='%{label}<br>%{value:,.0f}').to_plotly_json())
+
 
 trans_table = dash_table.DataTable(
     id='trans_table',
@@ -138,7 +179,10 @@ bs_trans_table = dash_table.DataTable(
 
 LEAF_SUFFIX: str = ' [Leaf]'
 OTHER_PREFIX: str = 'Other '
-MAX_SLICES: int = 7  # TODO: expose this in a control
+OTHER_SUFFIX: str = ' [Other]'
+MAX_SLICES: int = 7       # default for the Slices control
+SLICES_OPTIONS: list = [{'label': str(x), 'value': x} for x in (5, 7, 10, 20)]
+SUNBURST_DEPTH: int = 3   # rings in a sunburst figure, below the account it is zoomed to
 ROOT_ACCOUNTS = [{'id': 'Assets', 'flip_negative': False},
                  {'id': 'Equity', 'flip_negative': True},
                  {'id': 'Expenses', 'flip_negative': True},
@@ -148,6 +192,10 @@ ROOT_TAG = '[Total]'
 ROOT_ID = 'root'
 
 SUBTOTAL_SUFFIX: str = ' [Subtotal]'
+EXPORT_FORMATS: list = ['csv', 'parquet']  # file types of /api/ledgers/<id>/export (see api.py)
+FLOW_DEPTH: int = 2        # Sankey nodes are accounts this deep, e.g., Expenses:Food
+MAX_FLOW_LINKS: int = 40   # and show only the largest flows
+MARGIN_Z: float = 1.96     # margins of error of sampled totals are 95% intervals
 TIME_RES_LOOKUP: dict = {
     1: {'label': 'Era', 'abbrev': 'era'},
     2: {'label': 'Year', 'abbrev': 'Y', 'resample_keyword': 'A', 'months': 12, 'format': '%Y'},
@@ -161,43 +209,61 @@ TIME_RES_OPTIONS: list = [
 TIME_SPAN_LOOKUP: dict = {
     True: {'label': 'Annualized', 'abbrev': ' ⁄y', 'months': 12},
     False: {'label': 'Monthly', 'abbrev': ' ⁄mo', 'months': 1}}
+# TIME_SPAN_LOOKUP keyed the way the browser sees it, for the clientside callbacks
+TIME_SPAN_JS: dict = {str(k).lower(): {'label': v['label'], 'months': v['months']} for k, v in TIME_SPAN_LOOKUP.items()}
+DAYS_PER_MONTH: float = 365.2425 / 12
+NO_ERA: int = -1
+# the directory whose files, and glob patterns, may be loaded; otherwise only URLs (see transaction_sources)
+DATA_DIR: str = os.environ.get('LEDGER_EXPLORER_DATA_DIR') or None
+
+
+def trans_from_json(trans_json: str) -> pd.DataFrame:
+    """ Parse transactions stored in the Dash JSON component """
+    return pd.read_json(trans_json,
+                        orient='split',
+                        dtype={'date': 'datetime64',
+                               'description': 'object',
+                               'amount': 'int64',
+                               'account': 'object',
+                               'full account name': 'object',
+                               'transaction': 'int64',
+                               'era': 'int64'})
 
 
 def data_from_json_store(data_store: str, filter: list) -> tuple:
     """ Parse data stored in Dash JSON component.  Used to move data between different
     callbacks in Dash """
     data = json.loads(data_store)
-    trans = pd.read_json(data['trans'],
-                         orient='split',
-                         dtype={'date': 'datetime64',
-                                'description': 'object',
-                                'amount': 'int64',
-                                'account': 'object',
-                                'full account name': 'object'})
-    orig_account_tree = make_account_tree_from_trans(trans)
+    trans = trans_from_json(data['trans'])
+    account_tree = make_account_tree_from_trans(trans)
     filter_accounts: list = []
 
     for account in filter:
-        filter_accounts = filter_accounts + [account] + get_descendents(account, orig_account_tree)
+        filter_accounts = filter_accounts + [account] + get_descendents(account, account_tree)
 
     if filter_accounts:
         trans = trans[trans['account'].isin(filter_accounts)]
+        # rebuild account tree from filtered trans
+        account_tree = make_account_tree_from_trans(trans)
 
-    # rebuild account tree from filtered trans
-    account_tree = make_account_tree_from_trans(trans)
+    eras = eras_from_json(data['eras'])
+
+    earliest_trans: np.datetime64 = trans['date'].min()
+    latest_trans: np.datetime64 = trans['date'].max()
+
+    return trans, eras, account_tree, earliest_trans, latest_trans
 
-    eras = pd.read_json(data['eras'],
+
+def eras_from_json(eras_json: str) -> pd.DataFrame:
+    """ Parse eras stored in the Dash JSON component """
+    eras = pd.read_json(eras_json,
                         orient='split',
                         dtype={'index': 'str', 'date_start': 'datetime64', 'date_end': 'datetime64'})
     # No idea why era dates suddenly became int64 instead of datetime.  Kludge it back.
     if len(eras) > 0:
         eras['date_start'] = eras['date_start'].astype('datetime64[ms]')
         eras['date_end'] = eras['date_end'].astype('datetime64[ms]')
-
-    earliest_trans: np.datetime64 = trans['date'].min()
-    latest_trans: np.datetime64 = trans['date'].max()
-
-    return trans, eras, account_tree, earliest_trans, latest_trans
+    return eras
 
 
 def get_descendents(account_id: str, account_tree: Tree) -> list:
@@ -214,23 +280,69 @@ def get_descendents(account_id: str, account_tree: Tree) -> list:
     return descendent_list
 
 
-def make_bar(trans: pd.DataFrame,
+def period_totals(trans: pd.DataFrame, time_resolution: int) -> pd.Series:
+    """ Total amount in each Year, Quarter, or Month time_resolution
+    period, indexed by the last day of the period.  Empty periods are zero. """
+    resample_keyword = TIME_RES_LOOKUP[time_resolution]['resample_keyword']
+    return trans.set_index('date')['amount'].resample(resample_keyword).sum()
+
+
+def era_totals(trans: pd.DataFrame, eras: pd.DataFrame) -> pd.DataFrame:
+    """ Total amount in each era with transactions, in era order, indexed
+    by era name, with the era's date_start and date_end.  Transactions
+    outside every era are left out. """
+    era_starts, era_ends = era_bounds(eras)
+    if 'era' in trans.columns:
+        era_index = trans['era'].to_numpy()
+    else:
+        era_index = assign_eras(trans['date'].to_numpy(), eras)
+    in_era = era_index >= 0
+    # integer groupby: one bin per era, in era order
+    era_counts = np.bincount(era_index[in_era], minlength=len(eras))
+    era_sums = np.bincount(era_index[in_era],
+                           weights=trans['amount'].to_numpy()[in_era],
+                           minlength=len(eras))
+    occupied = np.flatnonzero(era_counts)
+    return pd.DataFrame({'value': era_sums[occupied],
+                         'date_start': era_starts[occupied],
+                         'date_end': era_ends[occupied]},
+                        index=eras.index[occupied])
+
+
+def subtree_totals(trans: pd.DataFrame, account_tree: Tree) -> pd.DataFrame:
+    """ For every account in account_tree, the total amount of its own
+    transactions ('total') and of its own and all descendent accounts'
+    transactions ('subtotal'), indexed by account.  trans may be
+    transactions, or account totals from QueryBackend.account_totals. """
+    direct = trans.groupby('account')['amount'].sum()
+    totals = dict.fromkeys(account_tree.nodes, 0)
+    for account, amount in direct.items():
+        node = account_tree.get_node(account)
+        while node is not None:
+            totals[node.identifier] += amount
+            node = account_tree.parent(node.identifier)
+    result = pd.DataFrame({'subtotal': pd.Series(totals, dtype=direct.dtype)})
+    result.insert(0, 'total', direct.reindex(result.index, fill_value=0))
+    return result
+
+
+def make_bar(source: QueryBackend,
              account_tree: Tree,
              eras: pd.DataFrame,
              account_id: str,
              color_num: int = 0,
              time_resolution: int = 0,
              time_span: int = 1,
-             deep: bool = False) -> go.Bar:
-    """ returns a go.Bar object with total by time_resolution period for
-    the selected account.  If deep, include total for all descendent accounts. """
+             deep: bool = False) -> dict:
+    """ returns a bar trace (see figures.py) with total by time_resolution period for
+    the selected account, from the transactions in source (see backend.py).
+    If deep, include total for all descendent accounts. """
 
     if deep:
-        tba = trans[trans['account'].isin([account_id] + get_descendents(account_id, account_tree))]
+        accounts = [account_id] + get_descendents(account_id, account_tree)
     else:
-        tba = trans[trans['account'] == account_id]
+        accounts = [account_id]
 
-    tba = tba.set_index('date')
     tr: dict = TIME_RES_LOOKUP[time_resolution]
     tr_hover: str = tr.get('abbrev', None)      # e.g., "Q"
     tr_label: str = tr.get('label', None)       # e.g., "Quarter"
@@ -258,90 +370,88 @@ def make_bar(trans: pd.DataFrame,
         # don't ever run out of colors
         marker_color = 'var(--Cyan)'
 
+    margins = None  # for totals estimated from a sample
     if trace_type == 'periodic':
-        resample_keyword = tr['resample_keyword']
-        bin_amounts = tba.resample(resample_keyword).\
-            sum()['amount'].\
-            to_frame(name='value')
+        totals, variances = source.period_estimates(accounts, time_resolution)
+        bin_amounts = totals.to_frame(name='value')
+        if variances is not None:
+            margins = sampling_margins(bin_amounts['value'], variances)
         factor = ts_months / tr_months
         bin_amounts['x'] = bin_amounts.index.to_period().strftime(format)
         bin_amounts['y'] = bin_amounts['value'] * factor
         bin_amounts['text'] = f'{tr_hover}'
         bin_amounts['customdata'] = account_id
         bin_amounts['texttemplate'] = '%{customdata}'  # workaround for passing variables through layers of plotly
-        trace = go.Bar(
+        trace = dict(
+            type='bar',
             name=account_id,
-            x=bin_amounts.x,
-            y=bin_amounts.y,
-            customdata=bin_amounts.customdata,
-            text=bin_amounts.text,
-            texttemplate=bin_amounts.texttemplate,
+            x=bin_amounts.x.to_numpy(),
+            y=bin_amounts.y.to_numpy(),
+            customdata=bin_amounts.customdata.to_numpy(),
+            text=bin_amounts.text.to_numpy(),
+            texttemplate=bin_amounts.texttemplate.to_numpy(),
             textposition='auto',
             opacity=0.9,
             hovertemplate='%{x}<br>%{customdata}:<br>%{y:$,.0f}<br>',
-            marker_color=marker_color)
+            marker={'color': marker_color})
     elif trace_type == 'era':
-        latest_tba = tba.index.max()
-        # convert the era dates to a series that can be used for grouping
-        bins = eras.date_start.sort_values()
-        bin_boundary_dates = bins.tolist()
-        bin_labels = bins.index.tolist()
-        # there must be one more bin boundary than label, so:
-        if bin_boundary_dates[-1] <= latest_tba:
-            # if there's going to be any data in the last bin, add a final boundary
-            bin_boundary_dates = bin_boundary_dates + [latest_tba]
-        else:
-            # otherwise, lose its label, leaving its start as the final boundary of the previous
-            bin_labels = bin_labels[0:-1]
-
-        tba['bin'] = pd.cut(x=tba.index, bins=bin_boundary_dates, labels=bin_labels, duplicates='drop')
-        bin_amounts = pd.DataFrame({'date': bin_boundary_dates[0:-1],
-                                    'value': tba.groupby('bin')['amount'].sum()})
-        bin_amounts['date_start'] = bin_boundary_dates[0:-1]
-        bin_amounts['date_end'] = bin_boundary_dates[1:]
+        bin_amounts = source.era_totals(accounts, eras)
+        if 'variance' in bin_amounts:
+            margins = sampling_margins(bin_amounts['value'], bin_amounts['variance'])
         # Plotly bars want the midpoint and width:
-        bin_amounts['delta'] = bin_amounts['date_end'] - bin_amounts['date_start']
+        bin_amounts['delta'] = bin_amounts['date_end'] - bin_amounts['date_start'] + np.timedelta64(1, 'D')
         bin_amounts['width'] = bin_amounts['delta'] / np.timedelta64(1, 'ms')
         bin_amounts['midpoint'] = bin_amounts['date_start'] + bin_amounts['delta'] / 2
-        bin_amounts['months'] = bin_amounts['delta'] / np.timedelta64(1, 'M')
+        bin_amounts['months'] = bin_amounts['delta'] / np.timedelta64(1, 'D') / DAYS_PER_MONTH
         bin_amounts['value'] = bin_amounts['value'] * (ts_months / bin_amounts['months'])
         bin_amounts['text'] = account_id
         bin_amounts['customdata'] = bin_amounts['text'] + '<br>' +\
             bin_amounts.index.astype(str) + '<br>(' +\
-            bin_amounts['date_start'].astype(str) + \
-            ' to ' + bin_amounts['date_end'].astype(str) + ')'
-        trace = go.Bar(
+            bin_amounts['date_start'].dt.strftime('%Y-%m-%d') + \
+            ' to ' + bin_amounts['date_end'].dt.strftime('%Y-%m-%d') + ')'
+        trace = dict(
+            type='bar',
             name=account_id,
-            x=bin_amounts.midpoint,
-            width=bin_amounts.width,
-            y=bin_amounts.value,
-            customdata=bin_amounts.customdata,
-            text=bin_amounts.text,
+            x=figures.dates(bin_amounts.midpoint),
+            width=bin_amounts.width.to_numpy(),
+            y=bin_amounts.value.to_numpy(),
+            customdata=bin_amounts.customdata.to_numpy(),
+            text=bin_amounts.text.to_numpy(),
             textposition='auto',
             opacity=0.9,
             texttemplate='%{text}<br>%{value:$,.0f}',
             hovertemplate='%{customdata}<br>%{value:$,.0f}',
-            marker_color=marker_color)
+            marker={'color': marker_color})
     else:
         PreventUpdate
+    if margins is not None:
+        trace['hovertext'] = margins
+        trace['hovertemplate'] += '<br>%{hovertext}'
     return trace
 
 
+def sampling_margins(values: pd.Series, variances: pd.Series) -> np.ndarray:
+    """
+    The margins of error of totals estimated from a sample (see
+    sampling.py), as hover text.  They are relative to the totals, so
+    they hold when the browser rescales the figure.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = MARGIN_Z * np.sqrt(np.asarray(variances, dtype='float64')) / \
+            np.abs(np.asarray(values, dtype='float64'))
+    return np.array([f'±{x:.1%} (sampled)' if np.isfinite(x) else 'sampled' for x in relative], dtype=object)
+
+
 def make_cum_area(
-        trans: pd.DataFrame,
+        source: QueryBackend,
         account_id: str,
         color_num: int = 0,
-        time_resolution: int = 0) -> go.Scatter:
-    """ returns an object with cumulative total by time_resolution period for
-    the selected account."""
-
-    tr = TIME_RES_LOOKUP[time_resolution]
-    resample_keyword = tr['resample_keyword']
-    trans = trans.set_index('date')
+        time_resolution: int = 0) -> dict:
+    """ returns a stacked area trace (see figures.py) with cumulative total by time_resolution period for
+    the selected account, from the transactions in source (see backend.py)."""
 
-    bin_amounts = trans.resample(resample_keyword).sum().cumsum()
+    bin_amounts = source.balances([account_id], time_resolution).to_frame(name='value')
     bin_amounts['date'] = bin_amounts.index
-    bin_amounts['value'] = bin_amounts['amount']
     bin_amounts['label'] = account_id
     try:
         marker_color = disc_colors[color_num]
@@ -349,13 +459,14 @@ def make_cum_area(
         # don't ever run out of colors
         marker_color = 'var(--Cyan)'
     bin_amounts['texttemplate'] = '%{customdata}'  # workaround for passing variables through layers of plotly
-    scatter = go.Scatter(
-        x=bin_amounts['date'],
-        y=bin_amounts['value'],
+    scatter = dict(
+        type='scatter',
+        x=figures.dates(bin_amounts['date']),
+        y=bin_amounts['value'].to_numpy(),
         name=account_id,
         mode='lines+markers',
         marker={'symbol': 'circle', 'opacity': 1, 'color': marker_color},
-        customdata=bin_amounts['label'],
+        customdata=bin_amounts['label'].to_numpy(),
         hovertemplate='%{customdata}<br>%{y:$,.0f}<br>%{x}<extra></extra>',
         line={'width': 0.5, 'color': marker_color},
         hoverlabel={'namelength': 15},
@@ -381,224 +492,196 @@ def make_scatter(account_id: str, trans: pd.DataFrame, color_num: int = 0):
     return trace
 
 
+def sunburst_frame(account_totals: pd.DataFrame,
+                   scale: float,
+                   SUBTOTAL_SUFFIX: str = SUBTOTAL_SUFFIX,
+                   max_slices: int = MAX_SLICES,
+                   level: str = None,
+                   depth: int = SUNBURST_DEPTH) -> pd.DataFrame:
+    """
+    The nodes of a sunburst of account_totals (see make_sunburst), as
+    columns 'id', 'name', 'parent', 'value' and 'depth', with a bounded
+    number of nodes however many accounts there are:
+
+    * Each account's total is multiplied by scale and rounded; negative
+      totals count as zero, and nodes with a zero subtotal are left out.
+    * An account with both its own transactions and sub-accounts becomes
+      a subtotal node, named with SUBTOTAL_SUFFIX, with a child node,
+      LEAF_SUFFIX in its id, for its own transactions.
+    * Where a node has more than max_slices children, the smallest are
+      folded, with their subtrees, into one 'Other' child, OTHER_SUFFIX in
+      its id, so there are at most max_slices; its 'folded' column lists
+      the ids of the nodes folded into it, and is None for other nodes.
+      Accounts on the path to level are never folded.
+    * Only depth levels below level (the root, by default) are included,
+      plus the path from the root down to level, and the siblings along
+      that path, so the chart can zoom out from level.
+
+    If account_totals were estimated from a sample, with a 'variance'
+    column, the nodes have the variances of their values too.
+    """
+    totals = positize(account_totals.copy())
+    ids, parent_ids = account_parents(totals['full account name'].unique())
+    position: dict = {x: i for i, x in enumerate(ids)}
+    parents = np.array([-1] + [position[x] for x in parent_ids[1:]], dtype='int64')
+    depths = np.zeros(len(ids), dtype='int64')
+    for i in range(1, len(ids)):  # breadth first, so each parent comes before its children
+        depths[i] = depths[parents[i]] + 1
+
+    own = totals.groupby('account')['amount'].sum().reindex(ids, fill_value=0).to_numpy(dtype='float64')
+    with np.errstate(all='ignore'):
+        own = np.round(own * scale)
+    own[~np.isfinite(own) | (own < 0)] = 0
+    own = own.astype('int64')
+    subtotals = own.copy()
+    sampled = 'variance' in totals.columns
+    own_variances = totals.groupby('account')['variance'].sum().reindex(ids, fill_value=0).\
+        to_numpy(dtype='float64') * scale * scale if sampled else np.zeros(len(ids))
+    variances = own_variances.copy()
+    for d in range(depths.max(initial=0), 0, -1):
+        at = np.flatnonzero(depths == d)
+        np.add.at(subtotals, parents[at], subtotals[at])
+        np.add.at(variances, parents[at], variances[at])
+    has_children = np.zeros(len(ids), dtype=bool)
+    has_children[parents[1:]] = True
+
+    names = [ROOT_TAG if x == ROOT_ID else x + SUBTOTAL_SUFFIX if children else x
+             for x, children in zip(ids, has_children)]
+    frame = pd.DataFrame({'id': ids, 'name': names, 'parent': parent_ids, 'value': subtotals, 'depth': depths,
+                          'variance': variances})
+    split = has_children & (own > 0)
+    leaves = pd.DataFrame({'id': [x + LEAF_SUFFIX for x in frame['id'][split]],
+                           'name': frame['id'][split].to_numpy(),
+                           'parent': frame['id'][split].to_numpy(),
+                           'value': own[split],
+                           'depth': depths[split] + 1,
+                           'variance': own_variances[split]})
+    frame = pd.concat([frame[frame['value'] != 0], leaves], ignore_index=True).assign(folded=None)
+
+    # the path from the root to level, which is never folded
+    parent_of: dict = dict(zip(frame['id'], frame['parent']))
+    if level not in parent_of:
+        level = frame['id'].iloc[0] if len(frame) else None
+    path: list = [level]
+    while parent_of.get(path[-1]) is not None:
+        path.append(parent_of[path[-1]])
+
+    # fold the smallest siblings into Other
+    rank = frame['value'].astype('float64').where(~frame['id'].isin(path), np.inf).\
+        groupby(frame['parent'], sort=False).rank(method='first', ascending=False)
+    crowded = frame.groupby('parent', sort=False)['id'].transform('size') > max_slices
+    folded = frame[crowded & (rank >= max_slices)]
+    others = folded.groupby('parent', sort=False).\
+        agg(value=('value', 'sum'), depth=('depth', 'first'), variance=('variance', 'sum'), folded=('id', list)).\
+        reset_index()
+    others.insert(0, 'id', others['parent'] + OTHER_SUFFIX)
+    others.insert(1, 'name', [OTHER_PREFIX + ('accounts' if x == ROOT_ID else x) for x in others['parent']])
+    gone = set(folded['id'])
+    for d in range(frame['depth'].to_numpy().max(initial=-1) + 1):
+        at_depth = frame[(frame['depth'] == d) & frame['parent'].isin(gone)]
+        gone.update(at_depth['id'])
+    frame = pd.concat([frame[~frame['id'].isin(gone)], others[frame.columns]], ignore_index=True)
+
+    # the window of depth levels below level
+    level_depth = len(path) - 1
+    inside = {level}
+    for d in range(level_depth + 1, min(level_depth + depth, frame['depth'].to_numpy().max(initial=0)) + 1):
+        at_depth = frame[(frame['depth'] == d) & frame['parent'].isin(inside)]
+        inside.update(at_depth['id'])
+    keep = frame['id'].isin(inside) | frame['id'].isin(path) | frame['parent'].isin(path)
+    if not sampled:
+        frame = frame.drop(columns='variance')
+    return frame[keep].reset_index(drop=True)
+
+
 def make_sunburst(
-        trans: pd.DataFrame,
-        date_start: np.datetime64 = None,
+        account_totals: pd.DataFrame,
+        date_start: np.datetime64,
         date_end: np.datetime64 = None,
         SUBTOTAL_SUFFIX: str = None,
-        time_span: int = 1):
+        time_span: int = 1,
+        max_slices: int = MAX_SLICES,
+        level: str = None,
+        depth: int = SUNBURST_DEPTH):
     """
-    Using a tree of accounts and a DataFrame of transactions,
-    generate a figure for a sunburst, where each node is an account
-    in the tree, and the value of each node is the subtotal of all
-    transactions for that node and any subtree, filtered by date.
+    Using the total of each account's transactions between date_start
+    and date_end (see QueryBackend.account_totals), generate a figure for
+    a sunburst, where each node is an account in the tree, and the value
+    of each node is the subtotal of all transactions for that node and any
+    subtree, averaged over time_span.  The figure has at most max_slices
+    slices per ring, and depth rings below level; see sunburst_frame.
+    Deeper rings are fetched by making the account that the chart zooms
+    to the new level.
     """
-
-    #######################################################################
-    # Set up a new tree with totals based on date-filtered transactions
-    #######################################################################
-    if not date_start:
-        date_start = trans['date'].min()
     if not date_end:
         date_end = pd.Timestamp.now()
 
     ts = TIME_SPAN_LOOKUP[time_span]
     ts_months = ts.get('months')     # e.g., 12
-
     duration_m = pd.to_timedelta((date_end - date_start), unit='ms') / np.timedelta64(1, 'M')
-    sel_trans = trans[(trans['date'] >= date_start) & (trans['date'] <= date_end)]
-    sel_trans = positize(sel_trans)
-
-    def make_subtotal_tree(trans, prorate_months):
-        """
-        Calculate the subtotal for each node (direct subtotal only, no children) in
-        the provided transaction tree and store it in the tree.
-        """
-        trans = trans.reset_index(drop=True).set_index('account')
-        sel_tree = make_account_tree_from_trans(trans)
-        subtotals = trans.groupby('account').sum()['amount']
-        for node in sel_tree.all_nodes():
-            try:
-                subtotal = subtotals.loc[node.tag]
-            except KeyError:
-                # These should be nodes without leaf_totals, and therefore
-                # not present in the subtotals DataFrame
-                continue
-
-            try:
-                norm_subtotal = round(subtotal * ts_months / duration_m)
-            except OverflowError:
-                norm_subtotal = 0
-            if norm_subtotal < 0:
-                norm_subtotal = 0
-            node.data = {'leaf_total': norm_subtotal}
-
-        return sel_tree
-
-    _sun_tree = make_subtotal_tree(sel_trans, ts_months)
-
-    #######################################################################
-    # Total up all the nodes.
-    #######################################################################
-    # sunburst is very very finicky and wants the subtotals to be
-    # exactly correct and never missing, so build them directly from
-    # the leaf totals to avoid floats, rounding, and other fatal problems.
-    #
-    # If a leaf_total is moved out of a subtotal, there
-    # has to be a way to differentiate between clicking
-    # on the sub-total and clicking on the leaf.  Do this by
-    # appending a magic string to the id of the leaf.
-    # Then, use the tag as the key to transaction.account.
-    # This will cause the parent tag, 'XX Subtotal', to fail matches, and
-    # the child, which is labeled 'XX Leaf' but tagged 'XX' to match.
-
-    # BEFORE                          | AFTER
-    # id   parent   tag  leaf_total   | id       parent   tag          leaf_total    total
-    # A             A            50   | A                 A Subtotal                    72
-    # B    A        B            22   | A Leaf   A        A                    50       50
-    #                                 | B        A        B                    22       22
-
-    def set_node_total(node):
-        """
-        Set the total value of the node as a property of the node.  Assumes
-        a _sun_tree Tree in surrounding scope, and modifies that
-        treelib as a side effect.
-
-        Assumption: No negative leaf values
-
-        Uses 'leaf_total' for all transactions that belong to this node's account,
-        and 'total' for the final value for the node, including descendants.
-        """
-        nonlocal _sun_tree
-        node_id = node.identifier
-        tag = node.tag
-        try:
-            leaf_total = node.data.get('leaf_total', 0)
-        except AttributeError:
-            # in case it doesn't even have a data node
-            leaf_total = 0
-        running_subtotal = leaf_total
-
-        children = _sun_tree.children(node_id)
-
-        if children:
-            # if it has children, rename it to subtotal, but
-            # don't change the identity.  Don't do this for
-            # the root node, which doesn't need a rename
-            # and will look worse if it gets one
-
-            if node_id != ROOT_ID:
-                subtotal_tag = tag + SUBTOTAL_SUFFIX
-                _sun_tree.update_node(node_id, tag=subtotal_tag)
-
-            # If it has its own leaf_total, move that amount
-            # to a new leaf node
-            if leaf_total > 0:
-
-                new_leaf_id = node_id + LEAF_SUFFIX
-                node.data['leaf_total'] = 0
-                _sun_tree.create_node(identifier=new_leaf_id,
-                                      tag=tag,
-                                      parent=node_id,
-                                      data=dict(leaf_total=leaf_total,
-                                                total=leaf_total))
-
-            for child in children:
-                # recurse to get subtotals.  This won't double-count
-                # the leaf_total from the node because children
-                # was set before the new synthetic node
-                child_total = set_node_total(child)
-                running_subtotal += child_total
-
-        # Remove zeros, because they look terrible in sunburst.
-        if running_subtotal == 0:
-            _sun_tree.remove_node(node_id)
-        else:
-            if node.data:
-                node.data['total'] = running_subtotal
-            else:
-                node.data = {'total': running_subtotal}
-
-        return running_subtotal
-
-    root = _sun_tree.get_node(_sun_tree.root)
-
-    set_node_total(root)
-
-    def summarize_to_other(node):
-        """
-        If there are more than (MAX_SLICES - 2) children in this node,
-        group the excess children into a new 'other' node.
-        Recurse to do this for all children, including any 'other' nodes
-        that get created.
-
-        The "-2" accounts for the Other node to be created, and for
-        one-based vs zero-based counting.
-        """
-        nonlocal _sun_tree
-        node_id = node.identifier
-        children = _sun_tree.children(node_id)
-        if len(children) > (MAX_SLICES - 2):
-            other_id = OTHER_PREFIX + node_id
-            other_subtotal = 0
-            _sun_tree.create_node(identifier=other_id,
-                                  tag=other_id,
-                                  parent=node_id,
-                                  data=dict(total=other_subtotal))
-            total_list = [(dict(identifier=x.identifier,
-                                total=x.data['total']))
-                          for x in children]
-            sorted_list = sorted(total_list, key=lambda k: k['total'], reverse=True)
-            for i, child in enumerate(sorted_list):
-                if i > (MAX_SLICES - 2):
-                    other_subtotal += child['total']
-                    _sun_tree.move_node(child['identifier'], other_id)
-            _sun_tree.update_node(other_id, data=dict(total=other_subtotal))
-
-        children = _sun_tree.children(node_id)
-
-        for child in children:
-            summarize_to_other(child)
-
-    # summarize_to_other(root)
-
-    #######################################################################
-    # Make the figure
-    #######################################################################
-
-    sun_frame = pd.DataFrame([(x.identifier,
-                               x.tag,
-                               x.bpointer,
-                               x.data['total']) for x in _sun_tree.all_nodes()],
-                             columns=['id', 'name', 'parent', 'value'])
-
-    figure = px.sunburst(sun_frame,
-                         ids='id',
-                         names='name',
-                         parents='parent',
-                         values='value',
-                         height=600,
-                         branchvalues='total')
-
-    figure.update_traces(
-        go.Sunburst({'marker': {'colorscale': 'Aggrnyl'}}),
-        insidetextorientation='horizontal',
-        maxdepth=3,
-        hovertemplate='%{label}<br>%{value}',
-        texttemplate='%{label}<br>%{value}',
-    )
 
-    figure.update_layout(
-        font=big_font,
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        margin=dict(
-            t=10,
-            l=5,  # NOQA
-            r=5,
-            b=5)
-    )
-    return figure
+    # sunburst is very very finicky and wants the subtotals to be exactly
+    # correct and never missing, so sunburst_frame builds them from the
+    # rounded totals of each account, rather than rounding the subtotals.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.float64(ts_months) / duration_m  # infinite for a single day, so everything counts as zero
+    sun_frame = sunburst_frame(account_totals, scale, SUBTOTAL_SUFFIX or '',
+                               max_slices, level, depth)
+
+    trace = sunburst_trace_template(ids=sun_frame['id'].to_numpy(),
+                                    labels=sun_frame['name'].to_numpy(),
+                                    parents=sun_frame['parent'].to_numpy(),
+                                    values=sun_frame['value'].to_numpy(),
+                                    customdata=sun_frame['folded'].tolist(),
+                                    maxdepth=depth)
+    if level is not None and level in set(sun_frame['id']):
+        trace['level'] = level
+    if 'variance' in sun_frame:
+        trace['hovertext'] = sampling_margins(sun_frame['value'], sun_frame['variance'])
+        trace['hovertemplate'] += '<br>%{hovertext}'
+    return figures.figure([trace], sunburst_template())
+
+
+def make_sankey(flows: pd.DataFrame, account_tree: Tree, date_start, date_end) -> dict:
+    """
+    Sankey diagram of flows between accounts, as from FlowMatrix.flows.
+    Accounts are grouped into their ancestors FLOW_DEPTH levels down the
+    tree, flows in both directions between two groups are netted, and only
+    the largest MAX_FLOW_LINKS flows are shown.
+    """
+    group: dict = {}
+    for node in account_tree.all_nodes():
+        ancestor = node
+        while account_tree.depth(ancestor) > FLOW_DEPTH:
+            ancestor = account_tree.parent(ancestor.identifier)
+        group[node.identifier] = ancestor.tag
+
+    source = flows['source'].map(group)
+    target = flows['target'].map(group)
+    forward = source < target
+    net = pd.DataFrame({'a': np.where(forward, source, target),
+                        'b': np.where(forward, target, source),
+                        'amount': np.where(forward, flows['amount'], -flows['amount'])})
+    net = net[net['a'] != net['b']].groupby(['a', 'b'], sort=False)['amount'].sum().reset_index()
+    net = net.assign(size=net['amount'].abs().round()).nlargest(MAX_FLOW_LINKS, 'size')
+    net = net[net['size'] > 0]
+    links = pd.DataFrame({'source': np.where(net['amount'] > 0, net['a'], net['b']),
+                          'target': np.where(net['amount'] > 0, net['b'], net['a']),
+                          'value': net['size'].to_numpy()})
+    labels = list(pd.unique(np.concatenate([links['source'].to_numpy(), links['target'].to_numpy()])))
+    index = {label: i for i, label in enumerate(labels)}
+
+    sankey = dict(
+        type='sankey',
+        valueformat=',.0f',
+        node=dict(label=labels, pad=12, thickness=14),
+        link=dict(source=links['source'].map(index).tolist(),
+                  target=links['target'].map(index).tolist(),
+                  value=links['value'].tolist()))
+    return figures.figure([sankey], chart_template(
+        title={'text': f'Money flows {pretty_date(date_start)} to {pretty_date(date_end)}'},
+        margin={'t': 40},
+        height=450))
 
 
 def positize(trans):
@@ -614,6 +697,24 @@ def positize(trans):
     return trans
 
 
+def table_records(trans: pd.DataFrame) -> list:
+    """ DataTable records, with dates as epoch milliseconds.  The browser formats them
+    (see format_table_dates in assets/clientside.js). """
+    epoch_ms = trans['date'].to_numpy(dtype='datetime64[ms]').astype('int64')
+    return trans.assign(date=epoch_ms).to_dict('records')
+
+
+def export_links(ledger_id: str, parameters: list) -> list:
+    """ Links to export, for the selection in parameters, as (name, value) pairs, in each available format """
+    query = urllib.parse.urlencode(parameters)
+    formats = [x for x in EXPORT_FORMATS if x != 'parquet' or importlib.util.find_spec('pyarrow') is not None]
+    return [html.A(children=f'Download {x.upper()}',
+                   href=f'/api/ledgers/{ledger_id}/export.{x}?{query}',
+                   download=f'transactions.{x}',
+                   className='export_link')
+            for x in formats]
+
+
 def pretty_date(date: np.datetime64) -> str:
     # convert Numpy datetime64 to 'YYYY-MMM-DD'
     return pd.to_datetime(str(date)).strftime("%Y-%m-%d")
@@ -629,7 +730,20 @@ def get_children(account_id, account_tree):
 def load_eras(source, earliest_date, latest_date):
     """
     If era data file is available, use it to construct
-    arbitrary bins
+    arbitrary bins.
+
+    Eras are returned sorted by start date, so an era's position in
+    the frame is its era index (see assign_eras).  Gaps are made
+    explicit rather than guessed at:
+
+    * a missing start on the first era becomes earliest_date, and a
+      missing end on the last era becomes latest_date;
+    * any other missing end runs up to the day before the next era;
+    * where eras overlap, the later-starting era wins, so the earlier
+      era's end is clipped to the day before the next start.
+
+    Transactions between the end of one era and the start of the next
+    belong to no era.
     """
 
     try:
@@ -637,24 +751,125 @@ def load_eras(source, earliest_date, latest_date):
     except urllib.error.HTTPError:
         return pd.DataFrame()
 
-    data = data.astype({'date_start': 'datetime64'})
-    data = data.astype({'date_end': 'datetime64'})
+    data = data.astype({'date_start': 'datetime64[ns]'})
+    data = data.astype({'date_end': 'datetime64[ns]'})
 
-    data = data.sort_values(by=['date_start'], ascending=False)
-    data = data.reset_index(drop=True).set_index('name')
+    if len(data) == 0:
+        return data
 
-    if pd.isnull(data.iloc[0].date_end):
-        data.iloc[0].date_end = latest_date
-    if pd.isnull(data.iloc[-1].date_start):
-        data.iloc[-1].date_start = earliest_date
+    data['date_start'] = data['date_start'].fillna(pd.Timestamp(earliest_date))
+    data = data.sort_values(by=['date_start'], kind='stable').reset_index(drop=True)
+
+    day_before_next = data['date_start'].shift(-1) - pd.Timedelta(days=1)
+    day_before_next.iloc[-1] = pd.Timestamp(latest_date)
+    open_end = data['date_end'].isnull()
+    data.loc[open_end, 'date_end'] = day_before_next[open_end]
+    overlap = data['date_end'] > day_before_next
+    overlap.iloc[-1] = False
+    data.loc[overlap, 'date_end'] = day_before_next[overlap]
+
+    data = data.set_index('name')
 
     return data
 
 
-def load_transactions(source):
+def era_bounds(eras: pd.DataFrame) -> tuple:
+    """ Return the era start and end dates as datetime64 arrays, in era index order. """
+    if len(eras) == 0:
+        empty = np.array([], dtype='datetime64[ns]')
+        return empty, empty
+    starts = eras['date_start'].to_numpy(dtype='datetime64[ns]')
+    ends = eras['date_end'].to_numpy(dtype='datetime64[ns]')
+    return starts, ends
+
+
+def assign_eras(dates: np.ndarray, eras: pd.DataFrame) -> np.ndarray:
+    """
+    Return the era index of each date, or NO_ERA for dates outside
+    every era.  Eras must be sorted by start date and non-overlapping,
+    as returned by load_eras, so each date is one binary search over
+    the era starts.
+    """
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+    if len(eras) == 0:
+        return np.full(len(dates), NO_ERA, dtype='int64')
+    starts, ends = era_bounds(eras)
+    index = np.searchsorted(starts, dates, side='right') - 1
+    found = index >= 0
+    found[found] = dates[found] <= ends[index[found]]
+    return np.where(found, index, NO_ERA).astype('int64')
+
+
+def era_at(eras: pd.DataFrame, date) -> int:
+    """ Return the era index containing date, or NO_ERA. """
+    return int(assign_eras(np.array([np.datetime64(pd.Timestamp(date), 'ns')]), eras)[0])
+
+
+def transaction_sources(sources: Union[str, Iterable[str]], files: bool = True, root: str = None) -> List[str]:
+    """
+    Expand sources, a list or a comma- or newline-separated string of URLs
+    and file paths, into a list of sources.  File paths may be glob
+    patterns, e.g., exports/*.csv, which expand in sorted order.
+
+    Sources from the browser must not reach the server's files freely:
+    without files, file paths are refused (PermissionError), and with
+    root, they are relative to root, and every path, and every glob
+    match, must be within it, after following symbolic links.
+    """
+    if isinstance(sources, str):
+        sources = re.split(r'[,\n]', sources)
+    result: List[str] = []
+    for source in (x.strip() for x in sources):
+        if not source:
+            continue
+        scheme = urllib.parse.urlparse(source).scheme
+        if scheme not in ('', 'file'):
+            result.append(source)
+            continue
+        if not files:
+            raise PermissionError(f'{source}: only URLs can be loaded here')
+        if root is not None:
+            path = os.path.join(root, urllib.parse.urlparse(source).path if scheme else source)
+            matches = sorted(glob.glob(path)) if glob.has_magic(path) else [path]
+            outside = [x for x in matches if not _within(x, root)]
+            if outside:
+                raise PermissionError(f'{source}: {outside[0]} is outside {root}')
+        elif not glob.has_magic(source):
+            result.append(source)
+            continue
+        else:
+            matches = sorted(glob.glob(os.path.expanduser(source)))
+        if not matches:
+            raise FileNotFoundError(f'No files match {source}')
+        result.extend(matches)
+    return result
+
+
+def data_file(source: str, root: str) -> str:
+    """
+    The absolute path of the one file source names, relative to root and
+    within it as in transaction_sources.  Raise PermissionError without
+    root, or unless source names exactly one local file.
+    """
+    if root is None:
+        raise PermissionError(f'{source}: files on the server can be loaded only from LEDGER_EXPLORER_DATA_DIR')
+    paths = transaction_sources([source], root=root)
+    if len(paths) != 1 or urllib.parse.urlparse(source).scheme not in ('', 'file'):
+        raise PermissionError(f'{source}: not one file within {root}')
+    return os.path.abspath(paths[0])
+
+
+def _within(path: str, root: str) -> bool:
+    root = os.path.realpath(root)
+    return os.path.commonpath([os.path.realpath(path), root]) == root
+
+
+def read_transactions(source) -> pd.DataFrame:
     """
     Load a csv matching the transaction export format from Gnucash.
-    Uses columns 'Account Name', 'Description', 'Memo', Notes', 'Full Account Name', 'Date', 'Amount Num.'
+    Uses columns 'Account Name', 'Description', 'Memo', Notes', 'Full Account Name', 'Date', 'Amount Num.',
+    and 'Transaction ID', which is returned, along with each split's position
+    in its transaction, as 'transaction id' and 'split'.
     """
 
     def convert(s):  # not fast
@@ -669,7 +884,12 @@ def load_transactions(source):
     data.columns = [x.lower() for x in data.columns]
     data['date'] = data['date'].astype({'date': 'datetime64'})
 
-    # Gnucash doesn't include the date, description, or notes for transaction splits.  Fill them in.
+    # Only the first split of each transaction has its date, id, description, and notes.
+    # Exports without ids get one per transaction, unique to this source.
+    if 'transaction id' not in data.columns:
+        data['transaction id'] = f'{source}:' + data['date'].notna().cumsum().astype(str)
+    data['transaction id'] = data['transaction id'].fillna(method='ffill').astype(str)
+    data['split'] = data.groupby('transaction id', sort=False).cumcount()
     data['date'] = data['date'].fillna(method='ffill')
 
     data['description'] = data['description'].fillna(method='ffill')
@@ -689,10 +909,68 @@ def load_transactions(source):
     data['notes'] = data['notes'].astype(str)
 
     data['description'] = (data['description'] + ' ' + data['memo'] + ' ' + data['notes']).str.strip()
-    trans = data[['date', 'description', 'amount', 'account', 'full account name']]
+    trans = data[['date', 'description', 'amount', 'account', 'full account name', 'transaction id', 'split']]
     return trans
 
 
+def merge_transactions(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Combine transactions read from several exports, which may overlap.  A
+    split is the same split if it has the same transaction id and position
+    in the transaction, so each one is kept only once, from the first
+    export containing it.  Returns the splits in date order, keeping
+    transactions together, with the id and position columns replaced by
+    'transaction', numbering the transactions from 0.
+    """
+    frames = [x for x in frames if len(x) > 0]
+    if not frames:
+        return pd.DataFrame(columns=['date', 'description', 'amount', 'account', 'full account name', 'transaction'])
+    data = pd.concat(frames, ignore_index=True)
+    data = data[~data.duplicated(['transaction id', 'split'])]
+    if len(frames) > 1:
+        data = data.sort_values('date', kind='mergesort')
+    data = data.assign(transaction=pd.factorize(data['transaction id'])[0])
+    return data.drop(columns=['transaction id', 'split']).reset_index(drop=True)
+
+
+def load_transactions(sources: Union[str, Iterable[str]]) -> pd.DataFrame:
+    """
+    Load and combine one or more Gnucash transaction exports (see
+    transaction_sources and merge_transactions).  Several sources are
+    parsed in parallel worker processes.
+    """
+    return merge_transactions(process_map(read_transactions, transaction_sources(sources)))
+
+
+def flip_signs(trans: pd.DataFrame, account_tree: Tree) -> pd.DataFrame:
+    """ Reverse the sign of amounts in the descendents of ROOT_ACCOUNTS marked
+    flip_negative, e.g., Income, so they chart as positive numbers """
+    for account in [ra for ra in ROOT_ACCOUNTS if ra['flip_negative'] is True]:
+        trans['amount'] = np.where(trans['account'].isin(get_descendents(account['id'], account_tree)),
+                                   trans['amount'] * -1,
+                                   trans['amount'])
+    return trans
+
+
+def flip_signs_by_name(trans: pd.DataFrame) -> pd.DataFrame:
+    """ As flip_signs, but by the top-level account in each full account
+    name, so the result doesn't depend on which accounts trans has, e.g.,
+    when importing one export at a time """
+    flipped = '|'.join(re.escape(ra['id']) for ra in ROOT_ACCOUNTS if ra['flip_negative'] is True)
+    trans['amount'] = np.where(trans['full account name'].str.match(f'(?:{flipped}):'),
+                               trans['amount'] * -1,
+                               trans['amount'])
+    return trans
+
+
+def flipped_accounts(account_tree: Tree) -> list:
+    """ The accounts whose amounts flip_signs reverses """
+    result: list = []
+    for account in [ra for ra in ROOT_ACCOUNTS if ra['flip_negative'] is True]:
+        result = result + get_descendents(account['id'], account_tree)
+    return result
+
+
 def make_account_tree_from_trans(trans):
     """ extract all accounts from a list of Gnucash account paths
 
@@ -728,6 +1006,59 @@ def make_account_tree_from_trans(trans):
     return tree
 
 
+def add_accounts(account_tree: Tree, full_account_names: Iterable[str]) -> Tree:
+    """
+    A copy of account_tree, from make_account_tree_from_trans, with the
+    accounts it lacks among full_account_names, and their parents, added
+    as make_account_tree_from_trans would add them, so without going over
+    the accounts it already has.  Returns None if an account isn't under
+    the tree's root, because trim_excess_root removed the account's
+    branch; then only a new tree will do.
+    """
+    tree = Tree(account_tree, deep=True)
+    root = tree.root
+    for account in full_account_names:
+        branches = account.split(':')
+        if root != ROOT_ID:
+            if root not in branches:
+                return None
+            branches = branches[branches.index(root):]
+        for i, branch in enumerate(branches):
+            if not tree.get_node(branch):
+                tree.create_node(tag=branch,
+                                 identifier=branch,
+                                 parent=branches[i-1] if i > 0 else ROOT_ID)
+    return tree
+
+
+def account_parents(full_account_names: Iterable[str]) -> tuple:
+    """
+    The same accounts as in make_account_tree_from_trans, as (ids,
+    parents): lists, breadth first, of each account and the account it
+    belongs to, None for the root.  Much faster than building the Tree,
+    for code that needs only the shape.
+    """
+    parent_of: dict = {ROOT_ID: None}
+    children: dict = {ROOT_ID: []}
+    for account in full_account_names:
+        parent = ROOT_ID
+        for branch in account.split(':'):
+            if branch not in parent_of:
+                parent_of[branch] = parent
+                children[parent].append(branch)
+                children[branch] = []
+            parent = branch
+    # as in trim_excess_root
+    root = ROOT_ID
+    while len(children[root]) == 1:
+        root = children[root][0]
+    parent_of[root] = None
+    ids: list = [root]
+    for account in ids:
+        ids.extend(children[account])
+    return ids, [parent_of[x] for x in ids]
+
+
 def trim_excess_root(tree: Tree) -> Tree:
     # Remove any nodes from the root that have only 1 child.
     # I.e, replace A → B → (C, D) with B → (C, D)
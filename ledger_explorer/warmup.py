@@ -0,0 +1,98 @@
+"""
+Precompute the standard views of a newly loaded ledger in the background,
+so the first visit to each tab finds its figures already in the
+ledger's result cache (Ledger.cached).
+
+Tabs register the views worth warming with @standard_views.  Loading a
+new dataset cancels any warm-up still running for the previous one.  Set
+LEDGER_EXPLORER_WARM_UP=0 to turn warm-up off.
+"""
+import logging
+import os
+import threading
+import time
+from typing import Callable, List
+
+from ledger import Ledger
+from parallel import THREAD_NAME_PREFIX
+
+
+WARM_UP: bool = os.environ.get('LEDGER_EXPLORER_WARM_UP', '1') not in ('', '0')
+WARM_UP_NICENESS: int = 10
+
+_view_sources: List[Callable] = []
+_current: 'WarmUp' = None
+_current_lock = threading.Lock()
+
+
+def standard_views(function: Callable) -> Callable:
+    """
+    Decorator registering function(ledger) -> list of callables, each of
+    which computes one view through ledger.cached.  Views are warmed in
+    registration order, and in list order within a function, so put the
+    views shown by default first.
+    """
+    _view_sources.append(function)
+    return function
+
+
+class WarmUp(threading.Thread):
+    """ Background thread computing each standard view of one ledger in turn. """
+
+    def __init__(self, ledger: Ledger):
+        # The worker name prefix makes parallel_map run serially in this
+        # thread, so warm-up doesn't take pool threads from interactive requests.
+        super().__init__(name=f'{THREAD_NAME_PREFIX}-warm-up-{ledger.id[:8]}', daemon=True)
+        self.ledger: Ledger = ledger
+        self.cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+
+    def run(self) -> None:
+        try:
+            # lower this thread's priority only; Linux schedules threads individually
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WARM_UP_NICENESS)
+        except (AttributeError, OSError):
+            pass
+        start = time.perf_counter()
+        # the ledger's indexes first, so the views' scoped backends carry them over
+        views = [self.ledger.prepare] + [view for source in _view_sources for view in source(self.ledger)]
+        for view in views:
+            if self.cancelled.is_set():
+                logging.info(f'Warm-up of {self.ledger.id[:8]} cancelled; {report(self.ledger)}')
+                return
+            try:
+                view()
+            except Exception:
+                logging.exception(f'Warm-up of {self.ledger.id[:8]} failed on a view')
+        logging.info(f'Warm-up of {self.ledger.id[:8]} done in {time.perf_counter() - start:,.1f} s; '
+                     f'{report(self.ledger)}')
+
+
+def start(ledger: Ledger) -> WarmUp:
+    """ Cancel any warm-up in progress and start warming ledger, unless warm-up is turned off. """
+    global _current
+    with _current_lock:
+        if _current is not None:
+            _current.cancel()
+            _current = None
+        if not WARM_UP:
+            return None
+        _current = WarmUp(ledger)
+        _current.start()
+        return _current
+
+
+def cancel() -> None:
+    global _current
+    with _current_lock:
+        if _current is not None:
+            _current.cancel()
+            _current = None
+
+
+def report(ledger: Ledger) -> str:
+    """ Which views of ledger are warm, e.g., for logging """
+    views = ledger.warm_views()
+    return f'{len(views)} warm views: ' + ', '.join(' '.join(str(x) for x in key) for key in views)
@@ -0,0 +1,9 @@
+import os
+import sys
+
+
+# The app runs from inside ledger_explorer/, and its modules import each other
+# by flat name (`from utils import ...`), so tests need the same path, and
+# import them the same way; importing ledger_explorer.utils as well would
+# load a second copy of each module, with its own registries.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ledger_explorer'))
@@ -0,0 +1,32 @@
+import pandas as pd
+
+import account_index
+import utils
+
+
+totals = pd.DataFrame({
+    'full account name': ['Expenses:Food:Groceries', 'Expenses:Food:Restaurants', 'Expenses:Rent',
+                          'Income:Salary', 'Income:Interest'],
+    'account': ['Groceries', 'Restaurants', 'Rent', 'Salary', 'Interest'],
+    'amount': [300, 100, 1000, 2000, 5]})
+
+
+class TestAccountIndex:
+    index = account_index.AccountIndex(utils.make_account_tree_from_trans(totals), totals)
+
+    def paths(self, query, limit=account_index.MAX_MATCHES):
+        return [x.path for x in self.index.find(query, limit)]
+
+    def test_ranked_by_subtotal(self):
+        assert self.paths('', 3) == ['Income', 'Income:Salary', 'Expenses']
+        assert self.index.find('food')[0].subtotal == 400
+
+    def test_prefix_at_any_level(self):
+        assert self.paths('expenses:fo') == ['Expenses:Food', 'Expenses:Food:Groceries',
+                                             'Expenses:Food:Restaurants']
+        assert self.paths('RE') == ['Expenses:Rent', 'Expenses:Food:Restaurants']
+
+    def test_substring(self):
+        assert self.paths('cer') == ['Expenses:Food:Groceries']
+        assert self.paths('sal inc') == ['Income:Salary']
+        assert self.paths('nothing') == []
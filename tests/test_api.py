@@ -0,0 +1,90 @@
+import io
+
+import flask
+import pandas as pd
+
+# the app's own module names, so the test and the API share one ledger registry
+import api as api_module
+from api import api
+from ledger import Ledger, register_ledger
+
+
+trans = pd.DataFrame({
+    'date': pd.to_datetime(['2020-01-05', '2020-01-20', '2020-02-10', '2020-04-01', '2020-04-02']),
+    'description': ['a', 'b', 'c', 'd', 'e'],
+    'amount': [100, 50, 25, 10, 1000],
+    'account': ['Food', 'Rent', 'Food', 'Food', 'Salary'],
+    'full account name': ['Expenses:Food', 'Expenses:Rent', 'Expenses:Food', 'Expenses:Food', 'Income:Salary']})
+eras = pd.DataFrame(columns=['date_start', 'date_end'])
+ledger = register_ledger(Ledger(trans, eras, 'test-api-ledger'))
+
+server = flask.Flask(__name__)
+server.register_blueprint(api)
+client = server.test_client()
+
+
+class TestApi:
+
+    def test_totals(self):
+        response = client.get('/api/ledgers/test-api-ledger/totals?account=Expenses&resolution=Quarter')
+        assert response.get_json() == {'period_end': ['2020-03-31', '2020-06-30'], 'total': [175, 10]}
+
+    def test_totals_shallow(self):
+        response = client.get('/api/ledgers/test-api-ledger/totals?account=Expenses&resolution=Quarter&deep=0')
+        assert response.get_json()['total'] == []
+
+    def test_balances(self):
+        response = client.get('/api/ledgers/test-api-ledger/balances?account=Food&resolution=Month')
+        assert response.get_json()['balance'] == [100, 125, 125, 135]
+
+    def test_balance_as_of(self):
+        response = client.get('/api/ledgers/test-api-ledger/balances?account=Expenses&as_of=2020-03-01')
+        assert response.get_json() == {'as_of': ['2020-03-01'], 'balance': [175]}
+
+    def test_subtotals(self):
+        response = client.get('/api/ledgers/test-api-ledger/subtotals?account=Expenses&end=2020-01-31')
+        result = response.get_json()
+        subtotal = dict(zip(result['account'], result['subtotal']))
+        assert subtotal == {'Expenses': 150, 'Food': 100, 'Rent': 50}
+
+    def test_etag(self):
+        url = '/api/ledgers/test-api-ledger/totals?account=Income&resolution=Year'
+        etag = client.get(url).headers['ETag']
+        assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+        assert client.get(url, headers={'If-None-Match': f'W/{etag}'}).status_code == 304
+        assert client.get(url + '&deep=0', headers={'If-None-Match': etag}).status_code == 200
+
+    def test_results_bounded(self, monkeypatch):
+        monkeypatch.setattr(api_module, 'API_RESULTS', 3)
+        for day in range(1, 8):
+            client.get(f'/api/ledgers/test-api-ledger/subtotals?end=2020-01-{day:02d}')
+        kept = [key for key in ledger.results() if key[0] == 'api']
+        assert len(kept) == 3
+        assert ('api', '/api/ledgers/test-api-ledger/subtotals', (('end', '2020-01-07'),)) in kept
+
+    def test_errors(self):
+        assert client.get('/api/ledgers/missing/totals?account=Food').status_code == 404
+        assert client.get('/api/ledgers/test-api-ledger/totals?account=Missing').status_code == 400
+        assert client.get('/api/ledgers/test-api-ledger/balances?account=Food&resolution=Era').status_code == 400
+
+    def test_export_csv(self, monkeypatch):
+        monkeypatch.setattr(api_module, 'CHUNK_ROWS', 2)
+        response = client.get('/api/ledgers/test-api-ledger/export.csv?account=Expenses&end=2020-03-31')
+        assert response.is_streamed
+        assert response.headers['Content-Disposition'] == 'attachment; filename="transactions.csv"'
+        export = pd.read_csv(io.BytesIO(response.get_data()))
+        assert list(export.columns) == ['date', 'description', 'amount', 'account', 'full account name']
+        assert list(export['description']) == ['a', 'b', 'c']
+
+    def test_export_running_total(self, monkeypatch):
+        monkeypatch.setattr(api_module, 'CHUNK_ROWS', 2)
+        response = client.get('/api/ledgers/test-api-ledger/export.csv?through=2020-04-01:Food&through=2020-01-31:Rent')
+        export = pd.read_csv(io.BytesIO(response.get_data()))
+        assert list(export['description']) == ['a', 'b', 'c', 'd']
+        assert list(export['total']) == [100, 150, 175, 185]
+
+    def test_export_errors(self):
+        assert client.get('/api/ledgers/test-api-ledger/export.xls').status_code == 404
+        assert client.get('/api/ledgers/test-api-ledger/export.csv?account=Nope').status_code == 400
+        response = client.get('/api/ledgers/test-api-ledger/export.csv?account=Food&start=2021-01-01')
+        assert response.get_data(as_text=True).strip() == 'date,description,amount,account,full account name'
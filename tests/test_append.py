@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils
+from ledger import Ledger, dataset_id
+
+NAMES = ['Assets:Cash', 'Assets:Bank:Checking', 'Expenses:Food', 'Expenses:Food:Dining', 'Income:Salary']
+eras = pd.DataFrame({'date_start': pd.to_datetime(['2019-01-01', '2020-01-01']),
+                     'date_end': pd.to_datetime(['2019-12-31', '2020-12-31'])},
+                    index=pd.Index(['first', 'second'], name='name'))
+
+
+def make_splits(n: int, names: list, start: str, days: int, seed: int) -> pd.DataFrame:
+    """ Splits as loaded, before flip_signs, numbered as merge_transactions numbers them """
+    rng = np.random.default_rng(seed)
+    full_names = np.array(names)[rng.integers(0, len(names), n)]
+    dates = np.sort(np.datetime64(start) + rng.integers(0, days, n).astype('timedelta64[D]'))
+    return pd.DataFrame({
+        'date': dates.astype('datetime64[ns]'),
+        'description': 'x',
+        'amount': rng.integers(-500, 500, n),
+        'account': [x.rsplit(':', 1)[1] for x in full_names],
+        'full account name': full_names,
+        'transaction': np.arange(n) // 2})
+
+
+def load(raw: pd.DataFrame) -> Ledger:
+    """ As the Data Source tab loads transactions """
+    trans = utils.flip_signs(raw.copy(), utils.make_account_tree_from_trans(raw))
+    trans['era'] = utils.assign_eras(trans['date'].to_numpy(), eras)
+    return Ledger(trans, eras, 'test-append')
+
+
+def build_everything(ledger: Ledger) -> None:
+    ledger.backend.running
+    ledger.backend.monthly
+    ledger.account_summary()
+    for key in [(), ('Expenses',)]:
+        ledger.view(key)[0].period_totals(None, 4)
+        ledger.view(key)[0].running
+
+
+def assert_same(appended: Ledger, rebuilt: Ledger) -> None:
+    """ Everything append() updates, as a full rebuild computes it """
+    def shape(tree):
+        return tree.root, {x: tree.parent(x).identifier for x in tree.nodes if x != tree.root}
+    assert shape(appended.account_tree) == shape(rebuilt.account_tree)
+    pd.testing.assert_frame_equal(appended.backend.trans, rebuilt.backend.trans)
+    # the id a fresh load of the same data gets
+    assert appended.id == dataset_id(rebuilt.backend.trans.to_json(orient='split', date_format='%Y%m%d'),
+                                     eras.to_json(orient='split', date_format='%Y%m%d'))
+    pd.testing.assert_frame_equal(appended.account_summary(), rebuilt.account_summary())
+    for key in [(), ('Expenses',), ('Assets',)]:
+        source, view_eras, view_tree, earliest, latest = appended.view(key)
+        expected, *_, expected_tree, expected_earliest, expected_latest = rebuilt.view(key)
+        assert shape(view_tree) == shape(expected_tree)
+        assert (earliest, latest) == (expected_earliest, expected_latest)
+        fresh = type(source)(source.trans)  # with no indexes carried over
+        assert source.positions.keys() == fresh.positions.keys()
+        for account in fresh.positions:
+            assert (source.positions[account] == fresh.positions[account]).all()
+            for actual, full in zip(source.running[account], fresh.running[account]):
+                assert (actual == full).all()
+            for actual, full in zip(source.monthly[account], fresh.monthly[account]):
+                assert (actual == full).all()
+        for resolution in [2, 3, 4]:
+            for accounts in [None, ['Food', 'Dining'], ['Salary']]:
+                pd.testing.assert_series_equal(
+                    source.period_totals(accounts, resolution),
+                    utils.period_totals(fresh._frame(accounts), resolution))
+        pd.testing.assert_frame_equal(source.era_totals(None, eras), expected.era_totals(None, eras))
+
+
+class TestAppend:
+
+    @pytest.mark.parametrize('start,names', [
+        ('2020-06-01', NAMES),  # after every transaction so far
+        ('2019-03-01', NAMES),  # back-dated
+        ('2020-06-01', NAMES + ['Income:Interest', 'Expenses:Rent:Deposit'])])  # new accounts
+    def test_same_as_rebuild(self, start, names):
+        raw = make_splits(2000, NAMES, '2019-01-01', 500, 0)
+        batch = make_splits(100, names, start, 200, 1)
+        ledger = load(raw)
+        build_everything(ledger)
+
+        appended = ledger.append(batch)
+        rebuilt = load(pd.concat([raw, batch.assign(transaction=batch['transaction'] + 1000)], ignore_index=True))
+        assert_same(appended, rebuilt)
+        assert appended.id != ledger.id
+        assert len(ledger.backend.trans) == 2000
+
+    def test_new_branch_of_trimmed_tree(self):
+        raw = make_splits(200, ['Expenses:Food', 'Expenses:Rent'], '2019-01-01', 300, 0)
+        batch = make_splits(20, ['Income:Salary'], '2020-01-01', 30, 1)
+        ledger = load(raw)
+        assert ledger.account_tree.root == 'Expenses'
+        build_everything(ledger)
+
+        appended = ledger.append(batch)
+        rebuilt = load(pd.concat([raw, batch.assign(transaction=batch['transaction'] + 100)], ignore_index=True))
+        assert appended.account_tree.root == utils.ROOT_ID
+        assert_same(appended, rebuilt)
+        assert (appended.backend.trans['amount'].to_numpy()[-20:] == -batch['amount'].to_numpy()).all()
@@ -0,0 +1,98 @@
+import pandas as pd
+import pytest
+
+from backend import ROW_COLUMNS, MemoryBackend, SQLiteBackend, import_sqlite
+import utils
+
+
+HEADER = 'Date,Transaction ID,Description,Notes,Memo,Full Account Name,Account Name,Amount Num.\n'
+JAN = ('01/05/2020,t1,Groceries,,,Expenses:Food,Food,25.00\n'
+       ',,,,,Assets:Cash,Cash,-25.00\n'
+       '01/20/2020,t2,Paycheck,,,Assets:Cash,Cash,"2,000.00"\n'
+       ',,,,,Income:Salary,Salary,"-2,000.00"\n')
+FEB = ('02/01/2020,t3,Rent 100%,,,Expenses:Rent,Rent,"1,000.00"\n'
+       ',,,,,Assets:Cash,Cash,"-1,000.00"\n')
+
+
+@pytest.fixture
+def backends(tmp_path):
+    (tmp_path / 'jan.csv').write_text(HEADER + JAN)
+    (tmp_path / 'both.csv').write_text(HEADER + JAN + FEB)
+    trans = utils.merge_transactions([utils.read_transactions(str(tmp_path / 'both.csv'))])
+    memory = MemoryBackend(utils.flip_signs(trans, utils.make_account_tree_from_trans(trans)))
+    path = str(tmp_path / 'ledger.sqlite')
+    assert import_sqlite(path, [str(tmp_path / 'jan.csv')]) == 4
+    assert import_sqlite(path, [str(tmp_path / 'both.csv')]) == 2  # January is already there
+    return memory, SQLiteBackend(path)
+
+
+def test_import_flips_each_file_alike(tmp_path):
+    # a file with one top-level account has a tree without it, after trim_excess_root
+    (tmp_path / 'salary.csv').write_text(HEADER + '01/20/2020,t2,Paycheck,,,Income:Salary,Salary,"-2,000.00"\n')
+    path = str(tmp_path / 'ledger.sqlite')
+    import_sqlite(path, [str(tmp_path / 'salary.csv')])
+    assert list(SQLiteBackend(path).rows()['amount']) == [2000]
+
+
+class TestBackendParity:
+    def test_rows(self, backends):
+        memory, sqlite = backends
+        pd.testing.assert_frame_equal(memory.rows()[ROW_COLUMNS].reset_index(drop=True), sqlite.rows())
+        pd.testing.assert_frame_equal(memory.rows(offset=4)[ROW_COLUMNS].reset_index(drop=True), sqlite.rows(offset=4))
+        assert list(sqlite.rows(['Cash'], date_end='2020-01-31')['amount']) == [-25, 2000]
+
+    def test_aggregates(self, backends):
+        memory, sqlite = backends
+        assert sqlite.count() == memory.count() == 6
+        assert sqlite.count(['Cash'], '2020-01-06') == memory.count(['Cash'], '2020-01-06') == 2
+        assert sqlite.date_range(['Rent']) == memory.date_range(['Rent'])
+        assert list(sqlite.accounts()['account']) == list(memory.accounts()['account'])
+        totals = sqlite.account_totals(date_end='2020-01-31')
+        assert dict(zip(totals['account'], totals['amount'])) == {'Food': -25, 'Cash': 1975, 'Salary': 2000}
+        assert list(sqlite.account_totals()['count']) == list(memory.account_totals()['count']) == [1, 3, 1, 1]
+        assert list(sqlite.balances(['Cash'], 3)) == list(memory.balances(['Cash'], 3))
+        assert list(sqlite.period_totals(['Cash'], 3)) == list(memory.period_totals(['Cash'], 3))
+
+    def test_running_balances(self, backends):
+        memory, sqlite = backends
+        assert memory.balance(['Cash'], '2020-01-19') == sqlite.balance(['Cash'], '2020-01-19') == -25
+        assert memory.balance(['Cash', 'Food'], '2020-12-31') == sqlite.balance(['Cash', 'Food'], '2020-12-31') == 950
+        assert memory.balance(['Cash'], '2019-12-31') == 0
+        through = {'Rent': '2020-02-01', 'Cash': '2020-01-20'}
+        pd.testing.assert_frame_equal(memory.running_rows(through)[ROW_COLUMNS + ['total']].reset_index(drop=True),
+                                      sqlite.running_rows(through).reset_index(drop=True))
+        assert list(memory.running_rows(through)['total']) == [-25, 1975, 975]
+
+    def test_chunks(self, backends):
+        memory, sqlite = backends
+        for kwargs in [{}, {'accounts': ['Cash'], 'date_start': '2020-01-06'}, {'query': 'rent'}]:
+            memory_chunks = list(memory.chunks(size=4, **kwargs))
+            sqlite_chunks = list(sqlite.chunks(size=4, **kwargs))
+            assert [len(x) for x in memory_chunks] == [len(x) for x in sqlite_chunks]
+            pd.testing.assert_frame_equal(pd.concat(memory_chunks, ignore_index=True),
+                                          pd.concat(sqlite_chunks, ignore_index=True))
+        through = {'Rent': '2020-02-01', 'Cash': '2020-01-20'}
+        for backend in backends:
+            chunks = list(backend.running_chunks(through, size=2))
+            assert [len(x) for x in chunks] == [2, 1]
+            pd.testing.assert_frame_equal(pd.concat(chunks)[ROW_COLUMNS + ['total']].reset_index(drop=True),
+                                          backend.running_rows(through)[ROW_COLUMNS + ['total']].reset_index(drop=True))
+
+    def test_daily_flows(self, backends):
+        memory, sqlite = backends
+        flipped = ['Food', 'Rent', 'Salary']
+        pd.testing.assert_frame_equal(memory.daily_flows(flipped), sqlite.daily_flows(flipped), check_dtype=False)
+        assert list(sqlite.daily_flows(flipped)['target']) == ['Food', 'Cash', 'Rent']
+
+    def test_search(self, backends):
+        memory, sqlite = backends
+        assert list(sqlite.search('100%')['description']) == ['Rent 100%', 'Rent 100%']
+        assert len(sqlite.search('10_')) == 0
+        assert len(sqlite.search('PAY', ['Cash'])) == len(memory.search('pay', ['Cash'])) == 1
+
+    def test_prepare_search(self, backends):
+        memory, sqlite = backends
+        sqlite.prepare_search()  # searches the database
+        assert memory._search_index is None
+        memory.prepare_search()
+        assert memory._search_index is not None
@@ -0,0 +1,41 @@
+from collections import OrderedDict
+import json
+
+import pandas as pd
+import pytest
+
+import ledger as ledger_module
+import utils
+from apps import cash_flow
+from ledger import Ledger, dataset_id, register_ledger
+
+
+trans = pd.DataFrame({
+    'date': pd.to_datetime(['2020-01-05'] * 13),
+    'description': 'x',
+    'amount': list(range(1, 11)) + [5, 100, 1000],
+    'account': [f'Shop {i}' for i in range(10)] + ['Food', 'Rent', 'Salary'],
+    'full account name': [f'Expenses:Food:Shop {i}' for i in range(10)] + ['Expenses:Food', 'Expenses:Rent',
+                                                                            'Income:Salary'],
+    'era': -1})
+eras = pd.DataFrame(columns=['date_start', 'date_end'])
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    monkeypatch.setattr(ledger_module, '_ledgers', OrderedDict())
+    return register_ledger(Ledger(trans, eras, dataset_id('test-cash-flow')))
+
+
+def test_click_other_selects_folded(ledger):
+    figure = utils.make_sunburst(ledger.view(cash_flow.ACCOUNTS)[0].account_totals(), pd.Timestamp('2020-01-01'),
+                                 pd.Timestamp('2020-12-31'), utils.SUBTOTAL_SUFFIX, max_slices=4, level='Food')
+    sunburst = figure['data'][0]
+    point = list(sunburst['ids']).index('Food' + utils.OTHER_SUFFIX)
+    click = {'points': [{'id': sunburst['ids'][point], 'customdata': sunburst['customdata'][point]}]}
+    records, account_text, table_text, links = cash_flow.apply_burst_click.__wrapped__(
+        click, {'start': '2020-01-01', 'end': '2020-12-31'}, json.dumps({'id': ledger.id}), None)
+    # the shops shown as their own slices, and Rent, aren't selected
+    assert sorted(x['account'] for x in records) == ['Food'] + [f'Shop {i}' for i in range(7)]
+    assert account_text == '8 accounts in Other Food selected'
+    assert 'deep=0' in links[0].href and 'Shop+9' not in links[0].href
@@ -0,0 +1,88 @@
+from concurrent.futures import TimeoutError
+import json
+import threading
+import time
+
+import pytest
+
+from coalesce import SingleFlight
+from ledger import dataset_id, store_id
+
+
+def _run_concurrently(function, count):
+    results = [None] * count
+    errors = [None] * count
+
+    def run(i):
+        try:
+            results[i] = function()
+        except BaseException as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+class TestSingleFlight:
+
+    def test_concurrent_calls_share_one_computation(self):
+        flight = SingleFlight()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'figure': 1}
+
+        results, errors = _run_concurrently(lambda: flight.do('key', compute, timeout=5), 5)
+        assert len(calls) == 1
+        assert errors == [None] * 5
+        assert all(result is results[0] for result in results)
+        assert flight.in_flight() == 0
+
+    def test_exception_propagates_to_waiters(self):
+        flight = SingleFlight()
+
+        def compute():
+            time.sleep(0.2)
+            raise ValueError('bad ledger')
+
+        results, errors = _run_concurrently(lambda: flight.do('key', compute, timeout=5), 3)
+        assert all(isinstance(e, ValueError) for e in errors)
+        assert flight.in_flight() == 0
+
+    def test_waiter_times_out(self):
+        flight = SingleFlight()
+        started = threading.Event()
+
+        def compute():
+            started.set()
+            time.sleep(0.5)
+            return 1
+
+        leader = threading.Thread(target=lambda: flight.do('key', compute))
+        leader.start()
+        started.wait()
+        with pytest.raises(TimeoutError):
+            flight.do('key', compute, timeout=0.05)
+        leader.join()
+
+    def test_different_keys_run_separately(self):
+        flight = SingleFlight()
+        assert flight.do('a', lambda: 1) == 1
+        assert flight.do('b', lambda: 2) == 2
+
+
+def test_store_id():
+    data = dict(trans='{"columns": []}', eras='{"columns": []}')
+    data['id'] = dataset_id(data['trans'], data['eras'])
+    assert store_id(json.dumps(data)) == data['id']
+    # any key order and separators
+    assert store_id(json.dumps({'id': data['id'], **data}, separators=(',', ':'))) == data['id']
+    assert store_id(json.dumps(dict(data, eras='{"id": "' + '0' * 40 + '"}'))) == data['id']
+    del data['id']
+    assert store_id(json.dumps(data)) == dataset_id(data['trans'], data['eras'])
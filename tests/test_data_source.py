@@ -0,0 +1,119 @@
+from collections import OrderedDict
+import json
+
+import pandas as pd
+import pytest
+from dash.exceptions import PreventUpdate
+
+import ledger as ledger_module
+import warmup
+from apps import data_source
+from backend import import_sqlite
+from ledger import Ledger, dataset_id, ledger_from_json_store, register_ledger
+
+
+trans = pd.DataFrame({
+    'date': pd.to_datetime(['2020-01-05', '2020-01-20', '2020-02-10', '2020-04-01', '2020-04-02']),
+    'description': ['a', 'b', 'c', 'd', 'e'],
+    'amount': [100, 50, 25, 10, 1000],
+    'account': ['Food', 'Rent', 'Dining', 'Fuel', 'Salary'],
+    'full account name': ['Expenses:Food', 'Expenses:Rent', 'Expenses:Food:Dining', 'Expenses:Fuel',
+                          'Income:Salary']})
+eras = pd.DataFrame(columns=['date_start', 'date_end'])
+
+
+@pytest.fixture
+def ledger(monkeypatch):
+    monkeypatch.setattr(ledger_module, '_ledgers', OrderedDict())
+    return register_ledger(Ledger(trans, eras, dataset_id('test-data-source')))
+
+
+def test_account_summary(ledger):
+    summary = ledger.account_summary()
+    assert summary.loc['Food'].to_dict() == {'total': 100, 'subtotal': 125, 'count': 1, 'subcount': 2}
+    assert summary.loc['Expenses', ['total', 'subtotal', 'count', 'subcount']].tolist() == [0, 185, 0, 4]
+    assert summary.loc[ledger.account_tree.root, 'subcount'] == 5
+    assert ledger.account_summary() is summary  # computed once
+
+
+class TestTreeNodes:
+
+    def test_subtree_totals(self, ledger):
+        records = data_source.tree_nodes(ledger, 'Expenses')
+        assert [(x['tag'], x['count'], x['total'], x['leaf']) for x in records] == \
+            [('Food', 2, 125, False), ('Fuel', 1, 10, True), ('Rent', 1, 50, True)]
+
+    def test_pages(self, ledger, monkeypatch):
+        monkeypatch.setattr(data_source, 'MAX_TREE_CHILDREN', 2)
+        first = data_source.tree_nodes(ledger, 'Expenses')
+        assert [x.get('tag') for x in first[:2]] == ['Food', 'Fuel']
+        assert first[2] == {'account': 'Expenses', 'page': 1, 'more': 1}
+        assert [x['tag'] for x in data_source.tree_nodes(ledger, 'Expenses', 1)] == ['Rent']
+
+    def test_more_row(self, ledger, monkeypatch):
+        monkeypatch.setattr(data_source, 'MAX_TREE_CHILDREN', 2)
+        rows = data_source.render_tree_nodes(data_source.tree_nodes(ledger, 'Expenses'))
+        more = rows[2].children[0]
+        assert more.id == {'type': 'tree_node', 'account': 'Expenses', 'page': 1}
+        assert more.children == '1 more account'
+
+
+class TestExpandTreeNode:
+    expand = staticmethod(data_source.expand_tree_node.__wrapped__)
+
+    def test_first_click_fetches(self, ledger):
+        data_store = json.dumps({'id': ledger.id})
+        rows = self.expand(1, {'type': 'tree_node', 'account': 'Expenses', 'page': 0}, data_store)
+        assert len(rows) == 3
+        assert rows[0].children[0].id == {'type': 'tree_node', 'account': 'Food', 'page': 0}  # collapsed
+
+    def test_later_clicks_and_no_data(self, ledger):
+        node_id = {'type': 'tree_node', 'account': 'Expenses', 'page': 0}
+        for n_clicks, data_store in [(2, json.dumps({'id': ledger.id})), (None, json.dumps({'id': ledger.id})),
+                                     (1, None)]:
+            with pytest.raises(PreventUpdate):
+                self.expand(n_clicks, node_id, data_store)
+
+
+def test_eras_only_from_data_dir(monkeypatch, tmp_path):
+    (tmp_path / 'eras.csv').write_text('date_start,date_end,name\n2020-01-01,2020-12-31,2020\n')
+    earliest, latest = trans['date'].min(), trans['date'].max()
+    monkeypatch.setattr(data_source, 'DATA_DIR', None)
+    assert data_source._load_eras(str(tmp_path / 'eras.csv'), earliest, latest).empty
+    monkeypatch.setattr(data_source, 'DATA_DIR', str(tmp_path))
+    assert len(data_source._load_eras('eras.csv', earliest, latest)) == 1
+
+
+class TestSQLite:
+
+    @pytest.fixture
+    def data_store(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(ledger_module, '_ledgers', OrderedDict())
+        monkeypatch.setattr(warmup, 'WARM_UP', False)
+        (tmp_path / 'jan.csv').write_text(
+            'Date,Transaction ID,Description,Notes,Memo,Full Account Name,Account Name,Amount Num.\n'
+            '01/05/2020,t1,Groceries,,,Expenses:Food,Food,25.00\n'
+            ',,,,,Assets:Cash,Cash,-25.00\n'
+            '01/20/2020,t2,Paycheck,,,Assets:Cash,Cash,"2,000.00"\n'
+            ',,,,,Income:Salary,Salary,"-2,000.00"\n')
+        import_sqlite(str(tmp_path / 'ledger.sqlite'), [str(tmp_path / 'jan.csv')])
+        for module in (data_source, ledger_module):
+            monkeypatch.setattr(module, 'DATA_DIR', str(tmp_path))
+        return data_source.load_data.__wrapped__(1, 'sqlite:///ledger.sqlite', '')[0]
+
+    def test_only_from_data_dir(self, data_store, monkeypatch):
+        assert json.loads(data_store)['id'] in [x.id for x in ledger_module.ledgers()]
+        assert data_source.load_data.__wrapped__(1, 'sqlite:///../ledger.sqlite', '')[0] is None
+        monkeypatch.setattr(data_source, 'DATA_DIR', None)
+        assert data_source.load_data.__wrapped__(1, 'sqlite:///ledger.sqlite', '')[0] is None
+
+    def test_forged_path(self, data_store, tmp_path, monkeypatch):
+        monkeypatch.setattr(ledger_module, '_ledgers', OrderedDict())  # as in another worker
+        assert ledger_from_json_store(data_store).backend.count() == 4
+        monkeypatch.setattr(ledger_module, '_ledgers', OrderedDict())
+        (tmp_path / 'other.sqlite').write_bytes((tmp_path / 'ledger.sqlite').read_bytes())
+        data = json.loads(data_store)
+        for path in [str(tmp_path / 'other.sqlite'), '/etc/passwd']:
+            with pytest.raises(PreventUpdate):
+                ledger_from_json_store(json.dumps(dict(data, sqlite=path, id=data['id'])))
+        assert ledger_module.ledgers() == []
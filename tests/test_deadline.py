@@ -0,0 +1,103 @@
+import threading
+import time
+
+import pandas as pd
+
+from deadline import Candidate, CostModel, within_budget
+from ledger import Ledger
+
+
+trans = pd.DataFrame({
+    'date': pd.to_datetime(['2020-01-05', '2020-02-10']),
+    'description': ['a', 'b'],
+    'amount': [100, 25],
+    'account': ['Food', 'Food'],
+    'full account name': ['Expenses:Food', 'Expenses:Food']})
+eras = pd.DataFrame(columns=['date_start', 'date_end'])
+
+
+class TestCostModel:
+    def test_estimate(self):
+        costs = CostModel(default_rate=1e-3)
+        assert costs.estimate('bars', 1000) == 1
+        costs.record('bars', 100, 1)
+        assert costs.estimate('bars', 1000) == 10
+        costs.record('bars', 100, 2)
+        assert 10 < costs.estimate('bars', 1000) < 20
+
+
+class TestWithinBudget:
+    def candidates(self, release: threading.Event):
+        def slow():
+            release.wait(5)
+            return 'exact'
+        return (Candidate(('exact',), slow, 'slow', 10 ** 6),
+                Candidate(('coarse',), lambda: 'coarse', 'fast', 1))
+
+    def test_fits(self):
+        ledger = Ledger(trans, eras, 'test-deadline-fits')
+        exact = Candidate(('exact',), lambda: 'exact', 'fast', 1)
+        assert within_budget(ledger, exact, [], 1, CostModel(1e-3)) == ('exact', exact)
+
+    def test_coarser_then_exact(self):
+        ledger = Ledger(trans, eras, 'test-deadline-coarser')
+        release = threading.Event()
+        exact, coarse = self.candidates(release)
+        costs = CostModel(1e-3)
+        assert within_budget(ledger, exact, [coarse], 1, costs) == ('coarse', coarse)
+        # a poll, before and after the exact result is ready
+        assert within_budget(ledger, exact, [coarse], 0, costs) == ('coarse', coarse)
+        release.set()
+        for _ in range(100):
+            if ledger.ready(('exact',)):
+                break
+            time.sleep(0.01)
+        assert within_budget(ledger, exact, [coarse], 0, costs) == ('exact', exact)
+
+    def test_nothing_in_time(self):
+        ledger = Ledger(trans, eras, 'test-deadline-nothing')
+        release = threading.Event()
+        exact, coarse = self.candidates(release)
+        start = time.monotonic()
+        assert within_budget(ledger, exact, [], 0.1, CostModel(1e-3)) == (None, None)
+        assert time.monotonic() - start < 1
+        release.set()
+
+    def test_poll_after_failure(self):
+        ledger = Ledger(trans, eras, 'test-deadline-failure')
+        release = threading.Event()
+        calls = []
+
+        def fail():
+            calls.append(1)
+            release.wait(5)
+            raise ValueError('no data')
+        exact = Candidate(('exact',), fail, 'slow', 10 ** 6)
+        assert within_budget(ledger, exact, [], 0, CostModel(1e-3)) == (None, None)
+        release.set()
+        for _ in range(100):
+            if not ledger.computing(('exact',)):
+                break
+            time.sleep(0.01)
+        # a poll neither restarts the failed computation nor waits for it
+        assert within_budget(ledger, exact, [], 0, CostModel(1e-3), start=False) == (None, None)
+        assert calls == [1]
+
+
+class TestTimeSeriesStandIns:
+    def test_coarser_only_when_ready(self, monkeypatch):
+        from apps import cash_flow
+        ledger = Ledger(trans, eras, 'test-deadline-stand-ins')
+        monthly = [x['value'] for x in cash_flow.TIME_RES_OPTIONS if x['label'] == 'Month'][0]
+        coarser = cash_flow.coarser_resolutions(monthly)
+        stand_ins = []
+
+        def spy(ledger, exact, candidates, budget=None, cost_model=None, start=True):
+            stand_ins.extend(x.key for x in candidates)
+            return 'exact', exact
+        monkeypatch.setattr(cash_flow, 'within_budget', spy)
+        cash_flow.budgeted_time_series_base(ledger, monthly)
+        assert stand_ins == []
+        cash_flow.cached_time_series_base(ledger, coarser[0])
+        cash_flow.budgeted_time_series_base(ledger, monthly)
+        assert stand_ins == [('time_series_base', coarser[0])]
@@ -0,0 +1,86 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from _plotly_utils.utils import PlotlyJSONEncoder
+
+import figures
+import utils
+from backend import MemoryBackend
+
+
+trans = pd.DataFrame({
+    'date': pd.to_datetime(['2020-01-05', '2020-01-20', '2020-02-10', '2020-04-01', '2020-04-02', '2020-07-01']),
+    'description': ['a', 'b', 'c', 'd', 'e', 'f'],
+    'amount': [100, 50, 25, 10, 1000, 7],
+    'account': ['Food', 'Rent', 'Food', 'Food', 'Salary', 'Rent'],
+    'full account name': ['Expenses:Food', 'Expenses:Rent', 'Expenses:Food', 'Expenses:Food', 'Income:Salary',
+                          'Expenses:Rent']})
+eras = utils.load_eras(io.StringIO('name,date_start,date_end\nWinter,,2020-03-15\nSpring,2020-03-16,\n'),
+                       np.datetime64('2020-01-05'), np.datetime64('2020-07-01'))
+trans['era'] = utils.assign_eras(trans['date'].to_numpy(), eras)
+account_tree = utils.make_account_tree_from_trans(trans)
+source = MemoryBackend(trans)
+
+
+def encoded(figure) -> dict:
+    return json.loads(json.dumps(figure, cls=PlotlyJSONEncoder))
+
+
+def assert_validated(figure: dict):
+    """ Validating figure changes nothing, so it is what the go objects would have made """
+    assert encoded(figure) == encoded(go.Figure(figure))
+
+
+class TestFigures:
+
+    def test_merge(self):
+        base = {'margin': {'t': 10, 'b': 10}, 'height': 350}
+        assert figures.merge(base, {'margin': {'t': 40}, 'title': {'text': 'x'}}) == \
+            {'margin': {'t': 40, 'b': 10}, 'height': 350, 'title': {'text': 'x'}}
+        assert base == {'margin': {'t': 10, 'b': 10}, 'height': 350}
+
+    def test_chart_template(self):
+        updates = dict(xaxis={'showgrid': True, 'dtick': 'M3'}, title={'text': 'Assets'}, barmode='relative')
+        validated = go.Figure(layout=utils.chart_fig_layout).update_layout(**updates)
+        assert encoded(utils.chart_template(**updates)) == encoded(validated.to_plotly_json()['layout'])
+
+    def test_bars(self):
+        for time_resolution in utils.TIME_RES_LOOKUP:
+            traces = [utils.make_bar(source, account_tree, eras, account, i, time_resolution, True, deep=True)
+                      for i, account in enumerate(['Expenses', 'Income'])]
+            assert_validated(figures.figure(traces, utils.chart_template(barmode='relative')))
+        era_bars = utils.make_bar(source, account_tree, eras, 'Expenses', 0, 1, True, deep=True)
+        assert list(era_bars['customdata'])[0].startswith('Expenses<br>Winter')
+
+    def test_cum_area(self):
+        traces = [utils.make_cum_area(source, account, i, 4) for i, account in enumerate(['Food', 'Rent'])]
+        assert_validated(figures.figure(traces, utils.chart_template(showlegend=True)))
+
+    def test_sunburst_same_as_px(self):
+        totals = source.account_totals()
+        start, end = np.datetime64('2020-01-01'), np.datetime64('2020-12-31')
+        fast = utils.make_sunburst(totals, start, end, utils.SUBTOTAL_SUFFIX, True, level='Expenses')
+        assert_validated(fast)
+
+        scale = 12 / (pd.to_timedelta(end - start, unit='ms') / np.timedelta64(1, 'M'))
+        frame = utils.sunburst_frame(totals, scale, utils.SUBTOTAL_SUFFIX, level='Expenses')
+        validated = px.sunburst(frame, ids='id', names='name', parents='parent', values='value', height=600,
+                                branchvalues='total')
+        validated.update_traces(go.Sunburst({'marker': {'colorscale': 'Aggrnyl'}}),
+                                insidetextorientation='horizontal',
+                                maxdepth=utils.SUNBURST_DEPTH,
+                                level='Expenses',
+                                customdata=frame['folded'].tolist(),  # what each Other slice folds
+                                hovertemplate='%{label}<br>%{value:,.0f}',
+                                texttemplate='%{label}<br>%{value:,.0f}')
+        validated.update_layout(font=utils.big_font, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
+                                margin=dict(t=10, l=5, r=5, b=5))
+        assert encoded(fast) == encoded(validated)
+
+    def test_sankey(self):
+        flows = pd.DataFrame({'source': ['Salary', 'Salary'], 'target': ['Food', 'Rent'], 'amount': [100.4, 50]})
+        assert_validated(utils.make_sankey(flows, account_tree, '2020-01-01', '2020-12-31'))
@@ -0,0 +1,35 @@
+import pandas as pd
+
+from flows import FlowMatrix, pair_splits
+
+
+# double-entry signs: money leaves accounts with negative amounts
+splits = pd.DataFrame({
+    'transaction': [0, 0, 1, 1, 1, 2, 2],
+    'date': pd.to_datetime(['2020-01-05', '2020-01-05', '2020-01-31', '2020-01-31', '2020-01-31',
+                            '2020-03-02', '2020-03-02']),
+    'account': ['Food', 'Cash', 'Cash', 'Taxes', 'Salary', 'Rent', 'Cash'],
+    'amount': [25, -25, 1500, 500, -2000, 1000, -1000]})
+
+
+class TestFlows:
+    def test_pair_splits(self):
+        flows = pair_splits(splits)
+        assert list(flows.columns) == ['date', 'source', 'target', 'amount']
+        assert list(zip(flows['source'], flows['target'], flows['amount'])) == \
+            [('Cash', 'Food', 25), ('Salary', 'Cash', 1500), ('Salary', 'Taxes', 500), ('Cash', 'Rent', 1000)]
+
+    def test_ranges(self):
+        matrix = FlowMatrix(pair_splits(splits))
+        assert len(matrix.monthly) == 4
+
+        def flows(start=None, end=None):
+            result = matrix.flows(start, end)
+            return dict(zip(zip(result['source'], result['target']), result['amount']))
+        assert flows() == {('Salary', 'Cash'): 1500, ('Cash', 'Rent'): 1000, ('Salary', 'Taxes'): 500,
+                           ('Cash', 'Food'): 25}
+        assert flows('2020-01-01', '2020-01-31') == flows('2019-12-15', '2020-02-29') == \
+            {('Salary', 'Cash'): 1500, ('Salary', 'Taxes'): 500, ('Cash', 'Food'): 25}
+        assert flows('2020-01-06', '2020-03-02') == {('Salary', 'Cash'): 1500, ('Cash', 'Rent'): 1000,
+                                                     ('Salary', 'Taxes'): 500}
+        assert flows('2020-02-01', '2020-02-29') == {}
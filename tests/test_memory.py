@@ -0,0 +1,76 @@
+from collections import OrderedDict
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from dash.exceptions import PreventUpdate
+
+import ledger as ledger_module
+from ledger import Ledger, admit, dataset_id, ledger_from_json_store, ledgers, register_ledger
+from memory import MemoryBudgetError, deep_size
+
+
+def make_trans(n: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        'date': pd.date_range('2020-01-01', periods=n, freq='D'),
+        'description': [f'payee {i}' for i in range(n)],
+        'amount': np.arange(n),
+        'account': 'Food',
+        'full account name': 'Expenses:Food'})
+
+
+eras = pd.DataFrame(columns=['date_start', 'date_end'])
+
+
+class TestDeepSize:
+
+    def test_counts_strings(self):
+        trans = make_trans(1000)
+        assert deep_size(trans) > deep_size(trans[['date', 'amount']]) + 1000 * len('payee 999')
+
+    def test_shared_counted_once(self):
+        array = np.zeros(10_000)
+        seen: set = set()
+        assert deep_size({'a': array}, seen) > array.nbytes
+        assert deep_size([array, array[5:]], seen) < 1000
+
+
+class TestBudget:
+
+    @pytest.fixture(autouse=True)
+    def registry(self, monkeypatch):
+        monkeypatch.setattr(ledger_module, '_ledgers', OrderedDict())
+
+    def test_memory_and_evict(self):
+        ledger = Ledger(make_trans(1000), eras, 'test-memory-evict')
+        ledger.account_summary()
+        usage = ledger.memory()
+        assert usage['transactions'] >= deep_size(ledger.backend.trans)
+        assert "('account_summary',)" in usage
+        ledger.evict()
+        assert "('account_summary',)" not in ledger.memory()
+
+    def test_admit(self, monkeypatch):
+        old = register_ledger(Ledger(make_trans(5000), eras, 'test-memory-old'))
+        recent = register_ledger(Ledger(make_trans(5000), eras, 'test-memory-recent'))
+        old.account_summary()
+        size = sum(recent.memory().values())
+        monkeypatch.setattr(ledger_module, 'MEMORY_BUDGET', 3 * size)
+        admit(size)
+        assert ledgers() == [old, recent]
+        # the older ledger goes first, once evicting results isn't enough
+        admit(2 * size)
+        assert ledgers() == [recent]
+        with pytest.raises(MemoryBudgetError):
+            admit(4 * size)
+
+    def test_store_over_budget(self, monkeypatch):
+        trans = make_trans(1000)
+        data_store = json.dumps(dict(trans=trans.to_json(orient='split', date_format='%Y%m%d'),
+                                     eras=eras.to_json(orient='split', date_format='%Y%m%d'),
+                                     id=dataset_id('test-memory-store')))
+        monkeypatch.setattr(ledger_module, 'MEMORY_BUDGET', 1000)
+        with pytest.raises(PreventUpdate):
+            ledger_from_json_store(data_store)
+        assert ledgers() == []
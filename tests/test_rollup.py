@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import ledger as ledger_module
+import parallel
+import utils
+from backend import MemoryBackend
+from rollup import rollup
+
+
+def make_trans(n: int = 5000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    names = np.array(['Assets:Cash', 'Assets:Bank:Checking', 'Expenses:Food', 'Expenses:Food:Dining', 'Income:Salary'])
+    full_names = names[rng.integers(0, len(names), n)]
+    return pd.DataFrame({
+        'date': np.datetime64('2019-01-01') + rng.integers(0, 730, n).astype('timedelta64[D]'),
+        'description': 'x',
+        'amount': rng.integers(-500, 500, n),
+        'account': [x.rsplit(':', 1)[1] for x in full_names],
+        'full account name': full_names})
+
+
+trans = make_trans()
+account_tree = utils.make_account_tree_from_trans(trans)
+source = MemoryBackend(trans)
+
+
+class TestRollup:
+
+    @pytest.mark.parametrize('by,workers', [('subtree', 1), ('subtree', 2), ('time', 2)])
+    def test_same_as_serial(self, by, workers):
+        result = rollup(trans, by, workers)
+
+        expected_balances = np.empty(len(trans), dtype='int64')
+        for rows, dates, balances in source.running.values():
+            expected_balances[rows] = balances[1:]
+        assert (result.balances == expected_balances).all()
+
+        monthly = trans.groupby(['account', trans['date'].dt.to_period('M').dt.to_timestamp()])['amount'].\
+            agg(['sum', 'size'])
+        actual = result.monthly.set_index(['account', 'month']).sort_index()
+        assert (actual['amount'].to_numpy() == monthly['sum'].to_numpy()).all()
+        assert (actual['count'].to_numpy() == monthly['size'].to_numpy()).all()
+
+        totals = source.account_totals()
+        summary = result.summary(account_tree)
+        assert summary['subtotal'].equals(utils.subtree_totals(totals, account_tree)['subtotal'])
+        assert summary.loc['Food', 'subcount'] == (trans['full account name'].str.startswith('Expenses:Food')).sum()
+
+    @pytest.mark.parametrize('by,workers', [('subtree', 1), ('subtree', 2), ('time', 2)])
+    def test_backend_indexes(self, by, workers):
+        result = rollup(trans, by, workers)
+        monthly = result.monthly_index()
+        running = result.running_index(trans['date'].to_numpy())
+        assert monthly.keys() == source.monthly.keys() and running.keys() == source.running.keys()
+        for account, (months, sums) in source.monthly.items():
+            assert (monthly[account][0] == months).all() and (monthly[account][1] == sums).all()
+        for account, expected in source.running.items():
+            assert all((actual == x).all() for actual, x in zip(running[account], expected))
+
+        backend = MemoryBackend(trans)
+        backend.adopt(monthly, running)
+        assert backend.period_totals(None, 4).equals(source.period_totals(None, 4))
+        scoped, expected = backend.scoped(['Food', 'Salary']), source.scoped(['Food', 'Salary'])
+        assert all((actual == x).all() for actual, x in zip(scoped._running['Food'], expected.running['Food']))
+        assert scoped.balance(['Food', 'Salary'], '2019-06-30') == expected.balance(['Food', 'Salary'], '2019-06-30')
+
+    def test_bad_partition(self):
+        with pytest.raises(ValueError):
+            rollup(trans, 'account', 1)
+
+
+def test_ledger_adopts_rollup(monkeypatch):
+    monkeypatch.setattr(parallel, 'WORKERS', 2)
+    monkeypatch.setattr(ledger_module, 'ROLLUP_ROWS', 0)
+    ledger = ledger_module.Ledger(trans, pd.DataFrame(columns=['date_start', 'date_end']), 'test-rollup-ledger')
+    ledger.prepare()
+    assert ledger.backend._running.keys() == source.running.keys()
+    assert ledger.backend.period_totals(None, 4).equals(source.period_totals(None, 4))
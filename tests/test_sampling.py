@@ -0,0 +1,89 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+import utils
+from backend import MemoryBackend
+from sampling import SampledBackend, StratifiedSample
+
+
+def random_trans(n: int, seed: int = 1) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    accounts = np.array(['Food', 'Rent', 'Salary'])
+    account = accounts[rng.integers(0, 3, n)]
+    return pd.DataFrame({
+        'date': np.datetime64('2020-01-01') + rng.integers(0, 365, n).astype('timedelta64[D]'),
+        'description': 'x',
+        'amount': rng.gamma(2, 50, n).round(2),
+        'account': account,
+        'full account name': np.char.add(np.where(account == 'Salary', 'Income:', 'Expenses:'), account)})
+
+
+trans = random_trans(20000)
+eras = utils.load_eras(io.StringIO('name,date_start,date_end\nH1,,2020-06-15\nH2,2020-06-16,\n'),
+                       np.datetime64('2020-01-01'), np.datetime64('2020-12-31'))
+source = MemoryBackend(trans)
+
+
+class TestStratifiedSample:
+
+    def test_whole_population_is_exact(self):
+        small = trans.iloc[:50]
+        sample = StratifiedSample(small, len(small))
+        assert len(sample) == len(small)
+        sampled = SampledBackend(MemoryBackend(small), ['Food', 'Rent'], sample)
+        exact = MemoryBackend(small).period_totals(['Food', 'Rent'], 4)
+        pd.testing.assert_series_equal(sampled.period_totals(None, 4), exact, check_names=False)
+        assert (sampled.period_variances(None, 4) == 0).all()
+
+    def test_every_stratum_sampled(self):
+        sample = StratifiedSample(trans, 1000)
+        assert 1000 <= len(sample) < 1200
+        assert (sample.sizes >= np.minimum(sample.population, 2)).all()
+        assert sample.sizes.sum() == len(sample)
+
+    def test_totals_within_margins(self):
+        sample = StratifiedSample(trans, 2000)
+        sampled = SampledBackend(source, ['Food', 'Rent', 'Salary'], sample)
+        exact = source.period_totals(['Food', 'Rent', 'Salary'], 4)
+        estimates = sampled.period_totals(None, 4)
+        margins = 4 * np.sqrt(sampled.period_variances(None, 4))  # so the test hardly ever fails by chance
+        assert list(estimates.index) == list(exact.index)
+        assert ((estimates - exact).abs() <= margins).all()
+
+        totals = sampled.account_totals(None, '2020-02-01', '2020-08-31').set_index('full account name')
+        exact_totals = source.account_totals(None, '2020-02-01', '2020-08-31').set_index('full account name')
+        error = (totals['amount'] - exact_totals['amount'].reindex(totals.index)).abs()
+        assert (error <= 4 * np.sqrt(totals['variance'])).all()
+        exact_counts = exact_totals['count'].reindex(totals.index)
+        assert ((totals['count'] - exact_counts).abs() < 0.05 * exact_counts).all()
+
+    def test_era_totals(self):
+        sampled = SampledBackend(source, ['Food'], StratifiedSample(trans, 2000))
+        exact = source.era_totals(['Food'], eras)
+        estimates = sampled.era_totals(None, eras)
+        assert list(estimates.index) == list(exact.index)
+        assert ((estimates['value'] - exact['value']).abs() <= 4 * np.sqrt(estimates['variance'])).all()
+
+    def test_sunburst_variance(self):
+        totals = SampledBackend(source, ['Food', 'Rent', 'Salary'], StratifiedSample(trans, 2000)).account_totals()
+        frame = utils.sunburst_frame(totals, 2, utils.SUBTOTAL_SUFFIX)
+        expenses = frame.set_index('id').loc['Expenses', 'variance']
+        parts = totals[totals['full account name'].str.startswith('Expenses')]['variance'].sum()
+        assert np.isclose(expenses, parts * 4)
+        assert 'variance' not in utils.sunburst_frame(source.account_totals(), 2, utils.SUBTOTAL_SUFFIX).columns
+
+    def test_bar_estimates_once(self, monkeypatch):
+        sample = StratifiedSample(trans, 2000)
+        sampled = SampledBackend(source, ['Food', 'Rent', 'Salary'], sample)
+        calls = []
+        estimate = sample.period_estimates
+        monkeypatch.setattr(sample, 'period_estimates', lambda *args: calls.append(args) or estimate(*args))
+        totals, variances = sampled.period_estimates(None, 4)
+        pd.testing.assert_series_equal(totals, sampled.period_totals(None, 4))
+        calls.clear()
+        tree = utils.make_account_tree_from_trans(trans)
+        trace = utils.make_bar(sampled, tree, pd.DataFrame(), 'Food', 0, 4)
+        assert len(calls) == 1 and 'hovertext' in trace
+        assert source.period_estimates(['Food'], 4)[1] is None
@@ -0,0 +1,35 @@
+import pandas as pd
+
+import search
+
+
+descriptions = pd.Series(['McDonalds/Visa rent',
+                          'Paycheck ACME Corp',
+                          None,
+                          'mcdonalds lunch',
+                          'Rent for June'])
+
+
+class TestSearchIndex:
+    index = search.SearchIndex(descriptions)
+
+    def test_token(self):
+        assert (list(self.index.search('rent')) == [0, 4])
+
+    def test_case_insensitive(self):
+        assert (list(self.index.search('MCDONALDS')) == [0, 3])
+
+    def test_substring(self):
+        assert (list(self.index.search('donald')) == [0, 3])
+
+    def test_short_prefix(self):
+        assert (list(self.index.search('pa')) == [1])
+
+    def test_all_terms(self):
+        assert (list(self.index.search('mcdonalds rent')) == [0])
+
+    def test_no_match(self):
+        assert (len(self.index.search('zebra')) == 0)
+
+    def test_empty_query(self):
+        assert (len(self.index.search('')) == len(descriptions))
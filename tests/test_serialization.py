@@ -0,0 +1,34 @@
+import json
+
+import numpy as np
+import plotly.graph_objects as go
+from _plotly_utils.utils import PlotlyJSONEncoder
+
+import serialization
+
+
+class TestNegotiateEncoding:
+
+    def test_prefers_brotli(self):
+        assert (serialization.negotiate_encoding('gzip, deflate, br') == 'br')
+
+    def test_gzip(self):
+        assert (serialization.negotiate_encoding('gzip, deflate') == 'gzip')
+
+    def test_refused(self):
+        assert (serialization.negotiate_encoding('gzip;q=0, br;q=0') is None)
+
+    def test_none(self):
+        assert (serialization.negotiate_encoding('') is None)
+
+
+class TestFastEncoder:
+
+    def test_same_as_plotly(self):
+        figure = go.Figure(go.Bar(x=np.array(['2020-01-01', '2020-02-01'], dtype='datetime64[ns]'),
+                                  y=np.array([1.5, np.nan]),
+                                  customdata=np.array(['a', 'b'], dtype=object)))
+        response = {'response': {'graph': {'figure': figure}}, 'multi': True}
+        fast = json.dumps(response, cls=serialization.FastPlotlyJSONEncoder)
+        standard = json.dumps(response, cls=PlotlyJSONEncoder)
+        assert (json.loads(fast) == json.loads(standard))
@@ -0,0 +1,55 @@
+import json
+
+import pandas as pd
+import pytest
+
+from ledger import Ledger
+import snapshot
+
+
+trans = pd.DataFrame({
+    'date': pd.to_datetime(['2020-01-05', '2020-01-20', '2020-02-10']),
+    'description': ['a', 'b', 'c'],
+    'amount': [100, 50, 25],
+    'account': ['Food', 'Rent', 'Food'],
+    'full account name': ['Expenses:Food', 'Expenses:Rent', 'Expenses:Food'],
+    'era': [0, 0, 0]})
+eras = pd.DataFrame(columns=['date_start', 'date_end'])
+sources = ['transactions.csv', 'eras.csv']
+response = {'data_store': json.dumps({'trans': '', 'eras': '', 'id': 'snapshot-test'}),
+            'meta_info': ['Data loaded: 3 records'], 'tree_records': [], 'records': []}
+
+
+@pytest.fixture
+def saved(tmp_path):
+    ledger = Ledger(trans, eras, 'snapshot-test')
+    ledger.cached('total', lambda: int(trans['amount'].sum()))
+    ledger.cached('unpicklable', lambda: lambda: None)
+    snapshot.save(ledger, sources, response, str(tmp_path))
+    return tmp_path
+
+
+class TestSnapshot:
+    def test_round_trip(self, saved):
+        manifest, ledger, restored_response = snapshot.read(str(saved))
+        assert manifest['sources'] == sources
+        assert restored_response == response
+        pd.testing.assert_frame_equal(ledger.backend.trans, trans)
+        assert ledger.account_tree.contains('Food')
+        assert ledger.warm_views() == ['total']
+        assert ledger.cached('total', lambda: 0) == 175
+        assert snapshot.response_for(sources) == response
+        assert snapshot.response_for(['other.csv', 'eras.csv']) is None
+
+    def test_replaces_previous(self, saved):
+        snapshot.save(Ledger(trans, eras, 'snapshot-test-2'), sources, response, str(saved))
+        assert len([x for x in saved.iterdir() if x.is_dir()]) == 1
+        assert snapshot.read(str(saved))[1].id == 'snapshot-test-2'
+
+    def test_other_version_rejected(self, saved):
+        manifest = json.loads((saved / snapshot.MANIFEST).read_text())
+        manifest['version'] = snapshot.SNAPSHOT_VERSION + 1
+        (saved / snapshot.MANIFEST).write_text(json.dumps(manifest))
+        with pytest.raises(snapshot.SnapshotError):
+            snapshot.read(str(saved))
+        assert snapshot.restore(str(saved)) is None
@@ -1,6 +1,10 @@
+import io
+import numpy as np
+import pandas as pd
+import pytest
 from treelib import Tree
 
-from ledger_explorer import utils
+import utils
 
 
 skinny_tree: Tree = Tree()
@@ -36,3 +40,108 @@ class TestTrim:
     def test_root(self):
         id = self.short_tree.root
         assert (id == 'tt')
+
+
+def make_eras(rows) -> pd.DataFrame:
+    source = io.StringIO('name,date_start,date_end\n' + '\n'.join(rows))
+    return utils.load_eras(source, np.datetime64('2000-01-01'), np.datetime64('2000-12-31'))
+
+
+class TestEras:
+    # Out of order, with a gap, an overlap and open ends
+    eras: pd.DataFrame = make_eras(['Summer,2000-06-01,2000-08-31',
+                                    'Spring,,2000-05-31',
+                                    'Late Summer,2000-08-15,2000-08-31',
+                                    'Fall,2000-10-01,'])
+
+    def test_sorted_by_start(self):
+        assert (list(self.eras.index) == ['Spring', 'Summer', 'Late Summer', 'Fall'])
+
+    def test_open_ends_filled(self):
+        assert (self.eras['date_start'].iloc[0] == pd.Timestamp('2000-01-01'))
+        assert (self.eras['date_end'].iloc[-1] == pd.Timestamp('2000-12-31'))
+
+    def test_overlap_clipped(self):
+        assert (self.eras.loc['Summer', 'date_end'] == pd.Timestamp('2000-08-14'))
+
+    def test_assign(self):
+        dates = np.array(['2000-01-01', '2000-05-31', '2000-06-01', '2000-08-20', '2000-09-15', '2000-12-31'],
+                         dtype='datetime64[ns]')
+        assert (list(utils.assign_eras(dates, self.eras)) == [0, 0, 1, 2, utils.NO_ERA, 3])
+
+    def test_era_at(self):
+        assert (utils.era_at(self.eras, '2000-07-04') == 1)
+        assert (utils.era_at(self.eras, '2000-09-15') == utils.NO_ERA)
+
+    def test_no_eras(self):
+        dates = np.array(['2000-01-01'], dtype='datetime64[ns]')
+        assert (list(utils.assign_eras(dates, pd.DataFrame())) == [utils.NO_ERA])
+
+
+class TestMultiSourceLoad:
+    header = 'Date,Transaction ID,Description,Notes,Memo,Full Account Name,Account Name,Amount Num.\n'
+    jan = ('01/05/2020,t1,Groceries,,,Expenses:Food,Food,25.00\n'
+           ',,,,,Assets:Cash,Cash,-25.00\n')
+    feb = ('02/01/2020,t2,Rent,,,Expenses:Rent,Rent,"1,000.00"\n'
+           ',,,,,Assets:Cash,Cash,"-1,000.00"\n')
+
+    def test_sources(self, tmp_path):
+        for name in ['b.csv', 'a.csv', 'c.txt']:
+            (tmp_path / name).write_text(self.header)
+        sources = utils.transaction_sources(f'{tmp_path}/*.csv, http://localhost/x.csv')
+        assert sources == [str(tmp_path / 'a.csv'), str(tmp_path / 'b.csv'), 'http://localhost/x.csv']
+
+    def test_sources_from_browser(self, tmp_path):
+        data = tmp_path / 'data'
+        data.mkdir()
+        (data / 'a.csv').write_text(self.header)
+        (tmp_path / 'secret.csv').write_text(self.header)
+        assert utils.transaction_sources('*.csv', root=str(data)) == [str(data / 'a.csv')]
+        for source in ['../*.csv', f'{tmp_path}/secret.csv', 'file://' + str(tmp_path / 'secret.csv')]:
+            with pytest.raises(PermissionError):
+                utils.transaction_sources(source, root=str(data))
+        with pytest.raises(PermissionError):
+            utils.transaction_sources(f'http://localhost/x.csv, {data}/a.csv', files=False)
+
+    def test_overlap_counted_once(self):
+        first = utils.read_transactions(io.StringIO(self.header + self.jan + self.feb))
+        second = utils.read_transactions(io.StringIO(self.header + self.feb))
+        trans = utils.merge_transactions([second, first])
+        assert list(trans.columns) == ['date', 'description', 'amount', 'account', 'full account name', 'transaction']
+        assert list(trans['amount']) == [25, -25, 1000, -1000]
+        assert list(trans['transaction']) == [0, 0, 1, 1]
+        assert list(trans['account']) == ['Food', 'Cash', 'Rent', 'Cash']
+
+
+class TestSunburstFrame:
+    totals = pd.DataFrame({
+        'full account name': [f'Expenses:Food:Shop {i}' for i in range(10)] + ['Expenses:Food', 'Expenses:Rent'],
+        'account': [f'Shop {i}' for i in range(10)] + ['Food', 'Rent'],
+        'amount': list(range(1, 11)) + [5, 100]})
+
+    def frame(self, **kwargs):
+        return utils.sunburst_frame(self.totals, 1, **kwargs).set_index('id')
+
+    def test_unbounded(self):
+        frame = self.frame(max_slices=100)
+        assert frame.loc['Expenses', 'value'] == 160
+        assert frame.loc['Food', 'name'] == 'Food [Subtotal]'
+        assert frame.loc['Food' + utils.LEAF_SUFFIX, 'value'] == 5
+        assert frame['depth'].max() == 2
+
+    def test_other(self):
+        frame = self.frame(max_slices=4)
+        children = frame[frame['parent'] == 'Food']
+        assert set(children.index) == {'Shop 9', 'Shop 8', 'Shop 7', 'Food' + utils.OTHER_SUFFIX}
+        assert children['value'].sum() == frame.loc['Food', 'value'] == 60
+        assert frame.loc['Food' + utils.OTHER_SUFFIX, 'name'] == 'Other Food'
+        assert sorted(frame.loc['Food' + utils.OTHER_SUFFIX, 'folded']) == \
+            ['Food' + utils.LEAF_SUFFIX] + [f'Shop {i}' for i in range(7)]
+        assert frame.loc['Shop 9', 'folded'] is None
+
+    def test_depth_window(self):
+        assert set(self.frame(depth=1).index) == {'Expenses', 'Food', 'Rent'}
+        # zoomed to an account that would be folded: its path and their siblings stay
+        frame = self.frame(max_slices=4, depth=1, level='Shop 0')
+        assert 'Shop 0' in frame.index and 'Rent' in frame.index
+        assert len(frame[frame['parent'] == 'Food']) == 4